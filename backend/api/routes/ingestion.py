@@ -1,41 +1,141 @@
+import json
+import logging
+
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from typing import List
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+
+from services.document_filters import normalize_entities
+from services.engine_registry import DEFAULT_CONNECTION_ID
+from services.ingestion_jobs import IngestionJobManager
+from services.query_cache import DOCUMENTS_TAG
 
-from services.schema_discovery import SchemaDiscovery
+from api.routes.query import doc_processor, engines, query_cache
 
-from api.routes.query import qe
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Background ingestion pipeline feeding the shared document processor; cached
+# answers that include document matches are dropped once new chunks are indexed
+ingestion_jobs = IngestionJobManager(
+    doc_processor, on_indexed=lambda: query_cache.invalidate_tables([DOCUMENTS_TAG])
+)
+
+def _parse_entities(entities: Optional[str]):
+    """Entity keys of an upload: a JSON object such as {"emp_id": 42}."""
+    if not entities:
+        return None
+    try:
+        return normalize_entities(json.loads(entities))
+    except ValueError as e:  # json.JSONDecodeError is a ValueError
+        raise HTTPException(status_code=400, detail=f"Invalid entities: {e}")
+
 @router.post("/connect-database")
-async def connect_database(connection_string: str = Form(...)):
+async def connect_database(connection_string: str = Form(...), connection_id: Optional[str] = Form(None)):
     """
     Connects to a database using the provided connection string and
-    discovers its schema.
+    discovers its schema. Several databases can be connected at once under
+    different ``connection_id`` values (default: "default"); reconnecting an id
+    replaces its database.
     """
-    print(f"Connecting to DB with connection string: {connection_string}")
-    qe.connect_db(connection_string=connection_string)  # <-- set schema and DB engine
+    logger.info("Connecting database '%s'", connection_id or DEFAULT_CONNECTION_ID)
+    try:
+        # Discovery can take a while on large catalogs; keep it off the event loop
+        connection_id, qe = await run_in_threadpool(engines.connect, connection_string, connection_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    discovery_service = SchemaDiscovery()
-    schema = discovery_service.analyze_database(connection_string)
-    
+    schema = qe.schema
     if "error" in schema:
         raise HTTPException(status_code=400, detail=schema["error"])
         
-    return {"message": "Database schema discovered successfully", "schema": schema}
+    return {"message": "Database schema discovered successfully", "connection_id": connection_id, "schema": schema}
 
-@router.post("/upload-documents")
-async def upload_documents(files: List[UploadFile] = File(...)):
+@router.post("/upload-documents", status_code=202)
+async def upload_documents(files: List[UploadFile] = File(...), entities: Optional[str] = Form(None)):
+    """
+    Queues the uploaded files for background ingestion and returns a job id.
+    Poll /ingestion/jobs/{job_id} for progress. ``entities`` (JSON object,
+    e.g. {"emp_id": 42}) tags every chunk of the uploaded files for filtered
+    search.
+    """
     if not files:
         raise HTTPException(status_code=400, detail="No files were uploaded.")
+    if doc_processor.read_only:
+        raise HTTPException(status_code=403, detail="This worker serves a read-only document store.")
 
+    file_entities = _parse_entities(entities)
     file_contents = []
     for file in files:
         content = await file.read()
-        file_contents.append({"filename": file.filename, "content": content})
+        file_contents.append({"filename": file.filename, "content": content, "entities": file_entities})
+
+    job = ingestion_jobs.submit(file_contents)
+    return {
+        "status": "accepted",
+        "job_id": job["job_id"],
+        "status_url": f"/api/ingestion/jobs/{job['job_id']}",
+        "files_total": job["files_total"],
+    }
+
+@router.get("/documents")
+async def list_documents():
+    """Indexed files with their live chunk counts and content hashes."""
+    return {"documents": await run_in_threadpool(doc_processor.list_documents)}
 
-    # Call the process_documents method on the processor inside our shared qe instance
-    result = qe.doc_processor.process_documents(file_contents)
-    
-    print("Vector index total after upload:", qe.doc_processor.vector_index.ntotal)
-    return result
\ No newline at end of file
+@router.put("/documents/{filename:path}", status_code=202)
+async def replace_document(filename: str, file: UploadFile = File(...), entities: Optional[str] = Form(None)):
+    """
+    Replaces the indexed version of ``filename`` with the uploaded content in a
+    background job. Only chunks that changed are embedded again; an identical
+    file is left untouched. ``entities`` replaces the file's entity keys
+    (omitted: kept).
+    """
+    if doc_processor.read_only:
+        raise HTTPException(status_code=403, detail="This worker serves a read-only document store.")
+    file_entities = _parse_entities(entities)
+    content = await file.read()
+    job = ingestion_jobs.submit([{"filename": filename, "content": content, "entities": file_entities}])
+    return {
+        "status": "accepted",
+        "job_id": job["job_id"],
+        "status_url": f"/api/ingestion/jobs/{job['job_id']}",
+        "files_total": job["files_total"],
+    }
+
+@router.delete("/documents/{filename:path}")
+async def delete_document(filename: str):
+    """
+    Removes every chunk of ``filename`` from the index and saves the store.
+    """
+    if doc_processor.read_only:
+        raise HTTPException(status_code=403, detail="This worker serves a read-only document store.")
+
+    def delete_and_persist() -> int:
+        removed = doc_processor.delete_document(filename)
+        if removed:
+            doc_processor.persist()
+        return removed
+
+    removed = await run_in_threadpool(delete_and_persist)
+    if not removed:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    query_cache.invalidate_tables([DOCUMENTS_TAG])
+    return {"status": "deleted", "filename": filename, "chunks_removed": removed,
+            "total_chunks_indexed": doc_processor.vector_index.live_count}
+
+@router.get("/ingestion/jobs")
+async def list_ingestion_jobs(limit: int = 20):
+    return {"jobs": ingestion_jobs.list_jobs(limit)}
+
+@router.get("/ingestion/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """
+    Reports per-file progress, throughput and errors of an ingestion job.
+    """
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found.")
+    job["total_chunks_indexed"] = doc_processor.vector_index.live_count
+    return job
@@ -0,0 +1,63 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from services.document_processor import query_embedder
+from services.embeddings import embedder
+from services.metrics import CONTENT_TYPE, registry
+from services.query_engine import in_flight_queries, query_cache, semantic_sql_cache
+
+from api.routes.ingestion import ingestion_jobs
+from api.routes.query import doc_processor, engines
+
+router = APIRouter()
+
+
+def _ratio(stats: dict, hits: str = "hits", misses: str = "misses") -> float:
+    lookups = stats[hits] + stats[misses]
+    return stats[hits] / lookups if lookups else 0.0
+
+
+# Read from the live objects at scrape time
+registry.callback("nlq_query_cache_hit_ratio", "Response cache hits / lookups in this worker.",
+                  lambda: _ratio(query_cache.stats()))
+registry.callback("nlq_query_cache_entries", "Cached responses (memory and sqlite backends).",
+                  lambda: query_cache.stats().get("entries"))
+registry.callback("nlq_query_cache_bytes", "Serialized size of the cached responses.",
+                  lambda: query_cache.stats().get("bytes"))
+registry.callback("nlq_semantic_cache_hit_ratio", "Semantic NL-to-SQL cache hits / lookups.",
+                  lambda: _ratio(semantic_sql_cache.stats()))
+registry.callback("nlq_coalesced_queries_total", "Requests that waited on an identical in-flight question.",
+                  lambda: in_flight_queries.stats()["coalesced"], kind="counter")
+registry.callback("nlq_vector_index_vectors", "Vectors in the document index.",
+                  lambda: doc_processor.vector_index.live_count)
+registry.callback("nlq_chunk_store_bytes", "Memory and mapped bytes of the chunk store.",
+                  lambda: doc_processor.chunk_store.nbytes())
+
+
+def _sql_stat(key: str) -> dict:
+    return {(cid,): qe.sql_executor.stats()[key] for cid, qe in engines.engines().items() if qe.sql_executor}
+
+
+registry.callback("nlq_connected_databases", "Databases connected through the engine registry.",
+                  lambda: len(engines.engines()))
+registry.callback("nlq_sql_in_flight", "SQL statements currently running.",
+                  lambda: _sql_stat("in_flight"), labels=("connection_id",))
+registry.callback("nlq_sql_timeouts_total", "SQL statements cancelled for exceeding the timeout.",
+                  lambda: _sql_stat("timeouts"), labels=("connection_id",), kind="counter")
+registry.callback("nlq_sql_rejected_total", "SQL statements rejected because every slot was busy.",
+                  lambda: _sql_stat("rejected"), labels=("connection_id",), kind="counter")
+registry.callback("nlq_embedding_model_loaded", "1 once the embedding model has been loaded.",
+                  lambda: float(embedder.loaded))
+registry.callback("nlq_embedding_batch_size_avg", "Average number of questions per embedding batch.",
+                  lambda: query_embedder.metrics()["batch_size_avg"])
+registry.callback("nlq_ingestion_jobs_active", "Ingestion jobs queued or running.",
+                  lambda: ingestion_jobs.active_jobs)
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    """
+    Prometheus scrape endpoint (this worker's counters). A plain function, so
+    FastAPI runs it in the threadpool: the sqlite / Redis cache stats block.
+    """
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
@@ -1,20 +1,129 @@
 # backend/routes/query.py
+import json
+import weakref
+from contextlib import contextmanager
+from urllib.parse import quote
+
 from fastapi import APIRouter, HTTPException, Form
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional
 
-from services.query_engine import QueryEngine
+from services.query_engine import QueryEngine, in_flight_queries, query_cache, semantic_sql_cache, warm_up
+from services.document_processor import DocumentProcessor, query_embedder
+from services.engine_registry import EngineRegistry
+from services.document_filters import normalize_filters
+from services.embeddings import embedder
+from services.pagination import InvalidCursor
+from services.result_format import check_result_format, json_default
 
 router = APIRouter()
 
-# Create a single engine instance (could be injected)
-# For demo, you can pass None and call engine.connect_db later via /connect-database route
-qe = QueryEngine()
+# One document processor shared by every connected database; each database gets
+# its own QueryEngine (pool, schema, cache namespace) via /connect-database
+doc_processor = DocumentProcessor()
+engines = EngineRegistry(doc_processor)
 
 class QueryRequest(BaseModel):
     query: str
     top_k_docs: Optional[int] = 5
     schema_hash: Optional[str] = ""
+    nprobe: Optional[int] = None      # IVF indexes: inverted lists probed per query
+    ef_search: Optional[int] = None   # HNSW index: candidate list size per query
+    result_format: Optional[str] = "rows"  # "rows" | "columns" | "arrow" (base64 Arrow IPC stream)
+    connection_id: Optional[str] = None    # database to query (default: "default")
+    # Document search scope, e.g. {"doc_type": ["pdf"], "uploaded_after": "2024-01-01", "entities": {"emp_id": [7]}}
+    document_filters: Optional[Dict[str, Any]] = None
+
+
+class StreamRequest(BaseModel):
+    query: str
+    format: Optional[str] = "ndjson"     # "ndjson": one row object per line; "json": chunked columns + row arrays
+    batch_size: Optional[int] = None
+    connection_id: Optional[str] = None
+
+
+class PageRequest(BaseModel):
+    query: Optional[str] = None          # first page: natural language or SQL
+    cursor: Optional[str] = None         # later pages: next_cursor of the previous page
+    page_size: Optional[int] = None      # default 100; later pages reuse the cursor's size
+    key_columns: Optional[List[str]] = None  # unique sort key for keyset pagination
+    result_format: Optional[str] = "rows"
+    connection_id: Optional[str] = None
+
+
+def _acquire(connection_id: Optional[str]) -> QueryEngine:
+    """The connected engine, held open until ``engines.release``."""
+    qe = engines.acquire(connection_id)
+    if qe is not None and (not qe.schema or "tables" not in qe.schema):
+        engines.release(qe)
+        qe = None
+    if qe is None:
+        raise HTTPException(status_code=400, detail="Database not connected. Call /connect-database first.")
+    return qe
+
+
+@contextmanager
+def _engine(connection_id: Optional[str]):
+    """The connected engine, held open (not evicted) for the block."""
+    qe = _acquire(connection_id)
+    try:
+        yield qe
+    finally:
+        engines.release(qe)
+
+
+def _holding(stream: Iterator[str], qe: QueryEngine) -> Iterator[str]:
+    """``stream``, keeping ``qe`` held until it ends, is closed or is discarded unstarted."""
+    def chunks():
+        try:
+            yield from stream
+        finally:
+            release()
+
+    wrapped = chunks()
+    release = weakref.finalize(wrapped, engines.release, qe)  # runs once, whichever comes first
+    return wrapped
+
+
+def _require_result_format(result_format: Optional[str]) -> str:
+    result_format = result_format or "rows"
+    try:
+        check_result_format(result_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return result_format
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, default=json_default)
+
+
+def _ndjson_stream(batches):
+    try:
+        for columns, rows in batches:
+            for row in rows:
+                yield _dumps(dict(zip(columns, row))) + "\n"
+    except Exception as e:
+        yield _dumps({"error": f"Stream aborted: {e}"}) + "\n"
+
+
+def _json_stream(sql: str, batches):
+    yield '{"sql": ' + _dumps(sql)
+    started_rows = False
+    try:
+        for columns, rows in batches:
+            if not started_rows:
+                yield ', "columns": ' + _dumps(columns) + ', "rows": ['
+                started_rows = True
+                first = True
+            for row in rows:
+                yield ("" if first else ",") + _dumps(list(row))
+                first = False
+        yield "]}" if started_rows else "}"
+    except Exception as e:
+        yield ("], " if started_rows else ", ") + '"error": ' + _dumps(f"Stream aborted: {e}") + "}"
 
 
 @router.post("/query")
@@ -25,15 +134,157 @@ async def process_query(body: QueryRequest):
     if not body.query or not body.query.strip():
         raise HTTPException(status_code=400, detail="Query must be provided.")
 
-    if not qe.schema or "tables" not in qe.schema:
-        raise HTTPException(status_code=400, detail="Database not connected. Call /connect-database first.")
+    with _engine(body.connection_id) as qe:
+        result_format = _require_result_format(body.result_format)
+        try:
+            document_filters = normalize_filters(body.document_filters)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # process_query blocks (LLM, DB, embedding); run it off the event loop so
+        # concurrent requests overlap and their query embeddings can be batched
+        result = await run_in_threadpool(
+            qe.process_query,
+            body.query,
+            top_k_docs=body.top_k_docs,
+            schema_hash=body.schema_hash or "",
+            nprobe=body.nprobe,
+            ef_search=body.ef_search,
+            result_format=result_format,
+            document_filters=document_filters,
+        )
+    return result
+
+
+@router.post("/query/stream")
+async def stream_query(body: StreamRequest):
+    """
+    Streams the full SQL result (no LIMIT) from a server-side cursor as NDJSON
+    or chunked JSON. The generated SQL is in the X-Generated-SQL header
+    (URL-encoded). Errors after the stream has started arrive as a final
+    ``{"error": ...}`` record.
+    """
+    if not body.query or not body.query.strip():
+        raise HTTPException(status_code=400, detail="Query must be provided.")
+    if body.format not in ("ndjson", "json"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'json'.")
+    # Held past this handler: the rows are read while the response body is sent
+    qe = _acquire(body.connection_id)
+    try:
+        sql, error = await run_in_threadpool(qe.prepare_sql, body.query)
+        if error:
+            raise HTTPException(status_code=400, detail=error)
+        batches = qe.stream_sql(sql, batch_size=body.batch_size) if body.batch_size else qe.stream_sql(sql)
+    except BaseException:
+        engines.release(qe)
+        raise
+
+    headers = {"X-Generated-SQL": quote(" ".join(sql.split()))}
+    if body.format == "ndjson":
+        return StreamingResponse(_holding(_ndjson_stream(batches), qe),
+                                 media_type="application/x-ndjson", headers=headers)
+    return StreamingResponse(_holding(_json_stream(sql, batches), qe), media_type="application/json", headers=headers)
+
+
+@router.post("/query/page")
+async def page_query(body: PageRequest):
+    """
+    One page of a query's result with an opaque continuation token. Send the
+    question first, then only ``cursor`` for each following page.
+    """
+    with _engine(body.connection_id) as qe:
+        result_format = _require_result_format(body.result_format)
+        if not body.cursor and not (body.query and body.query.strip()):
+            raise HTTPException(status_code=400, detail="Provide a query or a cursor.")
 
-    result = qe.process_query(body.query, top_k_docs=body.top_k_docs, schema_hash=body.schema_hash or "")
+        sql = None
+        if not body.cursor:
+            sql, error = await run_in_threadpool(qe.prepare_sql, body.query)
+            if error:
+                raise HTTPException(status_code=400, detail=error)
+        try:
+            result = await run_in_threadpool(
+                qe.fetch_page, sql, page_size=body.page_size,
+                key_columns=body.key_columns, cursor=body.cursor, result_format=result_format,
+            )
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if "error" in result:
+            raise HTTPException(status_code=400, detail=result["error"])
     return result
 
 
 @router.get("/query/history")
-async def query_history(limit: int = 50):
-    return {"history": qe.get_history(limit)}
+async def query_history(limit: int = 50, connection_id: Optional[str] = None):
+    history = query_cache.history(limit if connection_id is None else 10 ** 6)
+    if connection_id is not None:
+        history = [h for h in history if h.get("connection_id") == connection_id][:limit]
+    return {"history": history}
+
+
+@router.get("/query/cache-stats")
+async def cache_stats():
+    return {
+        "query_cache": query_cache.stats(),
+        "semantic_sql_cache": semantic_sql_cache.stats(),
+        "single_flight": in_flight_queries.stats(),
+    }
+
+
+class CacheInvalidationRequest(BaseModel):
+    tables: Optional[List[str]] = None   # drop cached answers that read these tables
+    all: Optional[bool] = False          # drop every cached answer
+    connection_id: Optional[str] = None  # only this database's answers (default: every connection)
+
+
+@router.post("/query/cache/invalidate")
+async def invalidate_cache(body: CacheInvalidationRequest):
+    """
+    Hook for ETL jobs and other writers: evicts the cached answers that depend
+    on the tables they just changed.
+    """
+    if body.all:
+        await run_in_threadpool(query_cache.clear)
+        return {"invalidated": "all"}
+    if not body.tables:
+        raise HTTPException(status_code=400, detail="Provide tables or all=true.")
+    removed = await run_in_threadpool(engines.invalidate_tables, body.tables, body.connection_id)
+    return {"invalidated": removed}
+
+
+@router.get("/query/embedding-stats")
+async def embedding_stats():
+    """Queue wait and batch size statistics of the query embedding batcher."""
+    return query_embedder.metrics()
+
+
+@router.get("/warmup")
+async def warmup_status():
+    """Whether the embedding model is loaded yet (usable as a readiness check)."""
+    return embedder.status()
+
+
+@router.post("/warmup")
+async def warmup():
+    """
+    Loads the embedding model and creates the LLM client now instead of on the
+    first query. Safe to call repeatedly.
+    """
+    try:
+        return await run_in_threadpool(warm_up)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/connections")
+async def list_connections():
+    """Connected databases with their dialect, table count and idle time."""
+    return {"connections": engines.list()}
 
 
+@router.delete("/connections/{connection_id}")
+async def close_connection(connection_id: str):
+    """Closes a database connection and its pool."""
+    if not await run_in_threadpool(engines.remove, connection_id):
+        raise HTTPException(status_code=404, detail="Connection not found.")
+    return {"status": "closed", "connection_id": connection_id}
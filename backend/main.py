@@ -1,12 +1,23 @@
-from fastapi import FastAPI
+import logging
+import os
+import time
+
+from fastapi import FastAPI, Request
+from starlette.concurrency import run_in_threadpool
 from api.routes import ingestion
+from api.routes import metrics as metrics_router
 from api.routes import query as query_router
+from services.metrics import registry
 # Example for a FastAPI backend
 from fastapi.middleware.cors import CORSMiddleware
 
 
 from dotenv import load_dotenv
 load_dotenv()
+# Service modules log through the standard logging module (e.g. model loading, closed connections)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
 app = FastAPI(
     title="NLP Query Engine API",
     description="API for database schema discovery, document ingestion, and natural language querying.",
@@ -24,6 +35,38 @@ app.add_middleware(
 # Include the ingestion router
 app.include_router(ingestion.router, prefix="/api", tags=["Data Ingestion"])
 app.include_router(query_router.router, prefix="/api", tags=["query"])
+app.include_router(metrics_router.router)
+
+HTTP_IN_FLIGHT = registry.gauge("nlq_http_requests_in_flight", "HTTP requests being served.")
+HTTP_SECONDS = registry.histogram("nlq_http_request_duration_seconds", "HTTP request latency by route.",
+                                  labels=("method", "route", "status"))
+
+
+@app.middleware("http")
+async def record_http_metrics(request: Request, call_next):
+    HTTP_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        # The route template keeps label cardinality bounded (no job ids in labels)
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        HTTP_SECONDS.observe(time.perf_counter() - start, method=request.method, route=route, status=status)
+
+@app.on_event("startup")
+async def warm_up_models():
+    # Off by default so workers start fast; POST /api/warmup does the same on demand
+    if os.getenv("WARMUP_ON_STARTUP", "false").lower() in ("1", "true", "yes"):
+        logger.info("Warm-up: %s", await run_in_threadpool(query_router.warm_up))
+
+@app.on_event("shutdown")
+def shutdown_ingestion():
+    ingestion.ingestion_jobs.shutdown()
+    query_router.engines.close_all()
 
 @app.get("/")
 async def root():
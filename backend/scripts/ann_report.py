@@ -0,0 +1,141 @@
+"""
+Recall-vs-latency report for the approximate vector index types.
+
+Builds each candidate index over the same vectors, sweeps its search knob
+(nprobe for IVF, efSearch for HNSW) and compares the top-k against the exact
+flat index. Vectors come from a saved document store or are synthetic.
+
+    cd backend
+    python scripts/ann_report.py --vectors 200000 --queries 500
+    python scripts/ann_report.py --store-dir data/document_store --output ann_report.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.storage import DocumentStorage  # noqa: E402
+from services.vector_index import VectorIndex  # noqa: E402
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """Unit vectors around random centroids, roughly shaped like sentence embeddings."""
+    rng = np.random.default_rng(seed)
+    centroids = rng.normal(size=(clusters, dim)).astype("float32")
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centroids[labels] + 0.6 * rng.normal(size=(n, dim)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype("float32")
+
+
+def stored_vectors(store_dir: str) -> np.ndarray:
+    loaded = DocumentStorage(store_dir).load(mmap=False)
+    if loaded is None:
+        raise SystemExit(f"No saved document store in {store_dir}")
+    index = loaded[0]
+    if isinstance(index, faiss.IndexIDMap2):
+        index = faiss.downcast_index(index.index)
+    if not isinstance(index, faiss.IndexFlat):
+        raise SystemExit("The saved index is not flat; its vectors cannot be reconstructed exactly.")
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def timed_search(index: VectorIndex, queries: np.ndarray, k: int, **knobs):
+    latencies = []
+    found = []
+    for q in queries:
+        start = time.perf_counter()
+        _, ids = index.search(q[None, :], k, **knobs)
+        latencies.append(time.perf_counter() - start)
+        found.append(ids[0])
+    return np.array(found), np.array(latencies)
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def summarize(name: str, knobs: dict, build_seconds: float, found, truth, latencies) -> dict:
+    return {
+        "index": name,
+        **knobs,
+        "build_seconds": round(build_seconds, 3),
+        "recall_at_k": round(recall_at_k(found, truth), 4),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        "qps_single_thread": round(len(latencies) / float(latencies.sum()), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store-dir", help="Read vectors from a saved document store instead of generating them")
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists (default: 4 * sqrt(n))")
+    parser.add_argument("--nprobe", default="1,4,16,64")
+    parser.add_argument("--ef-search", default="16,32,64,128,256")
+    parser.add_argument("--types", default="ivf_flat,ivf_pq,hnsw")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.store_dir:
+        vectors = stored_vectors(args.store_dir)
+    else:
+        vectors = synthetic_vectors(args.vectors, args.dim, args.clusters, args.seed)
+    n, dim = vectors.shape
+    rng = np.random.default_rng(args.seed + 1)
+    queries = vectors[rng.choice(n, size=min(args.queries, n), replace=False)]
+    queries = queries + 0.05 * rng.normal(size=queries.shape).astype("float32")
+    nlist = args.nlist or max(1, int(4 * np.sqrt(n)))
+
+    rows = []
+    start = time.perf_counter()
+    flat = VectorIndex(dim, "flat")
+    flat.add(vectors)
+    flat_build = time.perf_counter() - start
+    truth, latencies = timed_search(flat, queries, args.k)
+    rows.append(summarize("flat", {}, flat_build, truth, truth, latencies))
+
+    for index_type in [t.strip() for t in args.types.split(",") if t.strip()]:
+        start = time.perf_counter()
+        index = VectorIndex(dim, index_type, nlist=nlist, train_min_points=min(n, nlist * 39))
+        index.add(vectors)
+        build = time.perf_counter() - start
+        if not index.is_trained:
+            print(f"Skipping {index_type}: not enough vectors to train {nlist} lists", file=sys.stderr)
+            continue
+
+        if index_type.startswith("ivf"):
+            sweep = [("nprobe", int(v)) for v in args.nprobe.split(",")]
+        else:
+            sweep = [("ef_search", int(v)) for v in args.ef_search.split(",")]
+        for knob, value in sweep:
+            found, latencies = timed_search(index, queries, args.k, **{knob: value})
+            extra = {knob: value, "nlist": nlist} if index_type.startswith("ivf") else {knob: value}
+            rows.append(summarize(index_type, extra, build, found, truth, latencies))
+
+    report = {"vectors": n, "dim": dim, "queries": len(queries), "k": args.k, "results": rows}
+    for row in rows:
+        knobs = ", ".join(f"{key}={row[key]}" for key in ("nlist", "nprobe", "ef_search") if key in row)
+        print(f"{row['index']:<9} {knobs:<24} recall@{args.k}={row['recall_at_k']:.3f} "
+              f"p50={row['latency_ms_p50']:.2f}ms p95={row['latency_ms_p95']:.2f}ms", file=sys.stderr)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
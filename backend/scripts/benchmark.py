@@ -0,0 +1,573 @@
+"""
+Offline end-to-end benchmark of the query and ingestion paths.
+
+Builds SQLite employee databases for the three README schema variations,
+generates a synthetic PDF/DOCX/TXT corpus, replaces the Groq client with a
+deterministic local stub of configurable latency, and measures
+``process_documents``, ``search_documents`` and ``process_query`` (cold and
+warm cache) at several concurrency levels. Everything runs in a temporary
+directory; nothing is sent over the network.
+
+    cd backend
+    python scripts/benchmark.py --output bench.json
+    python scripts/benchmark.py --employees 100000 --concurrency 1,8,32 --llm-latency-ms 800
+    python scripts/benchmark.py --embedder hash --baseline bench.json   # compare with an earlier run
+
+``--embedder model`` (default) uses the real sentence-transformers model, which
+must already be in the local Hugging Face cache. ``--embedder hash`` swaps in a
+hashing encoder to measure the pipeline without model cost.
+
+The JSON report is the only output on stdout; progress and service
+diagnostics go to stderr, so ``python scripts/benchmark.py > bench.json`` works.
+"""
+import argparse
+import contextlib
+import datetime
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# -------------------------
+# Synthetic databases
+# -------------------------
+SCHEMAS = {
+    1: """
+        CREATE TABLE departments (dept_id INTEGER PRIMARY KEY, dept_name TEXT, manager_id INTEGER);
+        CREATE TABLE employees (
+            emp_id INTEGER PRIMARY KEY, full_name TEXT, dept_id INTEGER REFERENCES departments(dept_id),
+            position TEXT, annual_salary REAL, join_date DATE, office_location TEXT
+        );
+    """,
+    2: """
+        CREATE TABLE staff (
+            id INTEGER PRIMARY KEY, name TEXT, department TEXT, role TEXT, compensation REAL,
+            hired_on DATE, city TEXT, reports_to INTEGER REFERENCES staff(id)
+        );
+        CREATE TABLE documents (
+            doc_id INTEGER PRIMARY KEY, staff_id INTEGER REFERENCES staff(id), type TEXT,
+            content TEXT, uploaded_at TIMESTAMP
+        );
+    """,
+    3: """
+        CREATE TABLE divisions (division_code TEXT PRIMARY KEY, division_name TEXT, head_id INTEGER);
+        CREATE TABLE personnel (
+            person_id INTEGER PRIMARY KEY, employee_name TEXT,
+            division TEXT REFERENCES divisions(division_code), title TEXT, pay_rate REAL, start_date DATE
+        );
+    """,
+}
+
+# Question -> SQL the stub LLM answers with, per variation
+CANNED_SQL = {
+    1: {
+        "how many employees are in each department?":
+            "SELECT d.dept_name, COUNT(*) AS employees FROM employees e "
+            "JOIN departments d ON e.dept_id = d.dept_id GROUP BY d.dept_name",
+        "what is the average salary by department?":
+            "SELECT d.dept_name, AVG(e.annual_salary) AS avg_salary FROM employees e "
+            "JOIN departments d ON e.dept_id = d.dept_id GROUP BY d.dept_name",
+        "show the top 10 highest paid employees":
+            "SELECT full_name, annual_salary FROM employees ORDER BY annual_salary DESC LIMIT 10",
+        "list employees hired since 2021":
+            "SELECT full_name, join_date FROM employees WHERE join_date >= '2021-01-01'",
+    },
+    2: {
+        "how many employees are in each department?":
+            "SELECT department, COUNT(*) AS employees FROM staff GROUP BY department",
+        "what is the average salary by department?":
+            "SELECT department, AVG(compensation) AS avg_salary FROM staff GROUP BY department",
+        "show the top 10 highest paid employees":
+            "SELECT name, compensation FROM staff ORDER BY compensation DESC LIMIT 10",
+        "list employees hired since 2021":
+            "SELECT name, hired_on FROM staff WHERE hired_on >= '2021-01-01'",
+    },
+    3: {
+        "how many employees are in each department?":
+            "SELECT v.division_name, COUNT(*) AS employees FROM personnel p "
+            "JOIN divisions v ON p.division = v.division_code GROUP BY v.division_name",
+        "what is the average salary by department?":
+            "SELECT v.division_name, AVG(p.pay_rate) AS avg_salary FROM personnel p "
+            "JOIN divisions v ON p.division = v.division_code GROUP BY v.division_name",
+        "show the top 10 highest paid employees":
+            "SELECT employee_name, pay_rate FROM personnel ORDER BY pay_rate DESC LIMIT 10",
+        "list employees hired since 2021":
+            "SELECT employee_name, start_date FROM personnel WHERE start_date >= '2021-01-01'",
+    },
+}
+# SQL, SQL, SQL, SQL, HYBRID and DOCUMENT questions for the classifier
+QUESTIONS = list(CANNED_SQL[1]) + [
+    "which performance review mentions leadership?",
+    "remote work policy details",
+]
+DOCUMENT_QUERIES = [
+    "remote work policy details",
+    "python and machine learning experience",
+    "parental leave entitlement",
+    "feedback on communication in performance reviews",
+    "security training requirements for contractors",
+]
+
+DEPARTMENTS = ["Engineering", "Sales", "Marketing", "Finance", "Support", "People", "Legal", "Operations"]
+TITLES = ["Engineer", "Senior Engineer", "Manager", "Analyst", "Director", "Specialist", "Associate"]
+CITIES = ["Berlin", "Austin", "Pune", "Toronto", "Lisbon", "Sydney"]
+FIRST = ["Ana", "Ben", "Chen", "Dara", "Eli", "Fatima", "Gus", "Hana", "Ivan", "Jo", "Kofi", "Lena"]
+LAST = ["Ito", "Khan", "Lopez", "Muller", "Novak", "Okafor", "Patel", "Quinn", "Rossi", "Silva"]
+
+
+def _date(rng: random.Random) -> str:
+    return (datetime.date(2012, 1, 1) + datetime.timedelta(days=rng.randrange(13 * 365))).isoformat()
+
+
+def build_database(path: str, variation: int, employees: int, seed: int):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMAS[variation])
+    name = lambda: f"{rng.choice(FIRST)} {rng.choice(LAST)}"  # noqa: E731
+    if variation == 1:
+        conn.executemany("INSERT INTO departments VALUES (?, ?, ?)",
+                         [(i + 1, d, rng.randrange(1, employees + 1)) for i, d in enumerate(DEPARTMENTS)])
+        conn.executemany(
+            "INSERT INTO employees VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((i, name(), rng.randrange(1, len(DEPARTMENTS) + 1), rng.choice(TITLES),
+              round(rng.uniform(40000, 220000), 2), _date(rng), rng.choice(CITIES))
+             for i in range(1, employees + 1)),
+        )
+    elif variation == 2:
+        conn.executemany(
+            "INSERT INTO staff VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            ((i, name(), rng.choice(DEPARTMENTS), rng.choice(TITLES), round(rng.uniform(40000, 220000), 2),
+              _date(rng), rng.choice(CITIES), rng.randrange(1, i) if i > 1 else None)
+             for i in range(1, employees + 1)),
+        )
+        conn.executemany(
+            "INSERT INTO documents VALUES (?, ?, ?, ?, ?)",
+            ((i, rng.randrange(1, employees + 1), rng.choice(["resume", "review", "contract"]),
+              paragraph(rng), _date(rng) + " 09:00:00")
+             for i in range(1, employees // 4 + 2)),
+        )
+    else:
+        codes = [d[:3].upper() for d in DEPARTMENTS]
+        conn.executemany("INSERT INTO divisions VALUES (?, ?, ?)",
+                         [(c, d, rng.randrange(1, employees + 1)) for c, d in zip(codes, DEPARTMENTS)])
+        conn.executemany(
+            "INSERT INTO personnel VALUES (?, ?, ?, ?, ?, ?)",
+            ((i, name(), rng.choice(codes), rng.choice(TITLES), round(rng.uniform(20, 120), 2), _date(rng))
+             for i in range(1, employees + 1)),
+        )
+    conn.commit()
+    conn.close()
+
+
+# -------------------------
+# Synthetic documents
+# -------------------------
+TOPICS = {
+    "policy": ["remote work", "parental leave", "travel expenses", "security training", "code of conduct"],
+    "resume": ["python", "machine learning", "project management", "sales negotiation", "data analysis"],
+    "review": ["leadership", "communication", "ownership", "mentoring", "delivery"],
+}
+FILLER = ("the team employees manager company quarter requirements approved process during year "
+          "experience expected standard guidance contractors office hours responsible reported").split()
+
+
+def paragraph(rng: random.Random, topic: Optional[str] = None, words: int = 60) -> str:
+    kind = rng.choice(list(TOPICS))
+    topic = topic or rng.choice(TOPICS[kind])
+    body = " ".join(rng.choice(FILLER) for _ in range(words))
+    return f"{topic.capitalize()}: {body} {topic}."
+
+
+def document_pages(rng: random.Random, pages: int, paragraphs: int) -> List[List[str]]:
+    kind = rng.choice(list(TOPICS))
+    return [[paragraph(rng, rng.choice(TOPICS[kind])) for _ in range(paragraphs)] for _ in range(pages)]
+
+
+def make_txt(pages: List[List[str]]) -> bytes:
+    return "\n\n".join(p for page in pages for p in page).encode("utf-8")
+
+
+def make_docx(pages: List[List[str]]) -> bytes:
+    import docx
+    document = docx.Document()
+    for page in pages:
+        for p in page:
+            document.add_paragraph(p)
+        document.add_page_break()
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def make_pdf(pages: List[List[str]], line_chars: int = 90) -> bytes:
+    """Minimal text-only PDF (Helvetica, one content stream per page) that pypdf can extract."""
+    def escape(line: str) -> str:
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in pages:
+        lines = []
+        for p in page:
+            words, current = p.split(), ""
+            for word in words:
+                if len(current) + len(word) + 1 > line_chars:
+                    lines.append(current)
+                    current = word
+                else:
+                    current = f"{current} {word}".strip()
+            lines.extend([current, ""])
+        text_ops = " ".join(f"({escape(line)}) Tj T*" for line in lines[:50])
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td {text_ops} ET".encode("latin-1", "replace")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream.decode('latin-1')}\nendstream")
+        content_id = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    return out.getvalue()
+
+
+def build_corpus(documents: int, pages: int, paragraphs: int, seed: int) -> List[Dict]:
+    rng = random.Random(seed)
+    makers = [("pdf", make_pdf), ("docx", make_docx), ("txt", make_txt)]
+    files = []
+    for i in range(documents):
+        extension, make = makers[i % len(makers)]
+        files.append({"filename": f"doc_{i:05d}.{extension}",
+                      "content": make(document_pages(rng, pages, paragraphs))})
+    return files
+
+
+# -------------------------
+# Local stand-ins
+# -------------------------
+class StubGroqClient:
+    """
+    Deterministic replacement for ``groq.Groq``: answers after a fixed latency
+    (plus optional jitter derived from the question) with canned SQL, or a
+    count over the first table in the prompt.
+    """
+
+    def __init__(self, canned_sql: Dict[str, str], latency_ms: float, jitter_ms: float = 0.0):
+        self.canned_sql = canned_sql
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.calls = 0
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._create))
+
+    def _create(self, model: str, messages: List[Dict], temperature: float = 0, **kwargs):
+        self.calls += 1
+        prompt = messages[-1]["content"]
+        match = re.search(r'User query: "(.*)"', prompt)
+        question = strip_run_suffix(match.group(1) if match else "").strip().lower()
+        jitter = int(hashlib.md5(question.encode()).hexdigest(), 16) % 1000 / 1000 * self.jitter_ms
+        time.sleep((self.latency_ms + jitter) / 1000)
+        sql = self.canned_sql.get(question)
+        if sql is None:
+            table = re.search(r"Table (\w+)\(", prompt)
+            sql = f"SELECT COUNT(*) AS n FROM {table.group(1) if table else 'sqlite_master'}"
+        message = types.SimpleNamespace(content=f"```sql\n{sql}\n```")
+        usage = types.SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(sql) // 4)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage)
+
+
+def strip_run_suffix(question: str) -> str:
+    return re.sub(r"\s*\[run \d+\]$", "", question)
+
+
+def install_hash_embedder():
+    """Registers a fake ``sentence_transformers`` whose model hashes words into 384 dims."""
+    class HashingSentenceTransformer:
+        def __init__(self, name: str, **kwargs):
+            self.name = name
+
+        def get_sentence_embedding_dimension(self) -> int:
+            return 384
+
+        def encode(self, texts, convert_to_tensor=False, batch_size=32, **kwargs):
+            single = isinstance(texts, str)
+            vectors = np.zeros((1 if single else len(texts), 384), dtype="float32")
+            for row, text in enumerate([texts] if single else texts):
+                for word in text.lower().split():
+                    vectors[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % 384] += 1.0
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.where(norms == 0, 1, norms)
+            return vectors[0] if single else vectors
+
+    module = types.ModuleType("sentence_transformers")
+    module.SentenceTransformer = HashingSentenceTransformer
+    sys.modules["sentence_transformers"] = module
+
+
+# -------------------------
+# Measurement
+# -------------------------
+def memory_mb() -> Dict[str, Optional[float]]:
+    rss = peak = None
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak_raw = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        peak = peak_raw / 2 ** 20 if sys.platform == "darwin" else peak_raw / 2 ** 10
+    except ImportError:
+        pass
+    return {"rss_mb": round(rss, 1) if rss else None, "peak_rss_mb": round(peak, 1) if peak else None}
+
+
+def latency_stats(latencies: List[float], wall: float, errors: int) -> Dict:
+    values = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "latency_ms_p50": round(float(np.percentile(values, 50)), 3),
+        "latency_ms_p95": round(float(np.percentile(values, 95)), 3),
+        "latency_ms_p99": round(float(np.percentile(values, 99)), 3),
+        "latency_ms_mean": round(float(values.mean()), 3),
+        "latency_ms_max": round(float(values.max()), 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall > 0 else None,
+        "wall_seconds": round(wall, 3),
+    }
+
+
+def run_load(fn: Callable[[str], Dict], inputs: List[str], concurrency: int) -> Dict:
+    def one(item):
+        start = time.perf_counter()
+        try:
+            result = fn(item)
+            failed = bool(result.get("error")) or bool((result.get("sql_result") or {}).get("error"))
+        except Exception:
+            failed = True
+        return time.perf_counter() - start, failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, inputs))
+    wall = time.perf_counter() - start
+    return {**latency_stats([o[0] for o in outcomes], wall, sum(o[1] for o in outcomes)),
+            "concurrency": concurrency, **memory_mb()}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(report: Dict, baseline_path: str):
+    """Prints p95 changes against an earlier report to stderr."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def flatten(node, path=""):
+        if isinstance(node, dict):
+            if "latency_ms_p95" in node:
+                yield path, node["latency_ms_p95"]
+            for key, value in node.items():
+                yield from flatten(value, f"{path}/{key}")
+        elif isinstance(node, list):
+            for i, value in enumerate(node):
+                yield from flatten(value, f"{path}/{value.get('variation', i) if isinstance(value, dict) else i}")
+
+    old = dict(flatten(baseline))
+    for path, p95 in flatten(report):
+        if path in old and old[path]:
+            change = (p95 - old[path]) / old[path] * 100
+            print(f"{path:<60} p95 {old[path]:>10.2f} -> {p95:>10.2f} ms ({change:+.1f}%)", file=sys.stderr)
+
+
+# -------------------------
+# Main
+# -------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variations", default="1,2,3", help="README schema variations to benchmark")
+    parser.add_argument("--employees", type=int, default=10000, help="Rows in the main employee table")
+    parser.add_argument("--documents", type=int, default=30, help="Synthetic files (PDF/DOCX/TXT in turn)")
+    parser.add_argument("--pages", type=int, default=3, help="Pages per synthetic document")
+    parser.add_argument("--paragraphs", type=int, default=4, help="Paragraphs per page")
+    parser.add_argument("--requests", type=int, default=60, help="process_query calls per concurrency level")
+    parser.add_argument("--concurrency", default="1,8", help="Concurrency levels, comma separated")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--embedder", choices=("model", "hash"), default="model")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Keep databases and stores here instead of a temporary directory")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare p95 latencies against")
+    args = parser.parse_args()
+
+    # The services print diagnostics to stdout; keep it for the JSON report alone
+    with _stdout_to_stderr():
+        report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        compare(report, args.baseline)
+
+
+@contextlib.contextmanager
+def _stdout_to_stderr():
+    """Points file descriptor 1 (so also child processes) and sys.stdout at stderr."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(2, 1)
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            yield
+    finally:
+        sys.stderr.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def run(args) -> Dict:
+    """Ingests the corpus, runs the load at each concurrency level and returns the report."""
+    workdir = args.workdir or tempfile.mkdtemp(prefix="nlq-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    # Module-level settings are read at import time, so isolate them before importing services
+    os.environ.update({
+        "DOCUMENT_STORE_DIR": os.path.join(workdir, "document_store"),
+        "SCHEMA_CACHE_DIR": os.path.join(workdir, "schema_cache"),
+        "QUERY_CACHE_BACKEND": "memory",
+    })
+    os.environ.setdefault("GROQ_API_KEY", "benchmark-stub")
+    if args.embedder == "hash":
+        install_hash_embedder()
+    else:
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+    from services.embeddings import embedder
+    from services.query_engine import QueryEngine, query_cache, semantic_sql_cache
+
+    concurrency_levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    memory_start = memory_mb()
+    import_start = time.perf_counter()
+    qe = QueryEngine()
+    startup_seconds = time.perf_counter() - import_start
+    # The model loads lazily; keep its load time out of the ingestion numbers
+    embedding_warm_up = embedder.warm_up()
+
+    print(f"Generating {args.documents} documents in {workdir}", file=sys.stderr)
+    corpus = build_corpus(args.documents, args.pages, args.paragraphs, args.seed)
+    start = time.perf_counter()
+    ingested = qe.doc_processor.process_documents(corpus)
+    ingest_seconds = time.perf_counter() - start
+    ingestion = {
+        "files": len(corpus),
+        "bytes": sum(len(f["content"]) for f in corpus),
+        "chunks": ingested["total_chunks_indexed"],
+        "seconds": round(ingest_seconds, 3),
+        "chunks_per_second": round(ingested["total_chunks_indexed"] / ingest_seconds, 1) if ingest_seconds else None,
+        **memory_mb(),
+    }
+    print(f"process_documents: {ingestion['chunks']} chunks in {ingestion['seconds']}s", file=sys.stderr)
+
+    search = {}
+    doc_inputs = [DOCUMENT_QUERIES[i % len(DOCUMENT_QUERIES)] for i in range(args.requests)]
+    qe.search_documents(doc_inputs[0])  # warm the embedding batcher
+    for c in concurrency_levels:
+        search[f"c{c}"] = run_load(lambda q: qe.search_documents(q), doc_inputs, c)
+
+    variations = []
+    for variation in [int(v) for v in args.variations.split(",") if v.strip()]:
+        db_path = os.path.join(workdir, f"variation_{variation}.db")
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        start = time.perf_counter()
+        build_database(db_path, variation, args.employees, args.seed + variation)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        qe.connect_db(f"sqlite:///{db_path}")
+        connect_seconds = time.perf_counter() - start
+        stub = StubGroqClient(CANNED_SQL[variation], args.llm_latency_ms, args.llm_jitter_ms)
+        qe.groq_client = stub
+
+        runs = {"cold": {}, "warm": {}}
+        counter = iter(range(10 ** 9))
+        for c in concurrency_levels:
+            # Cold: a unique suffix per request misses both the response and the semantic cache
+            cold_inputs = [f"{QUESTIONS[i % len(QUESTIONS)]} [run {next(counter)}]" for i in range(args.requests)]
+            runs["cold"][f"c{c}"] = run_load(qe.process_query, cold_inputs, c)
+
+            query_cache.clear()
+            semantic_sql_cache.clear()
+            for question in QUESTIONS:  # prime
+                qe.process_query(question)
+            warm_inputs = [QUESTIONS[i % len(QUESTIONS)] for i in range(args.requests)]
+            runs["warm"][f"c{c}"] = run_load(qe.process_query, warm_inputs, c)
+
+        variations.append({
+            "variation": variation,
+            "tables": [t["name"] for t in qe.schema.get("tables", [])],
+            "employees": args.employees,
+            "build_seconds": round(build_seconds, 3),
+            "connect_seconds": round(connect_seconds, 3),
+            "llm_calls": stub.calls,
+            "process_query": runs,
+        })
+        cold = runs["cold"][f"c{concurrency_levels[0]}"]
+        print(f"variation {variation}: cold p95={cold['latency_ms_p95']:.1f}ms "
+              f"warm p95={runs['warm'][f'c{concurrency_levels[0]}']['latency_ms_p95']:.1f}ms", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "git_commit": git_commit(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": vars(args),
+        "startup_seconds": round(startup_seconds, 3),
+        "embedding_warm_up": embedding_warm_up,
+        "memory_start": memory_start,
+        "ingestion": ingestion,
+        "search_documents": search,
+        "variations": variations,
+        "memory_end": memory_mb(),
+    }
+    return report
+
+
+if __name__ == "__main__":
+    main()
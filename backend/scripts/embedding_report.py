@@ -0,0 +1,131 @@
+"""
+Speed and quality of the embedding backends against the default torch model.
+
+Encodes the same texts with every backend and reports load time, batch
+throughput, single-text latency, and how close each backend's embeddings and
+nearest neighbours are to the torch baseline. Texts come from a saved document
+store, or are synthetic when there is none.
+
+    cd backend
+    python scripts/embedding_report.py --backends torch,int8,onnx --output embedding_report.json
+    python scripts/embedding_report.py --store data/document_store --texts 5000
+    EMBEDDING_ONNX_FILE=onnx/model_qint8_avx2.onnx python scripts/embedding_report.py --backends torch,onnx
+
+Choose the backend for the server with EMBEDDING_BACKEND.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.embeddings import EMBEDDING_BACKENDS, EMBEDDING_MODEL, load_model  # noqa: E402
+from services.storage import DocumentStorage  # noqa: E402
+
+
+def stored_texts(store_dir: str, limit: int) -> list:
+    loaded = DocumentStorage(store_dir).load(mmap=True)
+    if loaded is None:
+        raise SystemExit(f"No saved document store in {store_dir}")
+    chunk_store = loaded[1]
+    ids = [i for i in range(len(chunk_store)) if i not in chunk_store.deleted][:limit]
+    return [chunk_store.text(i) for i in ids]
+
+
+def synthetic_texts(n: int, seed: int) -> list:
+    from benchmark import paragraph  # scripts/benchmark.py
+    rng = random.Random(seed)
+    return [paragraph(rng, words=rng.randrange(10, 120)) for _ in range(n)]
+
+
+def nearest(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    normed = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    q = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    return np.argsort(-(q @ normed.T), axis=1)[:, :k]
+
+
+def measure(backend: str, model_name: str, texts: list, single: list, batch_size: int) -> dict:
+    start = time.perf_counter()
+    model = load_model(model_name, backend)
+    load_seconds = time.perf_counter() - start
+    model.encode(texts[:batch_size], batch_size=batch_size)  # warm-up
+
+    start = time.perf_counter()
+    vectors = np.asarray(model.encode(texts, batch_size=batch_size, convert_to_tensor=False), dtype="float32")
+    batch_seconds = time.perf_counter() - start
+
+    latencies = []
+    for text in single:
+        start = time.perf_counter()
+        model.encode([text], convert_to_tensor=False)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    return {
+        "backend": backend,
+        "load_seconds": round(load_seconds, 3),
+        "texts_per_second": round(len(texts) / batch_seconds, 1),
+        "single_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+        "single_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+        "_vectors": vectors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="torch,int8,onnx",
+                        help=f"Backends to compare; torch is always measured as the baseline {EMBEDDING_BACKENDS}")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--store", help="Document store directory to take texts from")
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200, help="Texts encoded one at a time / used as NN queries")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    texts = stored_texts(args.store, args.texts) if args.store else synthetic_texts(args.texts, args.seed)
+    rng = np.random.default_rng(args.seed)
+    query_ids = rng.choice(len(texts), size=min(args.queries, len(texts)), replace=False)
+    single = [texts[i] for i in query_ids]
+
+    backends = ["torch"] + [b.strip() for b in args.backends.split(",") if b.strip() and b.strip() != "torch"]
+    rows = []
+    for backend in backends:
+        try:
+            rows.append(measure(backend, args.model, texts, single, args.batch_size))
+        except (RuntimeError, ImportError, OSError) as e:
+            print(f"Skipping {backend}: {e}", file=sys.stderr)
+
+    baseline = rows[0]["_vectors"]
+    truth = nearest(baseline, baseline[query_ids], args.k + 1)[:, 1:]  # drop the query itself
+    for row in rows:
+        vectors = row.pop("_vectors")
+        cosine = (vectors * baseline).sum(axis=1) / np.maximum(
+            np.linalg.norm(vectors, axis=1) * np.linalg.norm(baseline, axis=1), 1e-12)
+        found = nearest(vectors, vectors[query_ids], args.k + 1)[:, 1:]
+        row["cosine_to_torch_mean"] = round(float(cosine.mean()), 5)
+        row["cosine_to_torch_min"] = round(float(cosine.min()), 5)
+        row[f"neighbour_recall_at_{args.k}"] = round(
+            sum(len(set(f) & set(t)) for f, t in zip(found, truth)) / truth.size, 4)
+        row["speedup_vs_torch"] = round(row["texts_per_second"] / rows[0]["texts_per_second"], 2)
+
+    report = {"model": args.model, "texts": len(texts), "queries": len(single), "batch_size": args.batch_size,
+              "k": args.k, "results": rows}
+    for row in rows:
+        print(f"{row['backend']:<6} {row['texts_per_second']:>9.1f} texts/s (x{row['speedup_vs_torch']:.2f}) "
+              f"single p50={row['single_ms_p50']:.1f}ms cosine={row['cosine_to_torch_mean']:.4f} "
+              f"recall@{args.k}={row[f'neighbour_recall_at_{args.k}']:.3f}", file=sys.stderr)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
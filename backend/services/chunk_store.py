@@ -0,0 +1,421 @@
+import hashlib
+import itertools
+import json
+import os
+from array import array
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+import numpy as np
+
+CHUNK_STORE_FORMAT_VERSION = 3
+_TEXT_FILE = "chunks.text.bin"
+_OFFSETS_FILE = "chunks.offsets.npy"
+_FILE_IDS_FILE = "chunks.file_ids.npy"
+_POSITIONS_FILE = "chunks.positions.npy"
+_HASHES_FILE = "chunks.hashes.npy"
+_DELETED_FILE = "chunks.deleted.npy"
+_ENTITY_TERMS_FILE = "chunks.entity_terms.npy"    # postings sorted by term index, then chunk id
+_ENTITY_CHUNKS_FILE = "chunks.entity_chunks.npy"
+_META_FILE = "chunks.meta.json"
+
+
+def chunk_hash(text: str) -> int:
+    """64-bit content hash of a chunk."""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+class _Segment:
+    """
+    One run of rows. ``offsets`` has one more entry than there are rows and is
+    relative to the segment's own ``text`` buffer. The columns are either growable
+    stdlib arrays (the writable tail) or read-only memory-mapped numpy arrays
+    (a segment opened from disk).
+    """
+
+    def __init__(self, text=None, offsets=None, file_ids=None, positions=None, hashes=None):
+        self.text = bytearray() if text is None else text
+        self.offsets = array("q", [0]) if offsets is None else offsets
+        self.file_ids = array("i") if file_ids is None else file_ids
+        self.positions = array("i") if positions is None else positions
+        self.hashes = array("Q") if hashes is None else hashes
+
+    def __len__(self) -> int:
+        return len(self.file_ids)
+
+    def chunk_text(self, row: int) -> str:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return bytes(self.text[start:end]).decode("utf-8")
+
+    def nbytes(self) -> int:
+        return (
+            len(self.text)
+            + self.offsets.itemsize * len(self.offsets)
+            + self.file_ids.itemsize * len(self.file_ids)
+            + self.positions.itemsize * len(self.positions)
+            + self.hashes.itemsize * len(self.hashes)
+        )
+
+
+class ChunkStore:
+    """
+    Columnar storage for document chunks, addressed directly by embedding id.
+
+    Row ``i`` of the store describes the vector stored at position ``i`` of the
+    FAISS index, so resolving a search hit is plain array indexing instead of a
+    scan over every chunk. Chunk text lives in one contiguous UTF-8 buffer with
+    an offsets array; filenames are interned and referenced by a small integer.
+
+    A store opened from disk keeps those rows memory-mapped in a read-only base
+    segment; rows added afterwards go to an in-memory tail until the next save.
+
+    Rows are never rewritten, so an embedding id is a stable chunk id. Deleting
+    a chunk marks its id; each row also keeps a content hash so re-ingesting a
+    file can reuse chunks that did not change, and each file its content hash.
+
+    Files carry metadata (document type, upload time, entity keys such as an
+    employee id) that applies to all their chunks; entity keys found in a
+    chunk's own text are kept as ``key=value`` postings lists. ``select``
+    turns filters over both into the ids a search may return.
+    """
+
+    def __init__(self):
+        self.filenames: List[str] = []
+        self._filename_ids: Dict[str, int] = {}
+        self._base = _Segment()
+        self._tail = _Segment()
+        self.deleted: Set[int] = set()
+        self.file_hashes: Dict[str, str] = {}
+        self.file_meta: Dict[str, Dict[str, Any]] = {}
+        # Entity postings: mapped base (term index -> sorted runs of chunk ids) plus the in-memory tail
+        self.entity_terms: List[str] = []
+        self._base_term_ids = np.empty(0, dtype=np.int32)
+        self._base_term_chunks = np.empty(0, dtype=np.int64)
+        self._tail_postings: Dict[str, array] = {}
+        # Bumped on every change, so a saver can tell whether the store moved on meanwhile
+        self.revision = 0
+
+    def __len__(self) -> int:
+        return len(self._base) + len(self._tail)
+
+    def _locate(self, embedding_id: int):
+        base_len = len(self._base)
+        if embedding_id < base_len:
+            return self._base, embedding_id
+        return self._tail, embedding_id - base_len
+
+    def _intern_filename(self, filename: str) -> int:
+        file_id = self._filename_ids.get(filename)
+        if file_id is None:
+            file_id = len(self.filenames)
+            self.filenames.append(filename)
+            self._filename_ids[filename] = file_id
+        return file_id
+
+    def add_chunks(self, filename: str, chunks: List[str], positions: Optional[List[int]] = None,
+                   entities: Optional[List[List[str]]] = None) -> int:
+        """
+        Appends chunks of one file and returns the embedding id of the first one.
+        ``positions`` gives each chunk's place in the file (default 0, 1, ...),
+        ``entities`` the ``key=value`` entity terms found in each chunk.
+        """
+        first_id = len(self)
+        file_id = self._intern_filename(filename)
+        tail = self._tail
+        self.revision += 1
+        for position, chunk in zip(positions if positions is not None else range(len(chunks)), chunks):
+            tail.text += chunk.encode("utf-8")
+            tail.offsets.append(len(tail.text))
+            tail.file_ids.append(file_id)
+            tail.positions.append(position)
+            tail.hashes.append(chunk_hash(chunk))
+        for offset, terms in enumerate(entities or []):
+            for term in terms:
+                self._tail_postings.setdefault(term, array("q")).append(first_id + offset)
+        return first_id
+
+    def delete(self, embedding_ids: Iterable[int]):
+        self.deleted.update(int(i) for i in embedding_ids)
+        self.revision += 1
+
+    def set_file_hash(self, filename: str, digest: Optional[str]):
+        if digest is None:
+            self.file_hashes.pop(filename, None)
+        else:
+            self.file_hashes[filename] = digest
+        self.revision += 1
+
+    def set_file_meta(self, filename: str, meta: Optional[Dict[str, Any]]):
+        """``{"doc_type", "uploaded_at", "entities": {key: [values]}}`` of a file, or None to drop it."""
+        if meta is None:
+            self.file_meta.pop(filename, None)
+        else:
+            self.file_meta[filename] = meta
+        self.revision += 1
+
+    def live_count(self) -> int:
+        return len(self) - len(self.deleted)
+
+    def file_chunk_ids(self, filename: str) -> List[int]:
+        """Ids of the file's chunks that have not been deleted, in id order."""
+        file_id = self._filename_ids.get(filename)
+        if file_id is None:
+            return []
+        base_len = len(self._base)
+        ids = np.concatenate([
+            np.flatnonzero(np.asarray(self._base.file_ids, dtype=np.int32) == file_id),
+            np.flatnonzero(np.frombuffer(self._tail.file_ids, dtype=np.int32) == file_id) + base_len,
+        ])
+        return [i for i in ids.tolist() if i not in self.deleted]
+
+    def live_filenames(self) -> Dict[str, int]:
+        """Filename -> number of live chunks."""
+        counts = np.bincount(np.concatenate([
+            np.asarray(self._base.file_ids, dtype=np.int32),
+            np.frombuffer(self._tail.file_ids, dtype=np.int32),
+        ]).astype(np.int64), minlength=len(self.filenames))
+        for embedding_id in self.deleted:
+            segment, row = self._locate(embedding_id)
+            counts[int(segment.file_ids[row])] -= 1
+        return {name: int(n) for name, n in zip(self.filenames, counts) if n > 0}
+
+    # -------------------------
+    # Metadata filters
+    # -------------------------
+    def _file_id_column(self) -> np.ndarray:
+        return np.concatenate([
+            np.asarray(self._base.file_ids, dtype=np.int32),
+            np.frombuffer(self._tail.file_ids, dtype=np.int32),
+        ])
+
+    def entity_keys(self) -> Set[str]:
+        """Entity keys present in file metadata or chunk postings."""
+        keys = {key for meta in self.file_meta.values() for key in meta.get("entities", {})}
+        return keys | {term.partition("=")[0] for term in itertools.chain(self.entity_terms, self._tail_postings)}
+
+    def _term_chunks(self, terms: Iterable[str]) -> np.ndarray:
+        term_index = {term: i for i, term in enumerate(self.entity_terms)}
+        runs = []
+        for term in terms:
+            i = term_index.get(term)
+            if i is not None:
+                lo, hi = np.searchsorted(self._base_term_ids, [i, i + 1])
+                runs.append(np.asarray(self._base_term_chunks[lo:hi]))
+            if term in self._tail_postings:
+                runs.append(np.frombuffer(self._tail_postings[term], dtype=np.int64))
+        return np.concatenate(runs) if runs else np.empty(0, dtype=np.int64)
+
+    def select(self, filters: Dict[str, Any]) -> np.ndarray:
+        """
+        Ids of the live chunks matching ``filters`` (see
+        document_filters.normalize_filters): fields AND-ed, values OR-ed. An
+        entity value matches a file's metadata or the chunk's own text.
+        """
+        files = range(len(self.filenames))
+        if "filename" in filters:
+            names = set(filters["filename"])
+            files = [i for i in files if self.filenames[i] in names]
+        meta = [self.file_meta.get(name, {}) for name in self.filenames]
+        if "doc_type" in filters:
+            files = [i for i in files if meta[i].get("doc_type") in filters["doc_type"]]
+        if "uploaded_after" in filters:
+            files = [i for i in files if meta[i].get("uploaded_at", float("-inf")) >= filters["uploaded_after"]]
+        if "uploaded_before" in filters:
+            files = [i for i in files if meta[i].get("uploaded_at", float("inf")) < filters["uploaded_before"]]
+
+        file_ids = self._file_id_column()
+        mask = np.isin(file_ids, np.asarray(list(files), dtype=np.int32))
+        for key, values in (filters.get("entities") or {}).items():
+            wanted = set(values)
+            tagged_files = [i for i in range(len(self.filenames))
+                            if wanted & set(meta[i].get("entities", {}).get(key, []))]
+            key_mask = np.isin(file_ids, np.asarray(tagged_files, dtype=np.int32))
+            key_mask[self._term_chunks(f"{key}={value}" for value in values)] = True
+            mask &= key_mask
+        if self.deleted:
+            mask[np.fromiter(self.deleted, dtype=np.int64)] = False
+        return np.flatnonzero(mask).astype(np.int64)
+
+    # -------------------------
+    # Lookups
+    # -------------------------
+    def text(self, embedding_id: int) -> str:
+        segment, row = self._locate(embedding_id)
+        return segment.chunk_text(row)
+
+    def filename(self, embedding_id: int) -> str:
+        segment, row = self._locate(embedding_id)
+        return self.filenames[int(segment.file_ids[row])]
+
+    def position(self, embedding_id: int) -> int:
+        segment, row = self._locate(embedding_id)
+        return int(segment.positions[row])
+
+    def hash(self, embedding_id: int) -> int:
+        segment, row = self._locate(embedding_id)
+        return int(segment.hashes[row]) if len(segment.hashes) else 0
+
+    def doc_id(self, embedding_id: int) -> str:
+        return f"{self.filename(embedding_id)}_{embedding_id}"
+
+    def get(self, embedding_id: int) -> Optional[Dict]:
+        if embedding_id < 0 or embedding_id >= len(self) or embedding_id in self.deleted:
+            return None
+        return {
+            "doc_id": self.doc_id(embedding_id),
+            "filename": self.filename(embedding_id),
+            "chunk": self.text(embedding_id),
+            "position": self.position(embedding_id),
+            "embedding_id": embedding_id,
+        }
+
+    def nbytes(self) -> int:
+        """Approximate size of the columnar buffers (mapped or in memory)."""
+        return self._base.nbytes() + self._tail.nbytes()
+
+    # -------------------------
+    # Persistence
+    # -------------------------
+    def save(self, directory: str):
+        """
+        Writes the store into ``directory`` (which must already exist). Text is
+        streamed segment by segment so the mapped base is never copied into RAM.
+        """
+        base, tail = self._base, self._tail
+        base_text_len = len(base.text)
+
+        with open(os.path.join(directory, _TEXT_FILE), "wb") as f:
+            step = 1 << 24
+            for start in range(0, base_text_len, step):
+                f.write(bytes(base.text[start:start + step]))
+            f.write(tail.text)
+            f.flush()
+            os.fsync(f.fileno())
+
+        offsets = np.concatenate([
+            np.asarray(base.offsets, dtype=np.int64),
+            np.asarray(tail.offsets, dtype=np.int64)[1:] + base_text_len,
+        ])
+        file_ids = np.concatenate([
+            np.asarray(base.file_ids, dtype=np.int32),
+            np.asarray(tail.file_ids, dtype=np.int32),
+        ])
+        positions = np.concatenate([
+            np.asarray(base.positions, dtype=np.int32),
+            np.asarray(tail.positions, dtype=np.int32),
+        ])
+        np.save(os.path.join(directory, _OFFSETS_FILE), offsets)
+        np.save(os.path.join(directory, _FILE_IDS_FILE), file_ids)
+        hashes = np.concatenate([
+            np.asarray(base.hashes, dtype=np.uint64),
+            np.asarray(tail.hashes, dtype=np.uint64),
+        ])
+        np.save(os.path.join(directory, _POSITIONS_FILE), positions)
+        np.save(os.path.join(directory, _HASHES_FILE), hashes)
+        np.save(os.path.join(directory, _DELETED_FILE), np.array(sorted(self.deleted), dtype=np.int64))
+
+        terms = list(self.entity_terms)
+        term_index = {term: i for i, term in enumerate(terms)}
+        term_ids = [np.asarray(self._base_term_ids, dtype=np.int32)]
+        term_chunks = [np.asarray(self._base_term_chunks, dtype=np.int64)]
+        for term, chunk_ids in self._tail_postings.items():
+            if term not in term_index:
+                term_index[term] = len(terms)
+                terms.append(term)
+            term_ids.append(np.full(len(chunk_ids), term_index[term], dtype=np.int32))
+            term_chunks.append(np.frombuffer(chunk_ids, dtype=np.int64))
+        term_ids, term_chunks = np.concatenate(term_ids), np.concatenate(term_chunks)
+        order = np.lexsort((term_chunks, term_ids))
+        np.save(os.path.join(directory, _ENTITY_TERMS_FILE), term_ids[order])
+        np.save(os.path.join(directory, _ENTITY_CHUNKS_FILE), term_chunks[order])
+
+        with open(os.path.join(directory, _META_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "version": CHUNK_STORE_FORMAT_VERSION,
+                "count": len(self),
+                "filenames": self.filenames,
+                "file_hashes": self.file_hashes,
+                "file_meta": self.file_meta,
+                "entity_terms": terms,
+            }, f)
+
+    @classmethod
+    def open(cls, directory: str, mmap: bool = True) -> "ChunkStore":
+        """
+        Opens a store written by ``save``. With ``mmap`` the columns are mapped
+        read-only, so opening costs O(number of files), not O(corpus size).
+        """
+        with open(os.path.join(directory, _META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != CHUNK_STORE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported chunk store version: {meta.get('version')}")
+
+        mmap_mode = "r" if mmap else None
+        text_path = os.path.join(directory, _TEXT_FILE)
+        if os.path.getsize(text_path) == 0:
+            text = bytearray()  # numpy cannot map an empty file
+        elif mmap:
+            text = np.memmap(text_path, dtype=np.uint8, mode="r")
+        else:
+            with open(text_path, "rb") as f:
+                text = bytearray(f.read())
+
+        store = cls()
+        store.filenames = list(meta["filenames"])
+        store._filename_ids = {name: i for i, name in enumerate(store.filenames)}
+        store._base = _Segment(
+            text=text,
+            offsets=np.load(os.path.join(directory, _OFFSETS_FILE), mmap_mode=mmap_mode),
+            file_ids=np.load(os.path.join(directory, _FILE_IDS_FILE), mmap_mode=mmap_mode),
+            positions=np.load(os.path.join(directory, _POSITIONS_FILE), mmap_mode=mmap_mode),
+            hashes=np.load(os.path.join(directory, _HASHES_FILE), mmap_mode=mmap_mode),
+        )
+        store.deleted = set(np.load(os.path.join(directory, _DELETED_FILE)).tolist())
+        store.file_hashes = dict(meta["file_hashes"])
+        store.file_meta = dict(meta["file_meta"])
+        store.entity_terms = list(meta["entity_terms"])
+        store._base_term_ids = np.load(os.path.join(directory, _ENTITY_TERMS_FILE), mmap_mode=mmap_mode)
+        store._base_term_chunks = np.load(os.path.join(directory, _ENTITY_CHUNKS_FILE), mmap_mode=mmap_mode)
+        if len(store) != meta["count"]:
+            raise ValueError("Chunk store files are inconsistent with their metadata.")
+        return store
+
+
+class DocumentStoreView(Mapping):
+    """
+    Read-only ``doc_id -> {"filename", "chunk", "embedding_id"}`` mapping over a
+    ChunkStore, kept for code that still expects the old ``documents_store`` dict.
+    """
+
+    def __init__(self, store: ChunkStore):
+        self._store = store
+
+    def _embedding_id(self, doc_id: str) -> int:
+        filename, _, suffix = doc_id.rpartition("_")
+        if not suffix.isdigit():
+            raise KeyError(doc_id)
+        embedding_id = int(suffix)
+        if (embedding_id >= len(self._store) or embedding_id in self._store.deleted
+                or self._store.filename(embedding_id) != filename):
+            raise KeyError(doc_id)
+        return embedding_id
+
+    def __getitem__(self, doc_id: str) -> Dict:
+        embedding_id = self._embedding_id(doc_id)
+        return {
+            "filename": self._store.filename(embedding_id),
+            "chunk": self._store.text(embedding_id),
+            "embedding_id": embedding_id,
+        }
+
+    def __iter__(self) -> Iterator[str]:
+        for embedding_id in range(len(self._store)):
+            if embedding_id not in self._store.deleted:
+                yield self._store.doc_id(embedding_id)
+
+    def __len__(self) -> int:
+        return self._store.live_count()
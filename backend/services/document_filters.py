@@ -0,0 +1,110 @@
+import json
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+# Entity keys found in chunk text, e.g. {"emp_id": "\\bEMP-?(\\d+)\\b"}: the first group is the value.
+# Name keys after the database columns holding the same ids so HYBRID queries can scope by them.
+ENTITY_PATTERNS: Dict[str, "re.Pattern"] = {
+    key: re.compile(pattern) for key, pattern in json.loads(os.getenv("ENTITY_PATTERNS", "{}") or "{}").items()
+}
+# HYBRID queries search only the documents of the entities the SQL branch returned
+HYBRID_SCOPE_DOCUMENTS = os.getenv("HYBRID_SCOPE_DOCUMENTS", "true").lower() in ("1", "true", "yes")
+# A SQL result with more distinct entity values than this does not scope the search
+HYBRID_SCOPE_MAX_ENTITIES = int(os.getenv("HYBRID_SCOPE_MAX_ENTITIES", "1000"))
+# The HYBRID document search runs alongside SQL for top_k * this many hits, then keeps the scoped ones
+HYBRID_SCOPE_OVERFETCH = max(1, int(os.getenv("HYBRID_SCOPE_OVERFETCH", "4")))
+
+FILTER_FIELDS = ("filename", "doc_type", "uploaded_after", "uploaded_before", "entities")
+
+
+def entity_value(value: Any) -> str:
+    """Entity values are compared as strings; 42, 42.0 and "42" are the same id."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def entity_term(key: str, value: Any) -> str:
+    return f"{key.lower()}={entity_value(value)}"
+
+
+def extract_entities(text: str) -> List[str]:
+    """``key=value`` terms of the ENTITY_PATTERNS matches in ``text``."""
+    terms: Set[str] = set()
+    for key, pattern in ENTITY_PATTERNS.items():
+        for match in pattern.finditer(text):
+            terms.add(entity_term(key, match.group(1) if pattern.groups else match.group(0)))
+    return sorted(terms)
+
+
+def _as_list(value: Any) -> List[Any]:
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def _timestamp(value: Any, field: str) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    raise ValueError(f"{field} must be epoch seconds or an ISO 8601 date.")
+
+
+def normalize_entities(entities: Optional[Dict[str, Any]]) -> Optional[Dict[str, List[str]]]:
+    """``{key: value or [values]}`` -> ``{key: sorted [values]}`` (keys lower-cased)."""
+    if entities is None:
+        return None
+    if not isinstance(entities, dict):
+        raise ValueError("entities must be an object of key -> value(s).")
+    return {str(key).lower(): sorted({entity_value(v) for v in _as_list(values)})
+            for key, values in sorted(entities.items())}
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Validates document filters and puts them in a canonical form (so equal
+    filters give equal cache keys). Raises ValueError on unknown fields or
+    malformed values; returns None for no filters.
+
+    Fields combine with AND, the values of one field with OR:
+    ``{"filename": [...], "doc_type": ["pdf"], "uploaded_after": "2024-01-01",
+    "uploaded_before": 1735689600, "entities": {"emp_id": [7, 9]}}``.
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("Document filters must be an object.")
+    unknown = set(filters) - set(FILTER_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown document filter(s) {sorted(unknown)}; use {list(FILTER_FIELDS)}.")
+    normalized: Dict[str, Any] = {}
+    if filters.get("filename") is not None:
+        normalized["filename"] = sorted({str(name) for name in _as_list(filters["filename"])})
+    if filters.get("doc_type") is not None:
+        normalized["doc_type"] = sorted({str(t).lower().lstrip(".") for t in _as_list(filters["doc_type"])})
+    for field in ("uploaded_after", "uploaded_before"):
+        if filters.get(field) is not None:
+            normalized[field] = _timestamp(filters[field], field)
+    if filters.get("entities"):
+        normalized["entities"] = normalize_entities(filters["entities"])
+    return normalized or None
+
+
+def scope_from_result(sql_result: Dict[str, Any], entity_keys: Iterable[str]) -> Optional[Dict[str, List[str]]]:
+    """
+    ``{key: [values]}`` from the first result column named like an indexed
+    entity key, or None when no column matches (or it holds too many distinct
+    values to narrow the search).
+    """
+    keys = {key.lower() for key in entity_keys}
+    for i, column in enumerate(c.lower() for c in sql_result.get("columns") or []):
+        if column in keys:
+            values = {entity_value(row[i]) for row in sql_result.get("rows") or [] if row[i] is not None}
+            if not values or len(values) > HYBRID_SCOPE_MAX_ENTITIES:
+                return None
+            return {column: sorted(values)}
+    return None
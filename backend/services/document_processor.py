@@ -1,98 +1,526 @@
-import io
-from typing import List, Dict
-import pypdf
-import docx
-from sentence_transformers import SentenceTransformer
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 import numpy as np
 import faiss
 
-# The model is thread-safe and can be loaded once globally to save memory and time
-model = SentenceTransformer('all-MiniLM-L6-v2')
+from services.chunk_store import ChunkStore, DocumentStoreView, chunk_hash, content_hash
+from services.document_filters import extract_entities
+from services.embeddings import EMBEDDING_DIM, embedder
+from services.storage import DocumentStorage
+from services.text_extraction import (
+    dynamic_chunking, extract_text_from_docx, extract_text_from_pdf, extract_text_from_txt, file_extension,
+    iter_chunks,
+)
+from services.vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+# Where the index and chunk store are persisted; set to an empty string to keep them in memory only
+DOCUMENT_STORE_DIR = os.getenv("DOCUMENT_STORE_DIR", "data/document_store")
+# Read-only workers never ingest; they pick up new generations written by the ingesting worker
+DOCUMENT_STORE_READ_ONLY = os.getenv("DOCUMENT_STORE_READ_ONLY", "false").lower() in ("1", "true", "yes")
+DOCUMENT_STORE_REFRESH_SECONDS = float(os.getenv("DOCUMENT_STORE_REFRESH_SECONDS", "5"))
+# Concurrent query embeddings are collected for up to this long, or this many texts, per forward pass
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "64"))
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent single-text encode calls into one batched forward pass.
+
+    Callers block in ``encode`` while a background thread collects requests for
+    up to ``window_ms`` after the first one arrives (or until ``max_batch_size``
+    are waiting), runs ``encode_fn`` once on the whole batch and hands each
+    caller its own vector.
+    """
+
+    BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+    def __init__(self, encode_fn, window_ms: float = QUERY_BATCH_WINDOW_MS,
+                 max_batch_size: int = QUERY_BATCH_MAX_SIZE):
+        self._encode_fn = encode_fn
+        self.window_seconds = window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "batches": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0,
+            "batch_size_max": 0,
+            "encode_seconds_total": 0.0,
+            "batch_size_histogram": {str(b): 0 for b in self.BATCH_SIZE_BUCKETS + ("+Inf",)},
+        }
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._thread.start()
+
+    def encode(self, text: str) -> np.ndarray:
+        """Returns the float32 embedding of one text."""
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future.result()
+
+    def _collect(self) -> List:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                vectors = np.asarray(self._encode_fn([text for text, _, _ in batch]), dtype="float32")
+                for (_, future, _), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            self._record(batch, started, time.perf_counter() - started)
+
+    def _record(self, batch: List, started: float, encode_seconds: float):
+        waits = [started - enqueued for _, _, enqueued in batch]
+        bucket = next((str(b) for b in self.BATCH_SIZE_BUCKETS if len(batch) <= b), "+Inf")
+        with self._stats_lock:
+            stats = self._stats
+            stats["requests"] += len(batch)
+            stats["batches"] += 1
+            stats["queue_wait_seconds_total"] += sum(waits)
+            stats["queue_wait_seconds_max"] = max(stats["queue_wait_seconds_max"], max(waits))
+            stats["batch_size_max"] = max(stats["batch_size_max"], len(batch))
+            stats["encode_seconds_total"] += encode_seconds
+            stats["batch_size_histogram"][bucket] += 1
+
+    def metrics(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self._stats, batch_size_histogram=dict(self._stats["batch_size_histogram"]))
+        requests, batches = stats["requests"], stats["batches"]
+        stats["queue_wait_seconds_avg"] = stats["queue_wait_seconds_total"] / requests if requests else 0.0
+        stats["batch_size_avg"] = requests / batches if batches else 0.0
+        stats["pending"] = self._queue.qsize()
+        stats["window_ms"] = self.window_seconds * 1000.0
+        stats["max_batch_size"] = self.max_batch_size
+        return stats
+
+
+# Shared by every QueryEngine in this process so concurrent /query calls batch together
+query_embedder = EmbeddingBatcher(lambda texts: embedder.encode(texts))
+
+
+class _ReadWriteLock:
+    """
+    Many concurrent searches, or one writer. FAISS searches are safe to run in
+    parallel with each other but not with an append that may reallocate storage.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
 
 class DocumentProcessor:
     """A self-contained class to process and store document data."""
-    def __init__(self):
+    def __init__(self, storage_dir: Optional[str] = DOCUMENT_STORE_DIR,
+                 read_only: bool = DOCUMENT_STORE_READ_ONLY):
         """
-        Initializes instance-specific storage. This is the key fix.
+        Initializes instance-specific storage, loading the last saved generation
+        from ``storage_dir`` when there is one.
         """
-        self.documents_store: Dict[str, Dict] = {}
-        embedding_dim = 384  # model output dim
-        self.vector_index = faiss.IndexFlatL2(embedding_dim)
+        self.storage = DocumentStorage(storage_dir) if storage_dir else None
+        self.read_only = read_only
+        self._generation: Optional[str] = None
+        self._index_mmapped = False
+        self._last_refresh_check = 0.0
+        # Guards vector_index + chunk_store: appends and swaps are exclusive, searches shared
+        self._rw_lock = _ReadWriteLock()
+        # One file is added, replaced or deleted at a time
+        self._document_lock = threading.Lock()
 
-    def _extract_text_from_pdf(self, file_content: bytes) -> str:
+        self._set_chunk_store(ChunkStore())
+        self.vector_index = VectorIndex(EMBEDDING_DIM)
+
+        if self.storage:
+            self._load_from_storage()
+
+    def _set_chunk_store(self, chunk_store: ChunkStore):
+        self.chunk_store = chunk_store
+        # Compatibility view: doc_id -> {"filename", "chunk", "embedding_id"}
+        self.documents_store: DocumentStoreView = DocumentStoreView(chunk_store)
+
+    # -------------------------
+    # Persistence
+    # -------------------------
+    def _load_from_storage(self):
         try:
-            reader = pypdf.PdfReader(io.BytesIO(file_content))
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() or ""
-            return text
+            loaded = self.storage.load(mmap=True)
         except Exception as e:
-            print(f"Error reading PDF: {e}")
-            return ""
+            logger.error("Error loading document store from %s: %s", self.storage.directory, e)
+            return
+        if loaded is None:
+            return
+        vector_index, chunk_store, generation, index_mmapped = loaded
+        with self._rw_lock.write():
+            self.vector_index = VectorIndex.wrap(vector_index, deleted_ids=chunk_store.deleted)
+            self._set_chunk_store(chunk_store)
+            self._generation = generation
+            self._index_mmapped = index_mmapped
+        logger.info("Loaded document store generation %s: %d chunks", generation, chunk_store.live_count())
+
+    def refresh(self):
+        """
+        Lets read-only workers pick up a newer generation saved by the ingesting
+        worker. Cheap to call per request: it stats the storage at most every
+        DOCUMENT_STORE_REFRESH_SECONDS.
+        """
+        if not (self.storage and self.read_only):
+            return
+        now = time.time()
+        if now - self._last_refresh_check < DOCUMENT_STORE_REFRESH_SECONDS:
+            return
+        self._last_refresh_check = now
+        if self.storage.current_generation() != self._generation:
+            self._load_from_storage()
+
+    def _ensure_index_writable(self):
+        # A memory-mapped index is read-only; read it fully before the first append
+        if self._index_mmapped:
+            self.vector_index = VectorIndex.wrap(faiss.read_index(self.storage.index_path(self._generation)),
+                                                 deleted_ids=self.chunk_store.deleted)
+            self._index_mmapped = False
+
+    def persist(self):
+        """
+        Saves the current index and chunk store as a new generation. Searches keep
+        running during the write; only appends wait for it.
+        """
+        if not self.storage:
+            return
+        with self._rw_lock.read():
+            saved_revision = self.chunk_store.revision
+            path = self.storage.save(self.vector_index.index, self.chunk_store)
+        with self._rw_lock.write():
+            self._generation = os.path.basename(path)
+            # Re-map the chunk store from the new generation so the in-memory tail
+            # is released, unless it changed after the save
+            if self.chunk_store.revision == saved_revision:
+                self._set_chunk_store(ChunkStore.open(path, mmap=True))
+
+    # -------------------------
+    # Extraction (kept for callers of the old private helpers)
+    # -------------------------
+    def _extract_text_from_pdf(self, file_content: bytes) -> str:
+        return extract_text_from_pdf(file_content)
 
     def _extract_text_from_docx(self, file_content: bytes) -> str:
-        try:
-            doc = docx.Document(io.BytesIO(file_content))
-            return "\n".join([p.text for p in doc.paragraphs])
-        except Exception as e:
-            print(f"Error reading DOCX: {e}")
-            return ""
+        return extract_text_from_docx(file_content)
 
     def _extract_text_from_txt(self, file_content: bytes) -> str:
-        return file_content.decode('utf-8', errors='ignore')
+        return extract_text_from_txt(file_content)
 
     def _dynamic_chunking(self, content: str) -> List[str]:
-        chunks = content.split('\n\n')
-        return [c.strip() for c in chunks if c.strip()]
+        return dynamic_chunking(content)
+
+    # -------------------------
+    # Embedding + indexing
+    # -------------------------
+    def embed_chunks(self, chunks: List[str], on_batch=None) -> np.ndarray:
+        """
+        Encodes chunks in EMBEDDING_BATCH_SIZE batches. ``on_batch(n)`` is called
+        after each batch with the number of chunks just embedded.
+        """
+        vectors = []
+        for start in range(0, len(chunks), EMBEDDING_BATCH_SIZE):
+            batch = chunks[start:start + EMBEDDING_BATCH_SIZE]
+            vectors.append(embedder.encode(batch, batch_size=EMBEDDING_BATCH_SIZE))
+            if on_batch:
+                on_batch(len(batch))
+        return np.vstack(vectors) if vectors else np.empty((0, self.vector_index.dim), dtype="float32")
+
+    def add_embedded_chunks(self, filename: str, chunks: List[str], embeddings: np.ndarray,
+                            positions: Optional[List[int]] = None) -> int:
+        """
+        Appends chunks of one file and their vectors; ``positions`` places them in
+        the file (default 0, 1, ...). Appends are serialized, so several ingestion
+        jobs can call this concurrently. Returns the first embedding id.
+        """
+        if self.read_only:
+            raise PermissionError("This worker's document store is read-only.")
+        with self._rw_lock.write():
+            self._ensure_index_writable()
+            entities = [extract_entities(chunk) for chunk in chunks]
+            # The chunk id is the next chunk store row
+            first_id = len(self.chunk_store)
+            ids = np.arange(first_id, first_id + len(chunks), dtype="int64")
+            self.vector_index.add(embeddings, ids)
+            try:
+                return self.chunk_store.add_chunks(filename, chunks, positions, entities=entities)
+            except Exception:
+                # Without their rows these ids would be handed out again by the next append
+                self.vector_index.remove(ids)
+                raise
+
+    def index_chunks(self, filename: str, chunks: Iterable[str], on_batch=None,
+                     stages: Optional[Dict[str, float]] = None) -> int:
+        """
+        Embeds and appends a file's chunks EMBEDDING_BATCH_SIZE at a time, so only
+        one batch of text and vectors is held whatever the file size. ``chunks``
+        may be a generator. Time spent embedding and appending is added to
+        ``stages["ingest_embed"]`` / ``stages["ingest_index"]``. Returns the
+        number of chunks indexed.
+        """
+        return self._index_positioned(filename, enumerate(chunks), on_batch, stages)
+
+    def _index_positioned(self, filename: str, chunks: Iterable[Tuple[int, str]], on_batch=None,
+                          stages: Optional[Dict[str, float]] = None, added: Optional[List[int]] = None) -> int:
+        """``added``, when given, collects the ids appended so far."""
+        stages = {} if stages is None else stages
+        indexed = 0
+        iterator = iter(chunks)
+        while True:
+            batch = list(itertools.islice(iterator, EMBEDDING_BATCH_SIZE))
+            if not batch:
+                return indexed
+            positions, texts = [p for p, _ in batch], [t for _, t in batch]
+            start = time.perf_counter()
+            embeddings = self.embed_chunks(texts)
+            embedded = time.perf_counter()
+            first_id = self.add_embedded_chunks(filename, texts, embeddings, positions)
+            if added is not None:
+                added.extend(range(first_id, first_id + len(texts)))
+            stages["ingest_embed"] = stages.get("ingest_embed", 0.0) + embedded - start
+            stages["ingest_index"] = stages.get("ingest_index", 0.0) + time.perf_counter() - embedded
+            indexed += len(batch)
+            if on_batch:
+                on_batch(len(batch))
+
+    # -------------------------
+    # Documents (add / replace / delete by filename)
+    # -------------------------
+    def is_unchanged(self, filename: str, content: bytes, entities: Optional[Dict[str, List[str]]] = None) -> bool:
+        """
+        True when ``filename`` is indexed with exactly this content (and these
+        entity keys, unless ``entities`` is None).
+        """
+        with self._rw_lock.read():
+            return self.chunk_store.file_hashes.get(filename) == content_hash(content) and (
+                entities is None or self.chunk_store.file_meta.get(filename, {}).get("entities", {}) == entities)
+
+    def upsert_document(self, filename: str, content: bytes, chunks: Optional[Iterable[str]] = None,
+                        on_batch=None, stages: Optional[Dict[str, float]] = None,
+                        entities: Optional[Dict[str, List[str]]] = None) -> Dict:
+        """
+        Adds a file, or replaces the indexed version of the same filename in place.
+
+        An identical file (same content hash) is left alone. Otherwise only chunks
+        whose content hash is not among the file's current chunks are embedded;
+        unchanged chunks keep their ids and vectors, and chunks that no longer
+        occur are removed once the new ones are indexed. ``chunks`` are the
+        file's chunks if already extracted (any iterable, e.g. a stream from an
+        extraction worker). If it raises, the chunks indexed from it so far are
+        removed again and the file stays as it was. ``on_batch(n)`` reports
+        embedded chunks, then the reused ones.
+
+        ``entities`` (normalized, see document_filters.normalize_entities) tags
+        every chunk of the file; None keeps the file's current ones. Changing
+        only the entities of an identical file updates its metadata ("updated").
+        """
+        if self.read_only:
+            raise PermissionError("This worker's document store is read-only.")
+        digest = content_hash(content)
+        with self._document_lock:
+            with self._rw_lock.read():
+                existing = self.chunk_store.file_chunk_ids(filename)
+                previous_meta = self.chunk_store.file_meta.get(filename, {})
+                if entities is None:
+                    entities = previous_meta.get("entities", {})
+                same_content = bool(existing) and self.chunk_store.file_hashes.get(filename) == digest
+                if same_content and previous_meta.get("entities", {}) == entities:
+                    return {"filename": filename, "status": "unchanged", "chunks": len(existing),
+                            "embedded": 0, "reused": len(existing), "removed": 0}
+                reusable: Dict[int, List[int]] = {}
+                for embedding_id in existing:
+                    reusable.setdefault(self.chunk_store.hash(embedding_id), []).append(embedding_id)
+            if same_content:
+                # Only the entity keys changed; the chunks and vectors stay as they are
+                with self._rw_lock.write():
+                    self.chunk_store.set_file_meta(filename, dict(previous_meta, entities=entities))
+                return {"filename": filename, "status": "updated", "chunks": len(existing),
+                        "embedded": 0, "reused": len(existing), "removed": 0}
+
+            reused: List[int] = []
+
+            def new_chunks():
+                for position, chunk in enumerate(iter_chunks(filename, content) if chunks is None else chunks):
+                    ids = reusable.get(chunk_hash(chunk))
+                    if ids:
+                        reused.append(ids.pop(0))
+                    else:
+                        yield position, chunk
+
+            added: List[int] = []
+            try:
+                embedded = self._index_positioned(filename, new_chunks(), on_batch, stages, added)
+            except Exception:
+                if added:
+                    with self._rw_lock.write():
+                        self._ensure_index_writable()
+                        self.vector_index.remove(added)
+                        self.chunk_store.delete(added)
+                raise
+            if on_batch and reused:
+                on_batch(len(reused))
+            stale = [i for ids in reusable.values() for i in ids]
+            with self._rw_lock.write():
+                if stale:
+                    self._ensure_index_writable()
+                    self.vector_index.remove(stale)
+                    self.chunk_store.delete(stale)
+                total = embedded + len(reused)
+                self.chunk_store.set_file_hash(filename, digest if total else None)
+                self.chunk_store.set_file_meta(filename, {
+                    "doc_type": file_extension(filename), "uploaded_at": time.time(), "entities": entities,
+                } if total else None)
+
+        if existing:
+            status = "replaced"
+        else:
+            status = "added" if total else "empty"
+        return {"filename": filename, "status": status, "chunks": total,
+                "embedded": embedded, "reused": len(reused), "removed": len(stale)}
+
+    def delete_document(self, filename: str) -> int:
+        """Removes every chunk of ``filename``. Returns how many were removed."""
+        if self.read_only:
+            raise PermissionError("This worker's document store is read-only.")
+        with self._document_lock, self._rw_lock.write():
+            ids = self.chunk_store.file_chunk_ids(filename)
+            if ids:
+                self._ensure_index_writable()
+                self.vector_index.remove(ids)
+                self.chunk_store.delete(ids)
+            self.chunk_store.set_file_hash(filename, None)
+            self.chunk_store.set_file_meta(filename, None)
+            return len(ids)
+
+    def list_documents(self) -> List[Dict]:
+        with self._rw_lock.read():
+            return [
+                {"filename": name, "chunks": count, "content_hash": self.chunk_store.file_hashes.get(name),
+                 **self.chunk_store.file_meta.get(name, {})}
+                for name, count in sorted(self.chunk_store.live_filenames().items())
+            ]
+
+    def entity_keys(self) -> Set[str]:
+        with self._rw_lock.read():
+            return self.chunk_store.entity_keys()
+
+    def select(self, filters: Dict) -> np.ndarray:
+        """Ids of the live chunks matching normalized ``filters``."""
+        with self._rw_lock.read():
+            return self.chunk_store.select(filters)
+
+    def search(self, query_vectors: np.ndarray, top_k: int, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None, filters: Optional[Dict] = None) -> List[Dict]:
+        """
+        Searches the index for a single query vector and resolves the hits to chunk metadata.
+        ``filters`` (normalized, see document_filters.normalize_filters) restricts
+        the search to the matching chunks.
+        """
+        with self._rw_lock.read():
+            candidates = self.chunk_store.select(filters) if filters else None
+            if candidates is not None and not len(candidates):
+                return []
+            distances, indices = self.vector_index.search(
+                query_vectors, top_k, nprobe=nprobe, ef_search=ef_search, ids=candidates
+            )
+            results = []
+            for idx, dist in zip(indices[0], distances[0]):
+                meta = self.chunk_store.get(int(idx))  # -1 (no hit) returns None
+                if meta is None:
+                    continue
+                meta["distance"] = float(dist)
+                results.append(meta)
+            return results
 
     def process_documents(self, files: List[Dict]) -> Dict:
         """
-        Processes documents using the instance's own vector_index and documents_store.
-        No more 'global' keyword.
+        Synchronously processes documents into the instance's own vector_index and
+        chunk_store, then saves the batch to the storage directory. The API uses
+        the background pipeline in services.ingestion_jobs instead.
         """
+        if self.read_only:
+            raise PermissionError("This worker's document store is read-only.")
+
         processed_files = []
-        doc_id_counter = len(self.documents_store)
+        unchanged_files = []
 
         for file in files:
-            filename = file['filename']
-            content = file['content']
-            ext = filename.split('.')[-1].lower()
-
-            text = ""
-            if ext == 'pdf':
-                text = self._extract_text_from_pdf(content)
-            elif ext == 'docx':
-                text = self._extract_text_from_docx(content)
-            elif ext == 'txt':
-                text = self._extract_text_from_txt(content)
-            else:
-                continue
-
-            if not text:
-                continue
-
-            chunks = self._dynamic_chunking(text)
-            if not chunks:
-                continue
-
-            embeddings = model.encode(chunks, convert_to_tensor=False)
-
-            for i, chunk in enumerate(chunks):
-                doc_id = f"{filename}_{doc_id_counter + i}"
-                self.documents_store[doc_id] = {
-                    "filename": filename,
-                    "chunk": chunk,
-                    "embedding_id": self.vector_index.ntotal + i
-                }
-
-            self.vector_index.add(np.array(embeddings).astype('float32'))
-            processed_files.append(filename)
-            doc_id_counter += len(chunks)
+            # Pages are extracted, chunked and embedded as the chunks are consumed
+            result = self.upsert_document(file['filename'], file['content'])
+            if result["status"] in ("added", "replaced", "updated"):
+                processed_files.append(file['filename'])
+            elif result["status"] == "unchanged":
+                unchanged_files.append(file['filename'])
+
+        if processed_files:
+            self.persist()
 
         return {
             "status": "success",
             "processed_files": processed_files,
+            "unchanged_files": unchanged_files,
             "total_documents_processed": len(processed_files),
-            "total_chunks_indexed": self.vector_index.ntotal
+            "total_chunks_indexed": self.vector_index.live_count
         }
-
@@ -0,0 +1,110 @@
+import importlib.util
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# torch (default) | int8 (Linear layers dynamically quantized, CPU) | onnx (ONNX Runtime)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+# ONNX file inside the model repository, e.g. onnx/model_qint8_avx2.onnx for a quantized export
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "")
+# Output size of the model; the vector index is created with it before the model is loaded
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "384"))
+
+EMBEDDING_BACKENDS = ("torch", "int8", "onnx")
+
+logger = logging.getLogger(__name__)
+
+
+def load_model(model_name: str = EMBEDDING_MODEL, backend: str = EMBEDDING_BACKEND,
+               onnx_file: str = EMBEDDING_ONNX_FILE):
+    """Loads a sentence-transformers model on the requested backend."""
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}'. Expected one of {EMBEDDING_BACKENDS}.")
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "onnx":
+        if not all(importlib.util.find_spec(name) for name in ("onnxruntime", "optimum")):
+            raise RuntimeError("EMBEDDING_BACKEND=onnx needs optimum and onnxruntime "
+                               "(pip install 'sentence-transformers[onnx]').")
+        return SentenceTransformer(model_name, backend="onnx",
+                                   model_kwargs={"file_name": onnx_file} if onnx_file else None)
+
+    if backend == "int8":
+        import torch
+        from torch.ao.quantization import quantize_dynamic
+
+        # Dynamic quantization runs on CPU only; weights are int8, activations quantized per batch
+        model = SentenceTransformer(model_name, device="cpu")
+        return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return SentenceTransformer(model_name)
+
+
+class Embedder:
+    """
+    Sentence embedding model loaded on first use rather than at import, so
+    workers that never embed (or start before they serve traffic) do not pay
+    for it. ``warm_up`` loads it ahead of the first request.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, backend: str = EMBEDDING_BACKEND,
+                 dim: int = EMBEDDING_DIM):
+        self.model_name = model_name
+        self.backend = backend
+        self.dim = dim
+        self._model = None
+        self._lock = threading.Lock()
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    try:
+                        model = load_model(self.model_name, self.backend)
+                    except (OSError, ImportError) as e:
+                        raise RuntimeError(f"Could not load embedding model {self.model_name} "
+                                           f"({self.backend}): {e}") from e
+                    dim = model.get_sentence_embedding_dimension()
+                    if dim != self.dim:
+                        raise RuntimeError(f"{self.model_name} produces {dim}-dimensional embeddings; "
+                                           f"set EMBEDDING_DIM={dim} and rebuild the document store.")
+                    self.load_seconds = time.perf_counter() - start
+                    logger.info("Loaded embedding model %s (%s) in %.2fs",
+                                self.model_name, self.backend, self.load_seconds)
+                    self._model = model
+        return self._model
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32) -> np.ndarray:
+        """float32 embeddings of ``texts`` (one vector for a single string)."""
+        return np.asarray(self.model.encode(texts, batch_size=batch_size, convert_to_tensor=False),
+                          dtype="float32")
+
+    def warm_up(self) -> Dict:
+        """Loads the model and runs one forward pass; returns timings."""
+        start = time.perf_counter()
+        self.encode(["warm-up"])
+        return {**self.status(), "warm_up_seconds": time.perf_counter() - start}
+
+    def status(self) -> Dict:
+        return {
+            "model": self.model_name,
+            "backend": self.backend,
+            "dimension": self.dim,
+            "loaded": self.loaded,
+            "load_seconds": self.load_seconds,
+        }
+
+
+# Shared by the document processor, the query embedder and the schema index
+embedder = Embedder()
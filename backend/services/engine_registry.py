@@ -0,0 +1,194 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from services.document_processor import DocumentProcessor
+from services.query_engine import QueryEngine, query_cache
+
+# Connected databases kept at once; the least recently used one is closed beyond this
+ENGINE_REGISTRY_MAX_ENGINES = int(os.getenv("ENGINE_REGISTRY_MAX_ENGINES", "8"))
+# Engines unused for this long are closed (0 = never)
+ENGINE_IDLE_SECONDS = float(os.getenv("ENGINE_IDLE_SECONDS", "1800"))
+DEFAULT_CONNECTION_ID = "default"
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("connection_id", "engine", "connect_lock", "created_at", "last_used", "active", "closing",
+                 "connecting")
+
+    def __init__(self, connection_id: str, engine: QueryEngine):
+        self.connection_id = connection_id
+        self.engine = engine
+        self.connect_lock = threading.Lock()
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.active = 0  # requests holding the engine (see EngineRegistry.acquire)
+        self.closing = False  # removed while held; closed by the last release
+        self.connecting = 0  # connect() calls in progress; never evicted meanwhile
+
+
+class EngineRegistry:
+    """
+    QueryEngines keyed by connection id, so several databases can be served at
+    once without overwriting each other.
+
+    Each engine has its own connection pool, schema, fingerprint and cache
+    namespace; the document processor is shared. Reconnecting an id to the same
+    connection string keeps its pool and only rediscovers the schema. Engines
+    are closed when they have been idle for ENGINE_IDLE_SECONDS, or when more
+    than ENGINE_REGISTRY_MAX_ENGINES are connected (least recently used first).
+
+    Requests hold their engine between ``acquire`` and ``release``. Eviction
+    skips held engines (the registry may briefly exceed its bound), and an
+    engine removed while held is closed by its last release.
+    """
+
+    def __init__(self, doc_processor: DocumentProcessor, max_engines: int = ENGINE_REGISTRY_MAX_ENGINES,
+                 idle_seconds: float = ENGINE_IDLE_SECONDS):
+        self.doc_processor = doc_processor
+        self.max_engines = max(1, max_engines)
+        self.idle_seconds = idle_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._held: Dict[int, _Entry] = {}  # id(engine) -> entry, while acquired
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def connect(self, connection_string: str, connection_id: Optional[str] = None) -> Tuple[str, QueryEngine]:
+        """
+        Connects ``connection_id`` (default: "default") and discovers its schema.
+        Raises RuntimeError when the database cannot be reached (a new id is then
+        dropped again; a connected one keeps its database); schema discovery
+        errors are left in ``engine.schema["error"]``.
+        """
+        connection_id = connection_id or DEFAULT_CONNECTION_ID
+        with self._lock:
+            entry = self._entries.get(connection_id)
+            if entry is None:
+                entry = self._entries[connection_id] = _Entry(
+                    connection_id, QueryEngine(doc_processor=self.doc_processor, cache_namespace=connection_id)
+                )
+            entry.last_used = time.time()
+            entry.connecting += 1
+            self._entries.move_to_end(connection_id)
+        try:
+            with entry.connect_lock:
+                entry.engine.connect_db(connection_string)
+        finally:
+            with self._lock:
+                entry.connecting -= 1
+                failed = entry.engine.engine is None
+                if failed and not (entry.connecting or entry.active) and self._entries.get(connection_id) is entry:
+                    del self._entries[connection_id]
+        self._evict(keep=connection_id)
+        return connection_id, entry.engine
+
+    def acquire(self, connection_id: Optional[str] = None) -> Optional[QueryEngine]:
+        """
+        The engine for ``connection_id`` (marked as used), or None. It is not
+        closed until the matching ``release``.
+        """
+        connection_id = connection_id or DEFAULT_CONNECTION_ID
+        self._evict(keep=connection_id)
+        with self._lock:
+            entry = self._entries.get(connection_id)
+            if entry is None or entry.engine.engine is None:
+                return None
+            entry.active += 1
+            entry.last_used = time.time()
+            self._entries.move_to_end(connection_id)
+            self._held[id(entry.engine)] = entry
+            return entry.engine
+
+    def release(self, engine: QueryEngine):
+        with self._lock:
+            entry = self._held[id(engine)]
+            entry.active -= 1
+            entry.last_used = time.time()
+            if entry.active:
+                return
+            del self._held[id(engine)]
+            if not entry.closing:
+                return
+        self._close(entry)
+
+    def remove(self, connection_id: str) -> bool:
+        with self._lock:
+            entry = self._entries.pop(connection_id, None)
+            if entry is None:
+                return False
+            if entry.active:
+                entry.closing = True
+                return True
+        self._close(entry)
+        return True
+
+    def _evict(self, keep: Optional[str] = None):
+        now = time.time()
+        evicted: List[_Entry] = []
+        with self._lock:
+            idle = [cid for cid, entry in self._entries.items()
+                    if cid != keep and not (entry.active or entry.connecting)]
+            if self.idle_seconds > 0:
+                for cid in list(idle):
+                    if now - self._entries[cid].last_used > self.idle_seconds:
+                        idle.remove(cid)
+                        evicted.append(self._entries.pop(cid))
+            # Least recently used first; held engines stay until they are released
+            while len(self._entries) > self.max_engines and idle:
+                evicted.append(self._entries.pop(idle.pop(0)))
+            self.evictions += len(evicted)
+        for entry in evicted:
+            self._close(entry)
+
+    def _close(self, entry: _Entry):
+        logger.info("Closing database connection '%s'", entry.connection_id)
+        entry.engine.close()
+
+    def close_all(self):
+        """Closes every engine, held or not (shutdown)."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            self._close(entry)
+
+    # -------------------------
+    # Introspection
+    # -------------------------
+    def engines(self) -> Dict[str, QueryEngine]:
+        with self._lock:
+            return {cid: entry.engine for cid, entry in self._entries.items()}
+
+    def list(self) -> List[Dict]:
+        now = time.time()
+        with self._lock:
+            entries = list(self._entries.items())
+        return [
+            {
+                "connection_id": cid,
+                "dialect": entry.engine.engine.dialect.name if entry.engine.engine is not None else None,
+                "tables": len(entry.engine.schema.get("tables", [])),
+                "schema_fingerprint": entry.engine.schema_fingerprint,
+                "connected_at": entry.created_at,
+                "idle_seconds": now - entry.last_used,
+                "active_requests": entry.active,
+            }
+            for cid, entry in entries
+        ]
+
+    def invalidate_tables(self, tables: Iterable[str], connection_id: Optional[str] = None) -> int:
+        """
+        Drops cached answers that read ``tables`` on one connection, or on every
+        connected database when ``connection_id`` is None.
+        """
+        tables = list(tables)
+        engines = self.engines()
+        if connection_id is not None:
+            engines = {connection_id: engines[connection_id]} if connection_id in engines else {}
+        tags = [tag for engine in engines.values() for tag in engine.table_tags(tables)]
+        return query_cache.invalidate_tables(tags) if tags else 0
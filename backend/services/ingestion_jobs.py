@@ -0,0 +1,323 @@
+import copy
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+from services.document_processor import DocumentProcessor
+from services.metrics import STAGE_SECONDS, registry, timed_stage
+from services.text_extraction import SUPPORTED_EXTENSIONS, extract_chunks_to_queue, file_extension, iter_chunks
+
+logger = logging.getLogger(__name__)
+
+# Extraction (PDF/DOCX parsing) is CPU-bound and holds the GIL, so it runs in worker processes
+INGESTION_PROCESS_WORKERS = int(os.getenv("INGESTION_PROCESS_WORKERS", "2"))
+# Chunk batches (EXTRACT_BATCH_CHUNKS each) a worker may get ahead of embedding, per file
+INGESTION_QUEUE_BATCHES = int(os.getenv("INGESTION_QUEUE_BATCHES", "4"))
+# Jobs run one after another; embedding already uses every core
+INGESTION_MAX_CONCURRENT_JOBS = int(os.getenv("INGESTION_MAX_CONCURRENT_JOBS", "1"))
+INGESTION_JOB_HISTORY = int(os.getenv("INGESTION_JOB_HISTORY", "200"))
+
+INGESTION_JOBS = registry.counter("nlq_ingestion_jobs_total", "Finished ingestion jobs by status.",
+                                  labels=("status",))
+INGESTED_CHUNKS = registry.counter("nlq_ingested_chunks_total", "Chunks embedded and indexed.")
+
+
+class ExtractionError(Exception):
+    """Text extraction of one file failed; the other files of the job go on."""
+
+
+class IngestionJobManager:
+    """
+    Runs document uploads as background jobs so request handlers return at once.
+
+    Each job is a staged pipeline: files are extracted and chunked in a process
+    pool that streams chunks back through bounded queues, chunks are embedded
+    in batches on the job thread as they arrive, and the resulting
+    vectors are appended to the shared index under DocumentProcessor's write lock.
+    The document store is saved once per job. A file already indexed under the
+    same name is replaced in place (see ``DocumentProcessor.upsert_document``);
+    an identical one is not extracted again. Job state is kept in memory and
+    exposed through ``get``. ``on_indexed`` is called after a job changed the index.
+    """
+
+    def __init__(self, doc_processor: DocumentProcessor, process_workers: int = INGESTION_PROCESS_WORKERS,
+                 on_indexed: Optional[Callable[[], None]] = None):
+        self.doc_processor = doc_processor
+        self.process_workers = process_workers
+        self.on_indexed = on_indexed
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.active_jobs = 0  # queued or running
+        self._job_pool = ThreadPoolExecutor(max_workers=INGESTION_MAX_CONCURRENT_JOBS,
+                                            thread_name_prefix="ingestion")
+        self._extract_pool: Optional[ProcessPoolExecutor] = None
+        self._queue_manager = None
+
+    def _extraction_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.process_workers <= 0:
+            return None
+        if self._extract_pool is None:
+            # spawn: forking a process that already runs torch threads can deadlock
+            context = multiprocessing.get_context("spawn")
+            self._extract_pool = ProcessPoolExecutor(max_workers=self.process_workers, mp_context=context)
+            # Pool workers can only reach queues served by a manager process
+            self._queue_manager = context.Manager()
+        return self._extract_pool
+
+    def shutdown(self):
+        self._job_pool.shutdown(wait=False, cancel_futures=True)
+        if self._extract_pool is not None:
+            self._extract_pool.shutdown(wait=False, cancel_futures=True)
+        if self._queue_manager is not None:
+            self._queue_manager.shutdown()
+
+    # -------------------------
+    # Job state
+    # -------------------------
+    def submit(self, files: List[Dict]) -> Dict:
+        """
+        Queues ``[{"filename", "content", "entities"?}]`` for ingestion and returns the job record.
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "files": [
+                {
+                    "filename": f["filename"],
+                    "size_bytes": len(f["content"]),
+                    "status": "pending",
+                    "chunks_total": 0,
+                    "chunks_embedded": 0,
+                    "chunks_reused": 0,
+                    "chunks_removed": 0,
+                    "error": None,
+                }
+                for f in files
+            ],
+            "files_total": len(files),
+            "files_done": 0,
+            "chunks_indexed": 0,
+            "chunks_per_second": 0.0,
+            "elapsed_seconds": 0.0,
+            "stages": {},  # seconds per stage, summed over files (extraction overlaps the others)
+            "errors": [],
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self.active_jobs += 1
+            while len(self._jobs) > INGESTION_JOB_HISTORY:
+                self._jobs.popitem(last=False)
+        self._job_pool.submit(self._run, job_id, files)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return copy.deepcopy(job) if job else None
+
+    def list_jobs(self, limit: int = 20) -> List[Dict]:
+        with self._lock:
+            return [copy.deepcopy(j) for j in list(self._jobs.values())[-limit:][::-1]]
+
+    def _update_file(self, job: Dict, i: int, **fields):
+        with self._lock:
+            job["files"][i].update(fields)
+            if fields.get("status") in ("indexed", "unchanged", "skipped", "failed"):
+                job["files_done"] += 1
+            if fields.get("error"):
+                job["errors"].append(f"{job['files'][i]['filename']}: {fields['error']}")
+
+    @contextmanager
+    def _stage(self, job: Dict, name: str):
+        # Job records are only touched under the lock, so time into a scratch dict first
+        stages: Dict[str, float] = {}
+        try:
+            with timed_stage(stages, name):
+                yield
+        finally:
+            self._add_stage_time(job, name, stages[name])
+
+    def _add_stage_time(self, job: Dict, name: str, seconds: float):
+        with self._lock:
+            job["stages"][name] = job["stages"].get(name, 0.0) + seconds
+
+    def _add_extracted(self, job: Dict, i: int, n: int):
+        with self._lock:
+            job["files"][i]["chunks_total"] += n
+
+    def _add_embedded(self, job: Dict, i: int, n: int):
+        with self._lock:
+            job["files"][i]["chunks_embedded"] += n
+            elapsed = time.time() - job["started_at"]
+            embedded = sum(f["chunks_embedded"] for f in job["files"])
+            job["elapsed_seconds"] = elapsed
+            job["chunks_per_second"] = embedded / elapsed if elapsed > 0 else 0.0
+
+    # -------------------------
+    # Pipeline
+    # -------------------------
+    def _run(self, job_id: str, files: List[Dict]):
+        job = self._jobs.get(job_id)
+        if job is None:
+            with self._lock:
+                self.active_jobs -= 1
+            return
+        with self._lock:
+            job["status"] = "running"
+            job["started_at"] = time.time()
+
+        try:
+            indexed = 0
+            changed = False
+            for i, chunks in self._extracted(job, files):
+                self._update_file(job, i, status="embedding")
+                # Each batch is appended as soon as it is embedded
+                stages: Dict[str, float] = {}
+                try:
+                    result = self.doc_processor.upsert_document(
+                        files[i]["filename"], files[i]["content"], chunks=chunks, stages=stages,
+                        on_batch=lambda n, i=i: self._add_embedded(job, i, n),
+                        entities=files[i].get("entities"),
+                    )
+                except ExtractionError as e:
+                    # upsert_document already dropped the chunks indexed before the failure
+                    self._update_file(job, i, status="failed", error=f"Extraction failed: {e}")
+                    continue
+                finally:
+                    for name, seconds in stages.items():
+                        STAGE_SECONDS.observe(seconds, stage=name)
+                        self._add_stage_time(job, name, seconds)
+                if result["status"] == "empty":
+                    self._update_file(job, i, status="skipped", error="No text could be extracted.")
+                    continue
+                indexed += result["chunks"]
+                changed = changed or result["status"] != "unchanged"
+                INGESTED_CHUNKS.inc(result["embedded"])
+                self._update_file(job, i, status="unchanged" if result["status"] == "unchanged" else "indexed",
+                                  chunks_total=result["chunks"], chunks_reused=result["reused"],
+                                  chunks_removed=result["removed"])
+                with self._lock:
+                    job["chunks_indexed"] = indexed
+
+            if changed:
+                with self._stage(job, "ingest_persist"):
+                    self.doc_processor.persist()
+                if self.on_indexed is not None:
+                    self.on_indexed()
+            status = "completed_with_errors" if job["errors"] else "completed"
+        except Exception as e:
+            logger.exception("Ingestion job %s failed", job_id)
+            with self._lock:
+                job["errors"].append(str(e))
+            status = "failed"
+
+        INGESTION_JOBS.inc(status=status)
+        with self._lock:
+            job["status"] = status
+            job["finished_at"] = time.time()
+            self.active_jobs -= 1
+            job["elapsed_seconds"] = job["finished_at"] - job["started_at"]
+            if job["elapsed_seconds"] > 0:
+                job["chunks_per_second"] = job["chunks_indexed"] / job["elapsed_seconds"]
+
+    def _extracted(self, job: Dict, files: List[Dict]):
+        """
+        Yields ``(file_index, chunks)`` in file order. ``chunks`` is an iterator
+        fed by the file's extraction worker a batch at a time, so embedding of a
+        file starts with its first chunks while later files are extracted.
+        """
+        pending = []
+        for i, f in enumerate(files):
+            if file_extension(f["filename"]) not in SUPPORTED_EXTENSIONS:
+                self._update_file(job, i, status="skipped", error="Unsupported file type.")
+            elif self.doc_processor.is_unchanged(f["filename"], f["content"], f.get("entities")):
+                self._update_file(job, i, status="unchanged")
+            else:
+                self._update_file(job, i, status="extracting")
+                pending.append(i)
+
+        pool = self._extraction_pool()
+        if pool is None:
+            for i in pending:
+                yield i, self._local_chunks(job, i, files[i])
+            return
+
+        # Files are consumed in submission order, so the one being read is always
+        # running (or done) and a full queue only ever holds back later files
+        streams = {}
+        for i in pending:
+            chunk_queue = self._queue_manager.Queue(INGESTION_QUEUE_BATCHES)
+            future = pool.submit(extract_chunks_to_queue, files[i]["filename"], files[i]["content"], chunk_queue)
+            streams[i] = (future, chunk_queue)
+        try:
+            for i in pending:
+                yield i, self._queued_chunks(job, i, *streams[i])
+        finally:
+            # Job aborted: release workers blocked on queues nobody will read
+            for future, chunk_queue in streams.values():
+                if not future.cancel():
+                    self._drain(future, chunk_queue)
+
+    def _local_chunks(self, job: Dict, i: int, f: Dict) -> Iterator[str]:
+        """Extraction on the job thread (INGESTION_PROCESS_WORKERS=0)."""
+        seconds = 0.0
+        chunks = iter_chunks(f["filename"], f["content"])
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            except Exception as e:
+                raise ExtractionError(str(e)) from e
+            finally:
+                seconds += time.perf_counter() - start
+            self._add_extracted(job, i, 1)
+            yield chunk
+        STAGE_SECONDS.observe(seconds, stage="ingest_extract")
+        self._add_stage_time(job, "ingest_extract", seconds)
+
+    def _queued_chunks(self, job: Dict, i: int, future, chunk_queue) -> Iterator[str]:
+        """Chunks of one file as its pool worker puts them on ``chunk_queue``."""
+        finished = False
+        try:
+            while True:
+                try:
+                    batch = chunk_queue.get(timeout=0.5)
+                except queue.Empty:
+                    # A worker that returned normally has queued its end marker already
+                    if future.done() and future.exception() is not None:
+                        raise ExtractionError(str(future.exception()))
+                    continue
+                if batch is None:
+                    break
+                self._add_extracted(job, i, len(batch))
+                yield from batch
+            finished = True
+        finally:
+            if not finished:
+                self._drain(future, chunk_queue)
+        seconds = future.result()
+        STAGE_SECONDS.observe(seconds, stage="ingest_extract")
+        self._add_stage_time(job, "ingest_extract", seconds)
+
+    @staticmethod
+    def _drain(future, chunk_queue):
+        """Discards a worker's output until it finishes."""
+        while not future.done():
+            try:
+                chunk_queue.get(timeout=0.5)
+            except queue.Empty:
+                pass
@@ -0,0 +1,73 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.result_format import json_default
+
+# Tokens carry the SQL to resume, so they are signed. Set this explicitly when
+# several workers serve the same clients, or tokens only work on the issuing worker.
+PAGINATION_SECRET = os.getenv("PAGINATION_SECRET") or secrets.token_hex(32)
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _unb64(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def encode_cursor(state: Dict[str, Any]) -> str:
+    payload = json.dumps(state, separators=(",", ":"), default=json_default).encode("utf-8")
+    signature = hmac.new(PAGINATION_SECRET.encode("utf-8"), payload, hashlib.sha256).digest()[:16]
+    return f"{_b64(payload)}.{_b64(signature)}"
+
+
+def decode_cursor(token: str) -> Dict[str, Any]:
+    try:
+        payload_part, signature_part = token.split(".", 1)
+        payload = _unb64(payload_part)
+        signature = _unb64(signature_part)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Malformed cursor.")
+    expected = hmac.new(PAGINATION_SECRET.encode("utf-8"), payload, hashlib.sha256).digest()[:16]
+    if not hmac.compare_digest(signature, expected):
+        raise InvalidCursor("Cursor signature does not match; it was altered or issued by another server.")
+    return json.loads(payload)
+
+
+def build_page_query(sql: str, quote, key_columns: List[str], last_key: Optional[List[Any]],
+                     offset: int, limit: int) -> Tuple[str, Dict[str, Any]]:
+    """
+    Wraps ``sql`` as a subquery and returns one page of it.
+
+    With ``key_columns`` this is keyset pagination: rows strictly after
+    ``last_key`` in key order, which stays fast and stable however deep the
+    client scrolls. Without keys it falls back to LIMIT/OFFSET.
+    """
+    inner = sql.strip().rstrip(";")
+    params: Dict[str, Any] = {"_page_limit": limit}
+    if not key_columns:
+        params["_page_offset"] = offset
+        return f"SELECT * FROM ({inner}) AS _page LIMIT :_page_limit OFFSET :_page_offset", params
+
+    keys = [quote(k) for k in key_columns]
+    where = ""
+    if last_key is not None:
+        placeholders = []
+        for i, value in enumerate(last_key):
+            params[f"_page_k{i}"] = value
+            placeholders.append(f":_page_k{i}")
+        # Row-value comparison: supported by PostgreSQL, MySQL and SQLite >= 3.15
+        where = f" WHERE ({', '.join(keys)}) > ({', '.join(placeholders)})"
+    order = ", ".join(keys)
+    return f"SELECT * FROM ({inner}) AS _page{where} ORDER BY {order} LIMIT :_page_limit", params
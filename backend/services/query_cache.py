@@ -0,0 +1,521 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from services.result_format import json_default
+
+logger = logging.getLogger(__name__)
+
+# memory: per worker process | sqlite: one file shared by the workers of a host |
+# redis: a Redis-compatible server (Redis, Valkey, KeyDB, ...) shared by every host
+QUERY_CACHE_BACKEND = os.getenv("QUERY_CACHE_BACKEND", "memory")
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "300"))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Larger responses are served but never cached
+QUERY_CACHE_MAX_ENTRY_BYTES = int(os.getenv("QUERY_CACHE_MAX_ENTRY_BYTES", str(4 * 1024 * 1024)))
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "data/query_cache.sqlite3")
+QUERY_CACHE_URL = os.getenv("QUERY_CACHE_URL", "redis://localhost:6379/0")
+QUERY_HISTORY_LIMIT = int(os.getenv("QUERY_HISTORY_LIMIT", "200"))
+# How often (at most) the database is asked which tables changed since the last check
+CACHE_DATA_CHECK_SECONDS = float(os.getenv("CACHE_DATA_CHECK_SECONDS", "5"))
+
+# Pseudo-table attached to responses that include document search results;
+# invalidated whenever new documents are indexed
+DOCUMENTS_TAG = "__documents__"
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_$]*")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+
+def referenced_tables(sql: str, table_names: Iterable[str]) -> List[str]:
+    """
+    Schema tables mentioned in ``sql`` (lower-cased). Over-inclusive on purpose:
+    a column that shares a table's name only causes an extra invalidation.
+    """
+    known = {name.lower() for name in table_names}
+    identifiers = {m.lower() for m in _IDENTIFIER.findall(_STRING_LITERAL.sub("", sql or ""))}
+    return sorted(known & identifiers)
+
+
+def _serialize(value: Dict) -> bytes:
+    return json.dumps(value, default=json_default, separators=(",", ":")).encode("utf-8")
+
+
+class QueryCacheBackend(ABC):
+    """
+    Response cache for ``QueryEngine.process_query`` plus the shared query
+    history. Entries are tagged with the schema fingerprint and the tables the
+    SQL read, so a schema change or a change to one table only evicts the
+    responses that depend on it.
+    """
+
+    name = "base"
+
+    def __init__(self, ttl_seconds: float = QUERY_CACHE_TTL_SECONDS,
+                 max_entry_bytes: int = QUERY_CACHE_MAX_ENTRY_BYTES,
+                 history_limit: int = QUERY_HISTORY_LIMIT):
+        self.ttl_seconds = ttl_seconds
+        self.max_entry_bytes = max_entry_bytes
+        self.history_limit = history_limit
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.oversized = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        value = self._get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: Dict, fingerprint: str = "", tables: Iterable[str] = ()):
+        payload = _serialize(value)
+        if len(payload) > self.max_entry_bytes:
+            with self._stats_lock:
+                self.oversized += 1
+            return
+        self._set(key, value, payload, fingerprint, sorted({t.lower() for t in tables}))
+
+    def invalidate_tables(self, tables: Iterable[str]) -> int:
+        """Drops every entry that read one of ``tables``; returns how many."""
+        tables = sorted({t.lower() for t in tables})
+        removed = self._invalidate_tables(tables) if tables else 0
+        with self._stats_lock:
+            self.invalidations += removed
+        return removed
+
+    def invalidate_fingerprint(self, fingerprint: str) -> int:
+        """Drops every entry cached under schema ``fingerprint``; returns how many."""
+        removed = self._invalidate_fingerprint(fingerprint)
+        with self._stats_lock:
+            self.invalidations += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": self.name,
+                "ttl_seconds": self.ttl_seconds,
+                "max_entry_bytes": self.max_entry_bytes,
+                # Hit/miss counters are per worker process; the entries may be shared
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "invalidated": self.invalidations,
+                "oversized_skipped": self.oversized,
+                **self._storage_stats(),
+            }
+
+    # Backend hooks
+    @abstractmethod
+    def _get(self, key: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def _set(self, key: str, value: Dict, payload: bytes, fingerprint: str, tables: List[str]):
+        ...
+
+    @abstractmethod
+    def _invalidate_tables(self, tables: List[str]) -> int:
+        ...
+
+    @abstractmethod
+    def _invalidate_fingerprint(self, fingerprint: str) -> int:
+        ...
+
+    def _storage_stats(self) -> Dict[str, Any]:
+        return {}
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+    @abstractmethod
+    def add_history(self, entry: Dict):
+        ...
+
+    @abstractmethod
+    def history(self, limit: int = 50) -> List[Dict]:
+        ...
+
+
+class InProcessQueryCache(QueryCacheBackend):
+    """LRU bounded by the serialized size of the entries, private to this process."""
+
+    name = "memory"
+
+    def __init__(self, max_bytes: int = QUERY_CACHE_MAX_BYTES, **kwargs):
+        super().__init__(**kwargs)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._by_table: Dict[str, set] = {}
+        self._bytes = 0
+        self.evictions = 0
+        self._history: deque = deque(maxlen=self.history_limit)
+
+    def _get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires_at"] < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry["value"]
+
+    def _set(self, key: str, value: Dict, payload: bytes, fingerprint: str, tables: List[str]):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "value": value,
+                "size": len(payload),
+                "fingerprint": fingerprint,
+                "tables": tables,
+                "expires_at": time.time() + self.ttl_seconds,
+            }
+            self._bytes += len(payload)
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
+        for table in entry["tables"]:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def _invalidate_tables(self, tables: List[str]) -> int:
+        with self._lock:
+            keys = set().union(*(self._by_table.get(t, set()) for t in tables))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def _invalidate_fingerprint(self, fingerprint: str) -> int:
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if e["fingerprint"] == fingerprint]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+            self._bytes = 0
+
+    def _storage_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "evictions": self.evictions}
+
+    def add_history(self, entry: Dict):
+        with self._lock:
+            self._history.appendleft(entry)
+
+    def history(self, limit: int = 50) -> List[Dict]:
+        with self._lock:
+            return list(self._history)[:limit]
+
+
+class SQLiteQueryCache(QueryCacheBackend):
+    """
+    Cache in a local SQLite file (WAL mode), shared by every worker process on
+    the host. The least recently read entries are evicted once the total
+    payload size exceeds ``max_bytes``.
+    """
+
+    name = "sqlite"
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            fingerprint TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed_at);
+        CREATE INDEX IF NOT EXISTS entries_fingerprint ON entries(fingerprint);
+        CREATE TABLE IF NOT EXISTS entry_tables (
+            table_name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            PRIMARY KEY (table_name, key)
+        );
+        CREATE INDEX IF NOT EXISTS entry_tables_key ON entry_tables(key);
+        CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+            DELETE FROM entry_tables WHERE key = OLD.key;
+        END;
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            entry TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: str = QUERY_CACHE_PATH, max_bytes: int = QUERY_CACHE_MAX_BYTES, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(self._SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def _set(self, key: str, value: Dict, payload: bytes, fingerprint: str, tables: List[str]):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            conn.execute(
+                "INSERT INTO entries (key, value, size, fingerprint, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, payload, len(payload), fingerprint, now + self.ttl_seconds, now),
+            )
+            conn.executemany("INSERT OR IGNORE INTO entry_tables (table_name, key) VALUES (?, ?)",
+                             [(table, key) for table in tables])
+            conn.execute("DELETE FROM entries WHERE expires_at < ?", (now,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                # Walk entries oldest-read first until enough bytes are freed
+                excess, victims = total - self.max_bytes, []
+                for victim, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+                    victims.append((victim,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+
+    def _invalidate_tables(self, tables: List[str]) -> int:
+        placeholders = ", ".join("?" for _ in tables)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"DELETE FROM entries WHERE key IN "
+                f"(SELECT key FROM entry_tables WHERE table_name IN ({placeholders}))", tables,
+            )
+            return cursor.rowcount
+
+    def _invalidate_fingerprint(self, fingerprint: str) -> int:
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM entries WHERE fingerprint = ?", (fingerprint,)).rowcount
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+
+    def _storage_stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes, "path": self.path}
+
+    def add_history(self, entry: Dict):
+        with self._connect() as conn:
+            cursor = conn.execute("INSERT INTO history (entry) VALUES (?)", (json.dumps(entry, default=json_default),))
+            conn.execute("DELETE FROM history WHERE id <= ?", (cursor.lastrowid - self.history_limit,))
+
+    def history(self, limit: int = 50) -> List[Dict]:
+        rows = self._connect().execute("SELECT entry FROM history ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+class RedisQueryCache(QueryCacheBackend):
+    """
+    Cache on a Redis-compatible server shared by every worker and host.
+
+    Entries expire through Redis TTLs; set ``maxmemory`` with an
+    ``allkeys-lru`` policy on the server for size-bounded eviction. Per-table
+    and per-fingerprint key sets make invalidation a set union plus a delete.
+    Needs the ``redis`` package; any client with the same API (e.g. a local
+    stand-in such as fakeredis) can be passed as ``client``.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str = QUERY_CACHE_URL, client=None, prefix: str = "nlq", **kwargs):
+        super().__init__(**kwargs)
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("QUERY_CACHE_BACKEND=redis requires the redis package (pip install redis).")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    def _get(self, key: str) -> Optional[Dict]:
+        payload = self.client.get(self._key("q", key))
+        return json.loads(payload) if payload is not None else None
+
+    def _set(self, key: str, value: Dict, payload: bytes, fingerprint: str, tables: List[str]):
+        ttl_ms = max(1, int(self.ttl_seconds * 1000))
+        entry_key = self._key("q", key)
+        pipe = self.client.pipeline()
+        pipe.set(entry_key, payload, px=ttl_ms)
+        # Index sets may list keys that already expired; deleting those is a no-op
+        for index in [self._key("fp", fingerprint)] + [self._key("t", t) for t in tables]:
+            pipe.sadd(index, entry_key)
+            pipe.pexpire(index, ttl_ms)
+        pipe.execute()
+
+    def _delete_indexed(self, index_keys: List[str]) -> int:
+        members = self.client.sunion(index_keys) if index_keys else set()
+        pipe = self.client.pipeline()
+        if members:
+            pipe.delete(*members)
+        pipe.delete(*index_keys)
+        results = pipe.execute()
+        return results[0] if members else 0
+
+    def _invalidate_tables(self, tables: List[str]) -> int:
+        return self._delete_indexed([self._key("t", t) for t in tables])
+
+    def _invalidate_fingerprint(self, fingerprint: str) -> int:
+        return self._delete_indexed([self._key("fp", fingerprint)])
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self._key("*")))
+        history = self._key("history")
+        keys = [k for k in keys if (k.decode() if isinstance(k, bytes) else k) != history]
+        if keys:
+            self.client.delete(*keys)
+
+    def add_history(self, entry: Dict):
+        pipe = self.client.pipeline()
+        pipe.lpush(self._key("history"), json.dumps(entry, default=json_default))
+        pipe.ltrim(self._key("history"), 0, self.history_limit - 1)
+        pipe.execute()
+
+    def history(self, limit: int = 50) -> List[Dict]:
+        return [json.loads(item) for item in self.client.lrange(self._key("history"), 0, limit - 1)]
+
+
+def create_query_cache(backend: str = QUERY_CACHE_BACKEND) -> QueryCacheBackend:
+    if backend == "memory":
+        return InProcessQueryCache()
+    if backend == "sqlite":
+        return SQLiteQueryCache()
+    if backend == "redis":
+        return RedisQueryCache()
+    raise ValueError(f"Unknown QUERY_CACHE_BACKEND {backend!r}; use memory, sqlite or redis.")
+
+
+# -------------------------
+# Data change detection
+# -------------------------
+# One catalog query per dialect returning (table_name, version), where version
+# changes whenever rows of the table are written.
+_DATA_VERSION_QUERIES = {
+    # Cumulative row-change counters; reported by the stats collector with up to ~1s delay
+    "postgresql": """
+        SELECT relname, n_tup_ins + n_tup_upd + n_tup_del
+        FROM pg_stat_user_tables WHERE schemaname = current_schema()
+    """,
+    "mysql": """
+        SELECT TABLE_NAME, UPDATE_TIME FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'
+    """,
+}
+
+
+class TableChangeTracker:
+    """
+    Polls the database catalog (at most every ``min_interval`` seconds) and
+    reports which tables were written since the previous poll. Dialects without
+    a per-table change counter (e.g. SQLite) report nothing and rely on the TTL.
+    """
+
+    def __init__(self, engine: Engine, min_interval: float = CACHE_DATA_CHECK_SECONDS):
+        self.engine = engine
+        self.min_interval = min_interval
+        dialect = "mysql" if engine.dialect.name == "mariadb" else engine.dialect.name
+        self._query = _DATA_VERSION_QUERIES.get(dialect)
+        self._lock = threading.Lock()
+        self._versions: Optional[Dict[str, str]] = None
+        self._checked_at = 0.0
+
+    @property
+    def supported(self) -> bool:
+        return self._query is not None
+
+    def changed_tables(self) -> List[str]:
+        if self._query is None or time.time() - self._checked_at < self.min_interval:
+            return []
+        # Only one caller polls; the others carry on with the current cache state
+        if not self._lock.acquire(blocking=False):
+            return []
+        try:
+            self._checked_at = time.time()
+            versions = self._read_versions()
+            if versions is None:
+                return []
+            previous, self._versions = self._versions, versions
+            if previous is None:
+                return []
+            return sorted(name for name in set(previous) | set(versions)
+                          if previous.get(name) != versions.get(name))
+        finally:
+            self._lock.release()
+
+    def _read_versions(self) -> Optional[Dict[str, str]]:
+        try:
+            with self.engine.connect() as conn:
+                if self.engine.dialect.name == "mysql":
+                    # MySQL 8 otherwise serves UPDATE_TIME from a cache refreshed once a day
+                    conn.execute(text("SET SESSION information_schema_stats_expiry = 0"))
+                rows = conn.execute(text(self._query)).fetchall()
+        except SQLAlchemyError as e:
+            logger.warning("Table change check failed; cached queries expire by TTL only: %s", e)
+            self._query = None
+            return None
+        return {str(name).lower(): str(version) for name, version in rows}
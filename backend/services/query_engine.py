@@ -1,27 +1,62 @@
 # backend/services/query_engine.py
+import json
+import logging
+import threading
 import time
 import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from typing import Any, Dict, List, Optional, Tuple
-from cachetools import TTLCache
 import re
-import sqlparse
 import numpy as np
-from groq import Groq
+import sqlparse
 from dotenv import load_dotenv
 load_dotenv()
-from sqlalchemy import create_engine, text
-from sqlalchemy.exc import SQLAlchemyError
 
 # Import your schema discovery & doc processor
 from services.schema_discovery import SchemaDiscovery
-from services.document_processor import DocumentProcessor, model
+from services.document_processor import DocumentProcessor, query_embedder
+from services.embeddings import embedder
+from services.schema_index import SchemaIndex, estimate_tokens
+from services.semantic_cache import SemanticSQLCache
+from services.sql_executor import SQLExecutor, STREAM_BATCH_SIZE, create_pooled_engine
+from services.query_plan import QueryCostGuard
+from services.pagination import MAX_PAGE_SIZE, InvalidCursor, build_page_query, decode_cursor, encode_cursor
+from services.result_format import format_result
+from services.query_cache import DOCUMENTS_TAG, TableChangeTracker, create_query_cache, referenced_tables
+from services.single_flight import SingleFlight
+from services.document_filters import (
+    HYBRID_SCOPE_DOCUMENTS, HYBRID_SCOPE_OVERFETCH, normalize_filters, scope_from_result
+)
+from services.metrics import registry, timed_stage
 
 # -------------------------
 # Globals
 # -------------------------
-QUERY_HISTORY_LIMIT = 200
-_query_history: List[Dict] = []
-query_cache = TTLCache(maxsize=1000, ttl=300)  # 5 minutes TTL
+logger = logging.getLogger(__name__)
+# Responses and query history; backend chosen by QUERY_CACHE_BACKEND (see services/query_cache.py)
+query_cache = create_query_cache()
+# Paraphrase-tolerant NL->SQL tier, shared by every engine and keyed by schema fingerprint
+semantic_sql_cache = SemanticSQLCache()
+
+# Identical questions arriving while the first is still being answered share its result
+in_flight_queries = SingleFlight()
+
+QUERIES_TOTAL = registry.counter(
+    "nlq_queries_total", "Answered questions by type and outcome (computed, cache_hit, coalesced, error).",
+    labels=("query_type", "outcome"),
+)
+QUERY_SECONDS = registry.histogram(
+    "nlq_query_duration_seconds", "End-to-end process_query latency.", labels=("outcome",)
+)
+QUERIES_IN_FLIGHT = registry.gauge("nlq_queries_in_flight", "Questions currently being answered.")
+LLM_TOKENS = registry.counter("nlq_llm_tokens_total", "Tokens reported by the LLM API.", labels=("kind",))
+
+# HYBRID queries run their SQL (LLM + DB) and document branches side by side,
+# each bounded by its own timeout so one slow branch cannot hold back the other
+SQL_BRANCH_TIMEOUT_SECONDS = float(os.getenv("SQL_BRANCH_TIMEOUT_SECONDS", "45"))
+DOCUMENT_BRANCH_TIMEOUT_SECONDS = float(os.getenv("DOCUMENT_BRANCH_TIMEOUT_SECONDS", "15"))
+_branch_pool = ThreadPoolExecutor(max_workers=int(os.getenv("HYBRID_BRANCH_WORKERS", "32")),
+                                  thread_name_prefix="hybrid")
 
 FORBIDDEN_SQL_PATTERNS = [
     r";",
@@ -31,27 +66,149 @@ FORBIDDEN_SQL_PATTERNS = [
 ]
 ALLOWED_STATEMENTS = {"SELECT", "WITH"}
 
-def _normalize_query_key(query: str, schema_hash: str = "") -> str:
-    return f"{query.strip().lower()}::schema::{schema_hash}"
+def _normalize_query_key(query: str, schema_hash: str = "", namespace: str = "") -> str:
+    key = f"{query.strip().lower()}::schema::{schema_hash}"
+    return f"{namespace}::{key}" if namespace else key
+
+
+def _answer_key(query: str, schema_hash: str, namespace: str, top_k_docs: int, nprobe: Optional[int],
+                ef_search: Optional[int], document_filters: Optional[Dict[str, Any]]) -> str:
+    """
+    Cache and single-flight key of an answer: the question plus everything that
+    changes the response (the search knobs and filters shape the document hits).
+    """
+    key = _normalize_query_key(query, schema_hash, namespace)
+    key += f"::top_k::{top_k_docs}::nprobe::{nprobe}::ef::{ef_search}"
+    if document_filters:
+        key += "::docs::" + json.dumps(document_filters, sort_keys=True)
+    return key
+
+
+_groq_lock = threading.Lock()
+_shared_groq_client = None
+
+
+def shared_groq_client():
+    """One Groq client for every engine, created on first use."""
+    global _shared_groq_client
+    if _shared_groq_client is None:
+        with _groq_lock:
+            if _shared_groq_client is None:
+                from groq import Groq
+                _shared_groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+    return _shared_groq_client
+
+
+def warm_up() -> Dict[str, Any]:
+    """
+    Loads the embedding model and creates the LLM client ahead of the first
+    request. Returns the embedding model status and timings.
+    """
+    start = time.perf_counter()
+    shared_groq_client()
+    client_seconds = time.perf_counter() - start
+    return {"embeddings": embedder.warm_up(), "llm_client_seconds": client_seconds}
+
+
+def _merge_stages(into: Dict[str, float], stages: Dict[str, float]):
+    for name, seconds in stages.items():
+        into[name] = into.get(name, 0.0) + seconds
 
 
 class QueryEngine:
-    def __init__(self, connection_string: Optional[str] = None):
+    def __init__(self, connection_string: Optional[str] = None, doc_processor: Optional[DocumentProcessor] = None,
+                 cache_namespace: str = ""):
+        """
+        ``doc_processor`` may be shared between engines; ``cache_namespace``
+        keeps this engine's cached answers apart from other connections'.
+        """
+        self.cache_namespace = cache_namespace
+        self.connection_string: Optional[str] = None
         self.schema = {}
+        self.schema_fingerprint = ""
+        self.schema_index: Optional[SchemaIndex] = None
         self.engine = None
+        self.sql_executor: Optional[SQLExecutor] = None
+        self.cost_guard: Optional[QueryCostGuard] = None
+        self.change_tracker: Optional[TableChangeTracker] = None
         self.schema_discovery = SchemaDiscovery()
-        self.groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-        self.doc_processor = DocumentProcessor()
+        self._groq_client = None
+        self.doc_processor = doc_processor if doc_processor is not None else DocumentProcessor()
         if connection_string:
             self.connect_db(connection_string)
 
+    @property
+    def groq_client(self):
+        """The shared client unless one was set on this engine."""
+        return self._groq_client if self._groq_client is not None else shared_groq_client()
+
+    @groq_client.setter
+    def groq_client(self, client):
+        self._groq_client = client
+
+    def table_tags(self, tables: List[str]) -> List[str]:
+        """Cache invalidation tags of ``tables`` in this engine's namespace."""
+        if not self.cache_namespace:
+            return list(tables)
+        return [t if t == DOCUMENTS_TAG else f"{self.cache_namespace}:{t}" for t in tables]
+
+    def _fingerprint_tag(self, fingerprint: str) -> str:
+        return f"{self.cache_namespace}:{fingerprint}" if self.cache_namespace else fingerprint
+
     def connect_db(self, connection_string: str):
+        """
+        Creates the engine and discovers the schema in one pass (served from the
+        schema cache when nothing changed). Reconnecting to the same connection
+        string keeps the pool and only rediscovers the schema. Discovery errors
+        are left in ``self.schema["error"]`` for the caller to report.
+        """
+        reuse = self.engine is not None and connection_string == self.connection_string
         try:
-            self.engine = create_engine(connection_string)
-            self.schema = self.schema_discovery.analyze_database(connection_string)
+            engine = self.engine if reuse else create_pooled_engine(connection_string)
+            schema = self.schema_discovery.analyze_database(connection_string, engine=engine)
         except Exception as e:
             raise RuntimeError(f"DB connect failed: {e}")
 
+        if not reuse:
+            # Release the previous connection pool before replacing it
+            if self.sql_executor is not None:
+                self.sql_executor.shutdown()
+            self.engine = engine
+            self.connection_string = connection_string
+            self.sql_executor = SQLExecutor(engine)
+            self.cost_guard = QueryCostGuard(self.sql_executor)
+            self.change_tracker = TableChangeTracker(engine)
+        else:
+            # Plans and table sizes may have changed along with the schema
+            self.cost_guard.clear()
+
+        previous_fingerprint = self.schema_fingerprint
+        self.schema = schema
+        self.schema_fingerprint = schema.get("fingerprint", "")
+        # Cached answers for the old schema, or that read tables whose definition changed, are stale
+        if previous_fingerprint and previous_fingerprint != self.schema_fingerprint:
+            query_cache.invalidate_fingerprint(self._fingerprint_tag(previous_fingerprint))
+        discovery = schema.get("discovery", {})
+        query_cache.invalidate_tables(
+            self.table_tags(discovery.get("changed_tables", []) + discovery.get("removed_tables", []))
+        )
+        if "error" in schema:
+            self.schema_index = None
+        elif self.schema_index is None or self.schema_fingerprint != previous_fingerprint:
+            self.schema_index = SchemaIndex(
+                schema, encode_fn=embedder.encode
+            )
+
+    def close(self):
+        """Closes the connection pool; the engine can be connected again later."""
+        if self.sql_executor is not None:
+            self.sql_executor.shutdown()
+        self.engine = None
+        self.sql_executor = None
+        self.cost_guard = None
+        self.change_tracker = None
+        self.connection_string = None
+
     # -------------------------
     # Query Classification
     # -------------------------
@@ -148,8 +305,8 @@ class QueryEngine:
             sql = f"{sql.rstrip().rstrip(';')} LIMIT {default_limit}"
         return sql
 
-    def execute_sql(self, sql: str) -> Dict[str, Any]:
-        if self.engine is None:
+    def execute_sql(self, sql: str, stages: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        if self.engine is None or self.sql_executor is None:
             return {"error": "No DB engine connected."}
 
         safe, msg = self._is_sql_safe(sql)
@@ -157,30 +314,116 @@ class QueryEngine:
             return {"error": f"SQL safety check failed: {msg}"}
 
         sql = self.optimize_sql_query(sql)
-        try:
-            start = time.time()
-            with self.engine.connect() as conn:
-                result = conn.execute(text(sql))
-                rows = [dict(r._mapping) for r in result.fetchall()]
-            elapsed = time.time() - start
-            return {"rows": rows, "elapsed_seconds": elapsed}
-        except SQLAlchemyError as e:
-            return {"error": f"SQL execution error: {e}"}
-        except Exception as e:
-            return {"error": f"Unexpected SQL execution error: {e}"}
+        guard = None
+        if self.cost_guard is not None and self.cost_guard.enabled:
+            # EXPLAIN first (cached per statement); see SQL_COST_GUARD
+            with timed_stage(stages, "sql_plan_check"):
+                verdict = self.cost_guard.check(sql)
+            if verdict["action"] != "allow":
+                guard = {k: verdict.get(k) for k in ("action", "reason", "sql", "estimate", "cached")}
+            if verdict["action"] == "reject":
+                return {"error": f"Query rejected before execution: {verdict['reason']}.", "cost_guard": guard}
+            sql = verdict["sql"]
+        # Pooled, concurrency-limited and cancelled on the server after QUERY_TIMEOUT_SECONDS
+        result = self.sql_executor.execute(sql)
+        if guard is not None:
+            result["cost_guard"] = guard
+        return result
+
+    # -------------------------
+    # Streaming & Pagination
+    # -------------------------
+    def prepare_sql(self, user_query: str, metrics: Optional[Dict] = None) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Generated, safety-checked SQL for streaming or paging, without the
+        interactive LIMIT. Returns ``(sql, None)`` or ``(None, error)``.
+        """
+        if self.engine is None or self.sql_executor is None:
+            return None, "No DB engine connected."
+        sql = self.generate_sql(user_query, metrics)
+        if not sql:
+            return None, "Could not generate SQL with Groq."
+        safe, msg = self._is_sql_safe(sql)
+        if not safe:
+            return None, f"SQL safety check failed: {msg}"
+        return sql, None
+
+    def stream_sql(self, sql: str, batch_size: int = STREAM_BATCH_SIZE):
+        """Yields ``(columns, rows)`` batches from a server-side cursor; see SQLExecutor.stream."""
+        return self.sql_executor.stream(sql, batch_size=batch_size)
+
+    def fetch_page(self, sql: Optional[str] = None, page_size: Optional[int] = None,
+                   key_columns: Optional[List[str]] = None, cursor: Optional[str] = None,
+                   result_format: str = "rows") -> Dict[str, Any]:
+        """
+        Returns one page of a query plus an opaque ``next_cursor`` (None on the
+        last page). Pass either ``sql`` (first page) or a ``cursor`` from a
+        previous page. With ``key_columns`` (integer or text columns that
+        uniquely order the result) pages use keyset pagination; otherwise OFFSET.
+        The page size is kept in the cursor unless ``page_size`` overrides it.
+        """
+        if self.engine is None or self.sql_executor is None:
+            return {"error": "No DB engine connected."}
+        if cursor:
+            state = decode_cursor(cursor)
+            if state.get("conn", "") != self.cache_namespace:
+                raise InvalidCursor("Cursor belongs to another connection.")
+        else:
+            safe, msg = self._is_sql_safe(sql or "")
+            if not safe:
+                return {"error": f"SQL safety check failed: {msg}"}
+            state = {"sql": sql, "keys": key_columns or [], "last": None, "offset": 0, "size": 100,
+                     "conn": self.cache_namespace}
+        page_size = max(1, min(page_size or state.get("size", 100), MAX_PAGE_SIZE))
+        state["size"] = page_size
+
+        quote = self.engine.dialect.identifier_preparer.quote
+        page_sql, params = build_page_query(
+            state["sql"], quote, state["keys"], state["last"], state["offset"], page_size + 1
+        )
+        result = self.sql_executor.execute(page_sql, params=params)
+        if "error" in result:
+            return result
+
+        columns, rows = result["columns"], result["rows"]
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        next_cursor = None
+        if has_more:
+            next_state = dict(state, offset=state["offset"] + page_size)
+            if state["keys"]:
+                missing = [k for k in state["keys"] if k not in columns]
+                if missing:
+                    return {"error": f"Key column(s) not in the result: {', '.join(missing)}"}
+                next_state["last"] = [rows[-1][columns.index(k)] for k in state["keys"]]
+            next_cursor = encode_cursor(next_state)
+        page = format_result(
+            {"columns": columns, "rows": rows, "elapsed_seconds": result["elapsed_seconds"]}, result_format
+        )
+        return {"sql": state["sql"], **page, "page_size": page_size, "next_cursor": next_cursor}
 
     # -------------------------
     # LLM-based SQL Generation
     # -------------------------
-    def generate_sql_with_groq(self, user_query: str) -> Optional[str]:
+    def generate_sql_with_groq(self, user_query: str, stats: Optional[Dict] = None,
+                               question_embedding=None) -> Optional[str]:
+        """
+        Asks Groq for SQL. Only the tables relevant to the question (plus their
+        foreign-key neighbours) go into the prompt. Prompt size and token usage
+        are written into ``stats`` when given.
+        """
         if not self.schema or "tables" not in self.schema:
-            print("Current schema:", self.schema)
+            logger.warning("No schema to generate SQL from: %s", self.schema)
             return None
+        stats = stats if stats is not None else {}
 
-        schema_text = "\n".join(
-            [f"Table {t['name']}({', '.join([c['name'] for c in t['columns']])})"
-             for t in self.schema["tables"]]
-        )
+        if self.schema_index is None:
+            self.schema_index = SchemaIndex(self.schema)
+        with timed_stage(stats.setdefault("stages", {}), "schema_prune"):
+            table_names = self.schema_index.select(user_query, question_embedding)
+            schema_text = self.schema_index.describe(table_names)
+        stats["schema_tables_in_prompt"] = len(table_names)
+        stats["schema_tables_total"] = len(self.schema_index.names)
 
         prompt = f"""
         You are a helpful assistant that converts natural language into SQL.
@@ -192,105 +435,326 @@ class QueryEngine:
 
         Output ONLY a SQL query. Do not include explanations.
         """
+        stats["prompt_tokens_estimated"] = estimate_tokens(prompt)
 
         try:
-            resp = self.groq_client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0
-            )
-            print(f"GROQ response: {resp}")
+            with timed_stage(stats["stages"], "llm"):
+                resp = self.groq_client.chat.completions.create(
+                    model="llama-3.3-70b-versatile",
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0
+                )
+            usage = getattr(resp, "usage", None)
+            if usage is not None:
+                stats["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+                stats["completion_tokens"] = getattr(usage, "completion_tokens", None)
+                for kind in ("prompt", "completion"):
+                    if stats[f"{kind}_tokens"]:
+                        LLM_TOKENS.inc(stats[f"{kind}_tokens"], kind=kind)
             sql = resp.choices[0].message.content.strip()
             return sql
         except Exception as e:
-            print(f"GROQ SQL generation error: {e}")
+            logger.error("GROQ SQL generation error: %s", e)
             return None
 
+    def generate_sql(self, user_query: str, metrics: Optional[Dict] = None) -> Optional[str]:
+        """
+        Returns cleaned SQL for a question: passes SQL through, then tries the
+        semantic cache, and only calls Groq when no close-enough question is cached.
+        """
+        metrics = metrics if metrics is not None else {}
+        if re.match(r"^\s*(select|with)\b", user_query.strip(), flags=re.I):
+            metrics["sql_source"] = "passthrough"
+            return user_query.strip()
+
+        embedding = None
+        stages = metrics.setdefault("stages", {})
+        try:
+            with timed_stage(stages, "query_embedding"):
+                embedding = query_embedder.encode(user_query)
+            with timed_stage(stages, "semantic_cache_lookup"):
+                hit = semantic_sql_cache.lookup(self.schema_fingerprint, user_query, embedding)
+        except Exception as e:
+            logger.warning("Semantic cache lookup failed: %s", e)
+            hit = None
+        if hit:
+            metrics["sql_source"] = "semantic_cache"
+            metrics["semantic_cache_similarity"] = hit["similarity"]
+            metrics["semantic_cache_question"] = hit["question"]
+            return hit["sql"]
+
+        generated_sql = self.generate_sql_with_groq(user_query, metrics, question_embedding=embedding)
+        if not generated_sql:
+            return None
+        metrics["sql_source"] = "llm"
+        generated_sql = self.clean_groq_sql(generated_sql)
+        # Only remember SQL that would actually be executed
+        if embedding is not None and self._is_sql_safe(generated_sql)[0]:
+            semantic_sql_cache.store(self.schema_fingerprint, user_query, embedding, generated_sql)
+        return generated_sql
+
     # -------------------------
     # Document Search
     # -------------------------
-    def search_documents(self, query: str, top_k: int = 5) -> Dict[str, Any]:
+    def search_documents(self, query: str, top_k: int = 5, nprobe: Optional[int] = None,
+                         ef_search: Optional[int] = None, stages: Optional[Dict[str, float]] = None,
+                         filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Embeds the query and searches the vector index. ``nprobe`` (IVF) and
+        ``ef_search`` (HNSW) trade recall for latency on a per-query basis.
+        ``filters`` (see document_filters.normalize_filters) limits the search
+        to matching chunks. Stage timings are added to ``stages`` when given.
+        """
+        filters = normalize_filters(filters)
         # This now correctly uses the instance-specific processor
-        if self.doc_processor.vector_index is None or self.doc_processor.vector_index.ntotal == 0:
+        self.doc_processor.refresh()
+        if self.doc_processor.vector_index is None or self.doc_processor.vector_index.live_count == 0:
             return {"results": [], "elapsed_seconds": 0.0, "note": "No indexed documents."}
 
         start = time.time()
-        q_vec = model.encode([query], convert_to_tensor=False)
-        q_vec = np.array(q_vec).astype("float32")
-        
-        distances, indices = self.doc_processor.vector_index.search(q_vec, top_k)
-        
-        results = []
-        for idx, dist in zip(indices[0], distances[0]):
-             if idx == -1: continue
-             for doc_id, meta in self.doc_processor.documents_store.items():
-                 if meta.get("embedding_id") == int(idx):
-                    results.append({
-                        "doc_id": doc_id,
-                        "filename": meta.get("filename"),
-                        "chunk": meta.get("chunk"),
-                        "distance": float(dist)
-                    })
-                    break
-        
+        # Batched with other in-flight queries into a single model.encode call
+        with timed_stage(stages, "query_embedding"):
+            q_vec = query_embedder.encode(query)[None, :]
+
+        with timed_stage(stages, "vector_search"):
+            hits = self.doc_processor.search(q_vec, top_k, nprobe=nprobe, ef_search=ef_search, filters=filters)
+        results = [
+            {
+                "doc_id": hit["doc_id"],
+                "embedding_id": hit["embedding_id"],
+                "filename": hit["filename"],
+                "chunk": hit["chunk"],
+                "distance": hit["distance"]
+            }
+            for hit in hits
+        ]
+
         elapsed = time.time() - start
-        return {"results": results, "elapsed_seconds": elapsed}
+        response = {"results": results, "elapsed_seconds": elapsed}
+        if filters:
+            response["filters"] = filters
+        return response
 
     # -------------------------
     # Process Query
     # -------------------------
-    def process_query(self, user_query: str, top_k_docs: int = 5, schema_hash: str = "") -> Dict[str, Any]:
-        key = _normalize_query_key(user_query, schema_hash)
-
-        if key in query_cache:
-            cached_resp = query_cache[key]
+    def process_query(self, user_query: str, top_k_docs: int = 5, schema_hash: str = "",
+                      nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                      result_format: str = "rows", document_filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Answers a question. ``result_format`` selects the layout of
+        ``sql_result`` (see result_format.RESULT_FORMATS); cached responses keep
+        the compact columns + row tuples form and are rendered per request.
+        ``document_filters`` narrows the document search (see
+        document_filters.normalize_filters); HYBRID questions are additionally
+        scoped to the entities their SQL result returned.
+
+        Concurrent requests for the same cache key are coalesced: one computes
+        the answer, the rest wait for it and are marked ``_coalesced``.
+        """
+        start = time.perf_counter()
+        QUERIES_IN_FLIGHT.inc()
+        try:
+            # Keyed by the live schema fingerprint unless the client pins its own schema hash
+            document_filters = normalize_filters(document_filters)
+            key = _answer_key(user_query, schema_hash or self.schema_fingerprint, self.cache_namespace,
+                              top_k_docs, nprobe, ef_search, document_filters)
+            response, shared = in_flight_queries.do(
+                key, lambda: self._answer(user_query, key, top_k_docs, nprobe, ef_search, document_filters)
+            )
+        finally:
+            QUERIES_IN_FLIGHT.dec()
+
+        if "sql_result" not in response:
+            outcome = "error"
+        elif shared:
+            outcome = "coalesced"
+        else:
+            outcome = "cache_hit" if response.get("_cache_hit") else "computed"
+        QUERIES_TOTAL.inc(query_type=response.get("query_type") or "unknown", outcome=outcome)
+        QUERY_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
+
+        if shared:
+            query_cache.add_history({"query": user_query, "connection_id": self.cache_namespace or None, "cached": False, "coalesced": True, "time": time.time()})
+        if "sql_result" not in response:
+            return response
+        response = dict(response, sql_result=format_result(response["sql_result"], result_format))
+        response["metrics"] = dict(response.get("metrics") or {}, total_seconds=time.perf_counter() - start)
+        if shared:
+            response["_coalesced"] = True
+        return response
+
+    def _answer(self, user_query: str, key: str, top_k_docs: int, nprobe: Optional[int],
+                ef_search: Optional[int], document_filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Cached or freshly computed response, with ``sql_result`` in the compact
+        form. ``metrics["stages"]`` holds the seconds spent in each stage.
+        """
+        stages: Dict[str, float] = {}
+        with timed_stage(stages, "cache_lookup"):
+            if self.change_tracker is not None:
+                changed = self.change_tracker.changed_tables()
+                if changed:
+                    query_cache.invalidate_tables(self.table_tags(changed))
+            cached = query_cache.get(key)
+        if cached is not None:
+            cached_resp = dict(cached)
             cached_resp["_cache_hit"] = True
-            _query_history.insert(0, {"query": user_query, "cached": True, "time": time.time()})
-            _query_history[:] = _query_history[:QUERY_HISTORY_LIMIT]
+            # Stage timings describe this request, not the one that filled the cache
+            cached_resp["metrics"] = dict(cached.get("metrics") or {}, stages=stages)
+            query_cache.add_history({"query": user_query, "connection_id": self.cache_namespace or None, "cached": True, "time": time.time()})
             return cached_resp
 
-        qtype = self.classify_query(user_query)
+        with timed_stage(stages, "classify"):
+            qtype = self.classify_query(user_query)
         response = {
             "query": user_query,
             "query_type": qtype,
             "sql": None,
             "sql_result": None,
             "document_result": None,
-            "metrics": {},
+            "metrics": {"stages": stages},
             "error": None
         }
 
         try:
+            branches = {}
             if qtype in ("SQL", "HYBRID"):
-                generated_sql = None
-                if re.match(r"^\s*(select|with)\b", user_query.strip(), flags=re.I):
-                    generated_sql = user_query.strip()
-                else:
-                    generated_sql = self.generate_sql_with_groq(user_query)
+                branches["sql"] = (lambda: self._sql_branch(user_query), SQL_BRANCH_TIMEOUT_SECONDS)
+            document_stages: Dict[str, float] = {}
 
-                if generated_sql:
-                    generated_sql_clean = self.clean_groq_sql(generated_sql)
-                    response["sql"] = generated_sql_clean
-                    response["sql_result"] = self.execute_sql(generated_sql_clean)
-                else:
-                    response["sql_result"] = {"error": "Could not generate SQL with Groq."}
+            entity_keys = self.doc_processor.entity_keys() if qtype == "HYBRID" and HYBRID_SCOPE_DOCUMENTS else set()
+            # Documents tagged with entity keys are scoped to the entities the SQL result
+            # returns; the search still runs alongside SQL, over-fetching to leave room
+            fetch_k = top_k_docs * HYBRID_SCOPE_OVERFETCH if entity_keys else top_k_docs
+
+            def documents(filters=document_filters, top_k=fetch_k):
+                return self.search_documents(user_query, top_k=top_k, nprobe=nprobe,
+                                             ef_search=ef_search, stages=document_stages, filters=filters)
 
             if qtype in ("DOCUMENT", "HYBRID"):
-                response["document_result"] = self.search_documents(user_query, top_k=top_k_docs)
+                branches["documents"] = (documents, DOCUMENT_BRANCH_TIMEOUT_SECONDS)
+            branches_start = time.time()
+            results, timings = self._run_branches(branches)
+            if entity_keys and timings["documents"]["status"] == "ok":
+                self._scope_documents(results, timings, entity_keys, document_filters, top_k_docs,
+                                      lambda filters: documents(filters, top_k_docs))
+            # With concurrent branches this is close to the slower one, not their sum
+            response["metrics"]["branches"] = timings
+            response["metrics"]["branches_elapsed_seconds"] = time.time() - branches_start
+
+            if "sql" in results:
+                if timings["sql"]["status"] == "ok":
+                    sql, sql_result, sql_metrics = results["sql"]
+                    response["sql"] = sql
+                    response["sql_result"] = sql_result
+                    _merge_stages(stages, sql_metrics.pop("stages", {}))
+                    response["metrics"].update(sql_metrics)
+                else:
+                    response["sql_result"] = results["sql"]
+            if "documents" in results:
+                response["document_result"] = results["documents"]
+                if timings["documents"]["status"] == "ok":
+                    _merge_stages(stages, document_stages)
 
             response["metrics"]["timestamp"] = time.time()
             response["_cache_hit"] = False
 
-            query_cache[key] = response
-            _query_history.insert(0, {"query": user_query, "cached": False, "time": time.time(), "type": qtype})
-            _query_history[:] = _query_history[:QUERY_HISTORY_LIMIT]
+            # Partial answers (a branch timed out or crashed) are not worth replaying
+            if all(t["status"] == "ok" for t in timings.values()):
+                tables = referenced_tables(response["sql"], [t["name"] for t in self.schema.get("tables", [])])
+                if response["document_result"] is not None:
+                    tables.append(DOCUMENTS_TAG)
+                query_cache.set(key, response, fingerprint=self._fingerprint_tag(self.schema_fingerprint),
+                                tables=self.table_tags(tables))
+            query_cache.add_history({"query": user_query, "connection_id": self.cache_namespace or None, "cached": False, "time": time.time(), "type": qtype})
 
             return response
         except Exception as e:
             return {"error": f"Processing failed: {e}"}
 
+    def _scope_documents(self, results: Dict[str, Any], timings: Dict[str, Dict], entity_keys,
+                         document_filters: Optional[Dict[str, Any]], top_k: int, search_scoped) -> None:
+        """
+        Narrows the over-fetched HYBRID document hits in ``results`` to the
+        entities the SQL result returned (see document_filters.scope_from_result)
+        and trims them to ``top_k``. When fewer than ``top_k`` hits survive but
+        more scoped chunks exist, ``search_scoped(filters)`` runs as a second
+        document pass under the document branch timeout.
+        """
+        document_result = results["documents"]
+        hits = document_result["results"]
+        scope = scope_from_result(results["sql"][1], entity_keys) if timings["sql"]["status"] == "ok" else None
+        filters = dict(document_filters or {})
+        if scope:
+            filters["entities"] = {**scope, **filters.get("entities", {})}
+        if not scope or filters == (document_filters or {}):
+            document_result["results"] = hits[:top_k]
+            return
+
+        allowed = self.doc_processor.select(filters)
+        in_scope = np.isin(np.array([hit["embedding_id"] for hit in hits], dtype=np.int64), allowed)
+        kept = [hit for hit, keep in zip(hits, in_scope) if keep][:top_k]
+        if len(kept) < min(top_k, len(allowed)):
+            scoped, scoped_timings = self._run_branches(
+                {"documents": (lambda: search_scoped(filters), DOCUMENT_BRANCH_TIMEOUT_SECONDS)}
+            )
+            timings["documents_scoped"] = scoped_timings["documents"]
+            if scoped_timings["documents"]["status"] == "ok":
+                results["documents"] = scoped["documents"]
+                return
+        document_result["results"] = kept
+        document_result["filters"] = filters
+
+    def _sql_branch(self, user_query: str) -> Tuple[Optional[str], Dict[str, Any], Dict[str, Any]]:
+        """LLM/cache SQL generation plus execution: ``(sql, sql_result, metrics)``."""
+        metrics: Dict[str, Any] = {}
+        generated_sql = self.generate_sql(user_query, metrics)
+        if not generated_sql:
+            return None, {"error": "Could not generate SQL with Groq."}, metrics
+        generated_sql_clean = self.clean_groq_sql(generated_sql)
+        with timed_stage(metrics.setdefault("stages", {}), "sql_execute"):
+            sql_result = self.execute_sql(generated_sql_clean, metrics["stages"])
+        return generated_sql_clean, sql_result, metrics
+
+    @staticmethod
+    def _run_branches(branches: Dict[str, Tuple[Any, float]]) -> Tuple[Dict[str, Any], Dict[str, Dict]]:
+        """
+        Runs ``{name: (fn, timeout)}`` concurrently on the branch pool (a lone
+        branch too, so its timeout holds) and returns ``(results, timings)``. A
+        branch that times out or raises gets an ``{"error"}`` result and leaves
+        the others untouched.
+        """
+        start = time.time()
+        timings: Dict[str, Dict] = {}
+        results: Dict[str, Any] = {}
+
+        def timed(fn):
+            # Measured in the worker, so a branch's time does not include waiting on the other
+            branch_start = time.time()
+            return fn(), time.time() - branch_start
+
+        futures = {name: _branch_pool.submit(timed, fn) for name, (fn, _timeout) in branches.items()}
+
+        # Waiting in timeout order keeps each deadline measured from the common start
+        for name in sorted(futures, key=lambda n: branches[n][1]):
+            fn, timeout = branches[name]
+            try:
+                result, elapsed = futures[name].result(timeout=max(0.0, start + timeout - time.time()))
+                status = "ok"
+            except FuturesTimeout:
+                # The worker keeps running in the background; the SQL executor cancels its own statement
+                status, elapsed = "timeout", time.time() - start
+                result = {"error": f"The {name} branch timed out after {timeout:g}s."}
+            except Exception as e:
+                status, elapsed = "error", time.time() - start
+                result = {"error": f"The {name} branch failed: {e}"}
+            results[name] = result
+            timings[name] = {"status": status, "elapsed_seconds": elapsed}
+        return results, timings
+
     # -------------------------
     # Query History
     # -------------------------
     def get_history(self, limit: int = 50) -> List[Dict]:
-        return _query_history[:limit]
+        return query_cache.history(limit)
@@ -0,0 +1,367 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import sqlparse
+from sqlparse import sql as sql_tokens
+from sqlparse import tokens as T
+
+from services.metrics import registry
+
+# off: execute as generated | reject: refuse statements over budget |
+# rewrite: cap the over-budget full scans in limited subqueries, reject if that is not enough
+SQL_COST_GUARD = os.getenv("SQL_COST_GUARD", "off").lower()
+# Planner cost units (PostgreSQL total cost, MySQL query_cost); SQLite has no cost estimate
+SQL_MAX_PLAN_COST = float(os.getenv("SQL_MAX_PLAN_COST", "1000000"))
+# Estimated rows read, all dialects (SQLite: product of the nested full-scan table sizes)
+SQL_MAX_PLAN_ROWS = float(os.getenv("SQL_MAX_PLAN_ROWS", "10000000"))
+# Rows each over-budget table scan is capped at by the rewrite
+SQL_REWRITE_ROW_LIMIT = int(os.getenv("SQL_REWRITE_ROW_LIMIT", "10000"))
+SQL_PLAN_CACHE_SIZE = int(os.getenv("SQL_PLAN_CACHE_SIZE", "1024"))
+SQL_PLAN_CACHE_TTL_SECONDS = float(os.getenv("SQL_PLAN_CACHE_TTL_SECONDS", "600"))
+
+COST_GUARD_MODES = ("off", "reject", "rewrite")
+
+logger = logging.getLogger(__name__)
+
+if SQL_COST_GUARD not in COST_GUARD_MODES:
+    logger.warning("Unknown SQL_COST_GUARD %r; use one of %s. The cost guard is off.",
+                   SQL_COST_GUARD, COST_GUARD_MODES)
+    SQL_COST_GUARD = "off"
+
+COST_GUARD_CHECKS = registry.counter(
+    "nlq_sql_cost_guard_total", "Pre-flight plan checks by verdict and plan cache outcome.",
+    labels=("action", "plan_cache"),
+)
+
+# SQLite's own guess for the rows an index lookup returns
+_SQLITE_SEARCH_ROWS = 10
+# SQLite before 3.36 prints "SCAN TABLE x" / "SEARCH TABLE x USING ..."
+_SQLITE_LOOP = re.compile(r"^(SCAN|SEARCH)(?: TABLE)? (\w+)")
+_SQLITE_SUBQUERY = re.compile(r"^(?:MATERIALIZE|CO-ROUTINE) (\w+)")
+_TOP_LEVEL_LIMIT = re.compile(r"\blimit\s+(\d+)\s*(?:offset\s+\d+\s*)?;?\s*$", re.IGNORECASE)
+# Aggregates, grouping and DISTINCT read their whole input before the LIMIT applies
+_READS_ALL = re.compile(r"\b(?:count|sum|avg|min|max|group_concat|total)\s*\(|\bgroup\s+by\b|\bdistinct\b",
+                        re.IGNORECASE)
+
+
+def normalize_sql(sql: str) -> str:
+    """Plan cache key: whitespace collapsed, trailing semicolon dropped."""
+    return " ".join(sql.split()).rstrip(";").rstrip()
+
+
+def _from_references(group) -> List[Tuple[Any, Any]]:
+    """``(container, identifier)`` for every table or subquery named after FROM / JOIN."""
+    found = []
+    expect_table = False
+    for token in group.tokens:
+        if token.is_whitespace or token.ttype in T.Comment:
+            continue
+        if token.ttype in T.Keyword:
+            value = token.normalized
+            expect_table = value == "FROM" or value.endswith("JOIN")
+            continue
+        if expect_table and isinstance(token, sql_tokens.IdentifierList):
+            found.extend((token, i) for i in token.get_identifiers() if isinstance(i, sql_tokens.Identifier))
+        elif expect_table and isinstance(token, sql_tokens.Identifier):
+            found.append((group, token))
+        expect_table = False
+        if token.is_group:
+            found.extend(_from_references(token))
+    return found
+
+
+def _subquery(identifier) -> Optional[Any]:
+    return next((t for t in identifier.tokens if isinstance(t, sql_tokens.Parenthesis)), None)
+
+
+def table_references(sql: str) -> Dict[str, Tuple[Optional[str], Optional[int]]]:
+    """
+    ``{alias or name (lower-cased): (table, limit)}`` for the FROM / JOIN
+    references of ``sql``; subqueries have no table and the LIMIT they end with.
+    """
+    references = {}
+    for _container, identifier in _from_references(sqlparse.parse(sql)[0]):
+        subquery = _subquery(identifier)
+        name = identifier.get_alias() or identifier.get_real_name()
+        if not name:
+            continue
+        if subquery is None:
+            # A rewritten statement reuses the table name as its subquery's alias; the subquery wins
+            references.setdefault(name.lower(), (identifier.get_real_name(), None))
+        else:
+            limit = _TOP_LEVEL_LIMIT.search(str(subquery)[1:-1])
+            references[name.lower()] = (None, int(limit.group(1)) if limit else None)
+    return references
+
+
+def limit_table_scans(sql: str, tables: Dict[str, int]) -> str:
+    """
+    Replaces every ``FROM``/``JOIN`` reference to a table in ``tables`` with a
+    subquery reading at most that many of its rows, keeping the reference's
+    alias (or the table name) so the rest of the statement still resolves.
+    """
+    wanted = {name.lower(): limit for name, limit in tables.items()}
+    statement = sqlparse.parse(sql)[0]
+    for container, identifier in _from_references(statement):
+        name = identifier.get_real_name()
+        if _subquery(identifier) is not None or not name or name.lower() not in wanted:
+            continue
+        parent = identifier.get_parent_name()
+        source = f"{parent}.{name}" if parent else name
+        alias = identifier.get_alias() or name
+        replacement = f"(SELECT * FROM {source} LIMIT {wanted[name.lower()]}) AS {alias}"
+        container.tokens[container.tokens.index(identifier)] = sql_tokens.Token(T.Other, replacement)
+    return str(statement)
+
+
+class QueryCostGuard:
+    """
+    Pre-flight check of generated SQL against the database's own plan.
+
+    Runs the dialect's ``EXPLAIN`` through the SQL executor (so it shares the
+    pool, slots and timeout) and reads the estimated cost and row counts:
+    ``EXPLAIN (FORMAT JSON)`` on PostgreSQL, ``EXPLAIN FORMAT=JSON`` on MySQL /
+    MariaDB, and ``EXPLAIN QUERY PLAN`` on SQLite, where the rows read are
+    estimated from the sizes of the tables each nested loop scans in full.
+    Statements over budget are rejected, or in ``rewrite`` mode have their
+    large full scans capped in ``LIMIT`` subqueries (which makes the answer
+    approximate) and are checked again. Verdicts are cached by normalized SQL,
+    so a repeated statement is not explained again. Other dialects, and
+    statements whose plan cannot be read, are let through.
+    """
+
+    def __init__(self, executor, mode: str = SQL_COST_GUARD, max_cost: float = SQL_MAX_PLAN_COST,
+                 max_rows: float = SQL_MAX_PLAN_ROWS, rewrite_row_limit: int = SQL_REWRITE_ROW_LIMIT,
+                 cache_size: int = SQL_PLAN_CACHE_SIZE, cache_ttl: float = SQL_PLAN_CACHE_TTL_SECONDS):
+        self.executor = executor
+        self.dialect = executor.engine.dialect.name
+        self.mode = mode
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.rewrite_row_limit = rewrite_row_limit
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._plans: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._table_rows: Dict[str, Tuple[float, Optional[int]]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off" and self.dialect in ("postgresql", "mysql", "mariadb", "sqlite")
+
+    def check(self, sql: str) -> Dict[str, Any]:
+        """
+        Verdict for ``sql``: ``{"action": "allow" | "reject" | "rewrite", "sql",
+        "estimate", "reason"?}`` where ``sql`` is the statement to run. Cached
+        verdicts carry ``"cached": True``.
+        """
+        key = normalize_sql(sql)
+        now = time.time()
+        with self._lock:
+            entry = self._plans.get(key)
+            if entry is not None and now - entry[0] <= self.cache_ttl:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                COST_GUARD_CHECKS.inc(action=entry[1]["action"], plan_cache="hit")
+                return {**entry[1], "cached": True}
+            self.misses += 1
+
+        verdict = self._decide(sql)
+        with self._lock:
+            self._plans[key] = (now, verdict)
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.cache_size:
+                self._plans.popitem(last=False)
+        COST_GUARD_CHECKS.inc(action=verdict["action"], plan_cache="miss")
+        return {**verdict, "cached": False}
+
+    def clear(self):
+        """Forgets cached plans and table sizes (the schema or the data changed shape)."""
+        with self._lock:
+            self._plans.clear()
+            self._table_rows.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"mode": self.mode, "plans": len(self._plans), "hits": self.hits, "misses": self.misses}
+
+    def _decide(self, sql: str) -> Dict[str, Any]:
+        estimate = self.estimate(sql)
+        if estimate is None:
+            return {"action": "allow", "sql": sql, "estimate": None}
+        reason = self._over_budget(estimate)
+        if reason is None:
+            return {"action": "allow", "sql": sql, "estimate": estimate}
+        if self.mode == "rewrite":
+            scans = {table: self.rewrite_row_limit for table, rows in estimate["full_scans"].items()
+                     if rows is None or rows > self.rewrite_row_limit}
+            if scans:
+                rewritten = limit_table_scans(sql, scans)
+                rewritten_estimate = self.estimate(rewritten) if rewritten != sql else None
+                if rewritten_estimate is not None and self._over_budget(rewritten_estimate) is None:
+                    return {"action": "rewrite", "sql": rewritten, "estimate": rewritten_estimate,
+                            "reason": f"{reason}; scans of {', '.join(sorted(scans))} limited to "
+                                      f"{self.rewrite_row_limit} rows each (approximate result)"}
+        return {"action": "reject", "sql": sql, "estimate": estimate, "reason": reason}
+
+    def _over_budget(self, estimate: Dict[str, Any]) -> Optional[str]:
+        cost, rows = estimate.get("cost"), estimate.get("rows")
+        if cost is not None and cost > self.max_cost:
+            return f"estimated cost {cost:,.0f} exceeds SQL_MAX_PLAN_COST {self.max_cost:,.0f}"
+        if rows is not None and rows > self.max_rows:
+            return f"estimated {rows:,.0f} rows read exceeds SQL_MAX_PLAN_ROWS {self.max_rows:,.0f}"
+        return None
+
+    # -------------------------
+    # Plan estimates per dialect
+    # -------------------------
+    def estimate(self, sql: str) -> Optional[Dict[str, Any]]:
+        """
+        ``{"cost", "rows", "full_scans": {table: rows}}`` from the plan, or None
+        when the dialect is not supported or EXPLAIN failed (execution will
+        then report the real error).
+        """
+        statement = normalize_sql(sql)
+        try:
+            if self.dialect == "postgresql":
+                return self._estimate_postgresql(statement)
+            if self.dialect in ("mysql", "mariadb"):
+                return self._estimate_mysql(statement)
+            if self.dialect == "sqlite":
+                return self._estimate_sqlite(statement)
+        except (ValueError, KeyError, TypeError, IndexError) as e:
+            logger.warning("Could not read the query plan: %s", e)
+        return None
+
+    def _explain(self, sql: str) -> Optional[List[tuple]]:
+        result = self.executor.execute(sql)
+        if "error" in result:
+            logger.warning("EXPLAIN failed: %s", result["error"])
+            return None
+        return result["rows"]
+
+    def _estimate_postgresql(self, sql: str) -> Optional[Dict[str, Any]]:
+        rows = self._explain(f"EXPLAIN (FORMAT JSON) {sql}")
+        if not rows:
+            return None
+        document = rows[0][0]
+        plan = (json.loads(document) if isinstance(document, str) else document)[0]["Plan"]
+        full_scans: Dict[str, Optional[float]] = {}
+        max_rows = 0.0
+        stack = [plan]
+        while stack:
+            node = stack.pop()
+            max_rows = max(max_rows, float(node.get("Plan Rows", 0)))
+            if node.get("Node Type") == "Seq Scan" and node.get("Relation Name"):
+                table = node["Relation Name"]
+                full_scans[table] = max(full_scans.get(table) or 0.0, float(node.get("Plan Rows", 0)))
+            stack.extend(node.get("Plans", []))
+        return {"cost": float(plan["Total Cost"]), "rows": max_rows, "full_scans": full_scans}
+
+    def _estimate_mysql(self, sql: str) -> Optional[Dict[str, Any]]:
+        rows = self._explain(f"EXPLAIN FORMAT=JSON {sql}")
+        if not rows:
+            return None
+        block = json.loads(rows[0][0])["query_block"]
+        cost = block.get("cost_info", {}).get("query_cost")
+        full_scans: Dict[str, Optional[float]] = {}
+        examined = 1.0
+
+        def walk(node):
+            nonlocal examined
+            if isinstance(node, list):
+                for item in node:
+                    walk(item)
+            elif isinstance(node, dict):
+                if "table_name" in node:
+                    # MySQL: rows_examined_per_scan, MariaDB: rows
+                    table_rows = float(node.get("rows_examined_per_scan", node.get("rows", 1)) or 1)
+                    examined *= max(table_rows, 1.0)
+                    if node.get("access_type") == "ALL":
+                        full_scans[node["table_name"]] = table_rows
+                for value in node.values():
+                    if isinstance(value, (dict, list)):
+                        walk(value)
+
+        walk(block)
+        return {"cost": float(cost) if cost is not None else None, "rows": examined, "full_scans": full_scans}
+
+    def _estimate_sqlite(self, sql: str) -> Optional[Dict[str, Any]]:
+        rows = self._explain(f"EXPLAIN QUERY PLAN {sql}")
+        if rows is None:
+            return None
+        children: Dict[int, List[tuple]] = {}
+        for node_id, parent, _unused, detail in rows:
+            children.setdefault(parent, []).append((node_id, detail))
+        references = table_references(sql)
+        derived: Dict[str, float] = {}  # materialized subqueries / CTEs -> rows they produce
+        full_scans: Dict[str, Optional[float]] = {}
+
+        def loop_rows(kind: str, name: str) -> float:
+            if kind == "SEARCH":
+                return _SQLITE_SEARCH_ROWS
+            if name.lower() in derived:
+                return derived[name.lower()]
+            # The plan names loops by alias; CTEs and "SCAN CONSTANT ROW" have no size of their own
+            table = references.get(name.lower(), (None, None))[0] or name
+            size = self._sqlite_table_rows(table)
+            if size is None:
+                return 1.0
+            full_scans[table] = float(size)
+            return float(size)
+
+        def block_rows(parent: int) -> Tuple[float, float]:
+            # Loops of one block nest: rows read = product of their sizes; nested
+            # blocks (subqueries, CTEs, compound SELECTs) add their own.
+            # Returns (rows, rows without the outermost loop).
+            product, inner, nested, first = 1.0, 1.0, 0.0, True
+            for node_id, detail in children.get(parent, []):
+                loop = _SQLITE_LOOP.match(detail)
+                if loop:
+                    size = max(loop_rows(loop.group(1), loop.group(2)), 1.0)
+                    product *= size
+                    if not first:
+                        inner *= size
+                    first = False
+                if node_id not in children:
+                    continue
+                read, block_inner = block_rows(node_id)
+                subquery = _SQLITE_SUBQUERY.match(detail)
+                if subquery:
+                    limit = references.get(subquery.group(1).lower(), (None, None))[1]
+                    if limit is not None:
+                        read = min(read, limit * block_inner)
+                    derived[subquery.group(1).lower()] = float(min(read, limit) if limit is not None else read)
+                nested += read
+            return product + nested, inner + nested
+
+        total, inner = block_rows(0)
+        limit = _TOP_LEVEL_LIMIT.search(sql)
+        streaming = not any("TEMP B-TREE" in detail for _id, _parent, _unused, detail in rows) \
+            and not _READS_ALL.search(sql)
+        if limit and streaming:
+            # Without sorting or aggregation SQLite stops reading once the LIMIT is reached
+            total = min(total, int(limit.group(1)) * inner)
+        return {"cost": None, "rows": total, "full_scans": full_scans}
+
+    def _sqlite_table_rows(self, table: str) -> Optional[int]:
+        now = time.time()
+        with self._lock:
+            cached = self._table_rows.get(table)
+        if cached is not None and now - cached[0] <= self.cache_ttl:
+            return cached[1]
+        # MAX(rowid) is an index seek, unlike COUNT(*); close enough for a budget
+        quoted = '"' + table.replace('"', '""') + '"'
+        result = self.executor.execute(f"SELECT MAX(rowid) FROM {quoted}")
+        size = None if "error" in result or not result["rows"] else int(result["rows"][0][0] or 0)
+        with self._lock:
+            self._table_rows[table] = (now, size)
+        return size
@@ -0,0 +1,118 @@
+import base64
+import datetime
+import decimal
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+
+
+def json_default(value: Any) -> Any:
+    """``json.dumps`` fallback for the values database drivers return."""
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode("ascii")
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return str(value)
+
+
+# "rows": one object per row (default); "columns": names and types once, then
+# row arrays; "arrow": Apache Arrow IPC stream, base64-encoded (needs pyarrow)
+RESULT_FORMATS = ("rows", "columns", "arrow")
+
+_TYPE_NAMES = (
+    (bool, "boolean"),
+    (int, "integer"),
+    (float, "float"),
+    (decimal.Decimal, "decimal"),
+    (datetime.datetime, "timestamp"),
+    (datetime.date, "date"),
+    (datetime.time, "time"),
+    (datetime.timedelta, "interval"),
+    ((bytes, bytearray, memoryview), "binary"),
+    (str, "string"),
+)
+
+
+def value_type(value: Any) -> str:
+    for python_type, name in _TYPE_NAMES:
+        if isinstance(value, python_type):
+            return name
+    return "string"
+
+
+def column_types(rows: List[Sequence], width: int) -> List[Optional[str]]:
+    """Type of the first non-null value per column; None for all-null columns."""
+    types: List[Optional[str]] = [None] * width
+    missing = set(range(width))
+    for row in rows:
+        for i in list(missing):
+            if row[i] is not None:
+                types[i] = value_type(row[i])
+                missing.discard(i)
+        if not missing:
+            break
+    return types
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+    except ImportError:
+        raise ValueError("result_format 'arrow' requires pyarrow (pip install pyarrow).")
+    return pyarrow
+
+
+def check_result_format(result_format: str):
+    """Raises ValueError for an unknown format, or 'arrow' without pyarrow installed."""
+    if result_format not in RESULT_FORMATS:
+        raise ValueError(f"result_format must be one of {', '.join(RESULT_FORMATS)}.")
+    if result_format == "arrow":
+        _pyarrow()
+
+
+def to_arrow_ipc(columns: List[str], rows: List[Sequence]) -> bytes:
+    """Serializes a result as an Arrow IPC stream (one record batch)."""
+    pa = _pyarrow()
+    arrays = []
+    for i in range(len(columns)):
+        values = [row[i] for row in rows]
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Mixed-type columns (e.g. SQLite's dynamic typing) fall back to text
+            arrays.append(pa.array([None if v is None else str(v) for v in values], type=pa.string()))
+    batch = pa.RecordBatch.from_arrays(arrays, names=columns)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def format_result(result: Dict[str, Any], result_format: str = "rows") -> Dict[str, Any]:
+    """
+    Renders a compact SQL result (``{"columns", "rows": [[...]], ...}``, as
+    returned by SQLExecutor) in the requested layout. Errors pass through.
+    """
+    if not result or "error" in result or "columns" not in result:
+        return result
+    check_result_format(result_format)
+    columns, rows = result["columns"], result["rows"]
+    extra = {k: v for k, v in result.items() if k not in ("columns", "rows")}
+    if result_format == "rows":
+        return {"rows": [dict(zip(columns, row)) for row in rows], **extra}
+    if result_format == "columns":
+        return {"columns": columns, "types": column_types(rows, len(columns)),
+                "rows": [list(row) for row in rows], **extra}
+    return {
+        "format": "arrow",
+        "columns": columns,
+        "row_count": len(rows),
+        "arrow_ipc_base64": base64.b64encode(to_arrow_ipc(columns, rows)).decode("ascii"),
+        **extra,
+    }
@@ -1,66 +1,270 @@
-from sqlalchemy import create_engine, inspect, MetaData
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.default import DefaultDialect
 from sqlalchemy.exc import SQLAlchemyError
 
+logger = logging.getLogger(__name__)
+
+# Discovered schemas are cached here per connection; set to an empty string to disable
+SCHEMA_CACHE_DIR = os.getenv("SCHEMA_CACHE_DIR", "data/schema_cache")
+# Parallel per-table inspection for dialects without bulk catalog reflection
+SCHEMA_DISCOVERY_WORKERS = int(os.getenv("SCHEMA_DISCOVERY_WORKERS", "8"))
+SCHEMA_CACHE_VERSION = 1
+
+# One catalog query per dialect returning (table_name, signature): the signature
+# changes whenever a table's columns, types, defaults or foreign keys change.
+_SIGNATURE_QUERIES = {
+    "sqlite": """
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+    """,
+    "postgresql": """
+        SELECT c.relname,
+               md5(string_agg(a.attname || ':' || format_type(a.atttypid, a.atttypmod) || ':'
+                              || a.attnotnull::text || ':' || coalesce(pg_get_expr(d.adbin, d.adrelid), ''),
+                              ',' ORDER BY a.attnum)
+                   || coalesce((SELECT string_agg(pg_get_constraintdef(con.oid), ',' ORDER BY con.conname)
+                                FROM pg_constraint con
+                                WHERE con.conrelid = c.oid AND con.contype = 'f'), ''))
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        LEFT JOIN pg_attrdef d ON d.adrelid = c.oid AND d.adnum = a.attnum
+        WHERE c.relkind IN ('r', 'p') AND n.nspname = current_schema()
+        GROUP BY c.oid, c.relname
+    """,
+    "mysql": """
+        SELECT c.TABLE_NAME,
+               MD5(CONCAT(
+                   GROUP_CONCAT(CONCAT_WS(':', c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE,
+                                          IFNULL(c.COLUMN_DEFAULT, ''))
+                                ORDER BY c.ORDINAL_POSITION SEPARATOR ','),
+                   IFNULL((SELECT GROUP_CONCAT(CONCAT_WS(':', k.COLUMN_NAME, k.REFERENCED_TABLE_NAME,
+                                                         k.REFERENCED_COLUMN_NAME)
+                                               ORDER BY k.CONSTRAINT_NAME, k.ORDINAL_POSITION SEPARATOR ',')
+                           FROM information_schema.KEY_COLUMN_USAGE k
+                           WHERE k.TABLE_SCHEMA = c.TABLE_SCHEMA AND k.TABLE_NAME = c.TABLE_NAME
+                             AND k.REFERENCED_TABLE_NAME IS NOT NULL), '')))
+        FROM information_schema.COLUMNS c
+        JOIN information_schema.TABLES t
+          ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME AND t.TABLE_TYPE = 'BASE TABLE'
+        WHERE c.TABLE_SCHEMA = DATABASE()
+        GROUP BY c.TABLE_SCHEMA, c.TABLE_NAME
+    """,
+}
+_DIALECT_ALIASES = {"mariadb": "mysql"}
+
+
+def schema_fingerprint(tables: List[Dict]) -> str:
+    """Content hash of the table definitions, independent of discovery order."""
+    canonical = json.dumps(sorted(tables, key=lambda t: t["name"]), sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _column_info(column: Dict) -> Dict:
+    return {
+        "name": column['name'],
+        "type": str(column['type']),
+        "nullable": column['nullable'],
+        "default": column.get('default'),
+    }
+
+
+def _foreign_key_info(fk: Dict) -> Dict:
+    return {
+        "constrained_columns": fk['constrained_columns'],
+        "referred_table": fk['referred_table'],
+        "referred_columns": fk['referred_columns'],
+    }
+
+
 class SchemaDiscovery:
     """
     Connects to a database and discovers its schema, including tables,
     columns, data types, and relationships (foreign keys).
+
+    Discovery is a single pass. Dialects with bulk catalog reflection (e.g.
+    PostgreSQL) reflect every table in a couple of queries; others inspect
+    tables in parallel. The result is cached on disk per connection together
+    with a cheap per-table signature, so a reconnect re-inspects only the
+    tables that were added or changed since the last run.
     """
 
-    def analyze_database(self, connection_string: str) -> dict:
+    def __init__(self, cache_dir: Optional[str] = SCHEMA_CACHE_DIR, max_workers: int = SCHEMA_DISCOVERY_WORKERS):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+
+    def analyze_database(self, connection_string: str, engine: Optional[Engine] = None,
+                         use_cache: bool = True) -> dict:
         """
         Analyzes the database schema and returns it as a dictionary.
 
         Args:
             connection_string: The SQLAlchemy connection string for the database.
+            engine: An existing engine for that connection; one is created if omitted.
+            use_cache: Reuse (and incrementally refresh) the on-disk schema cache.
 
         Returns:
-            A dictionary representing the database schema.
+            A dictionary representing the database schema, with a content-hash
+            ``fingerprint`` and ``discovery`` statistics.
             Returns an error dictionary if the connection fails.
         """
+        start = time.time()
         try:
-            engine = create_engine(connection_string)
-            inspector = inspect(engine)
-            metadata = MetaData()
-            metadata.reflect(bind=engine)
-
-            schema = {"tables": []}
-
-            table_names = inspector.get_table_names()
-
-            for table_name in table_names:
-                table_info = {
-                    "name": table_name,
-                    "columns": [],
-                    "foreign_keys": []
-                }
-
-                # Get column information
-                columns = inspector.get_columns(table_name)
-                for column in columns:
-                    table_info["columns"].append({
-                        "name": column['name'],
-                        "type": str(column['type']),
-                        "nullable": column['nullable'],
-                        "default": column.get('default'),
-                    })
-
-                # Get foreign key information
-                foreign_keys = inspector.get_foreign_keys(table_name)
-                for fk in foreign_keys:
-                    table_info["foreign_keys"].append({
-                        "constrained_columns": fk['constrained_columns'],
-                        "referred_table": fk['referred_table'],
-                        "referred_columns": fk['referred_columns'],
-                    })
-                
-                schema["tables"].append(table_info)
-            
+            engine = engine or create_engine(connection_string)
+            signatures = self._table_signatures(engine)
+            cached = self._load_cache(connection_string) if use_cache else None
+
+            if cached is not None and signatures is not None:
+                cached_tables = {t["name"]: t for t in cached["tables"]}
+                old_signatures = cached.get("table_signatures", {})
+                changed = [n for n, sig in signatures.items() if old_signatures.get(n) != sig or n not in cached_tables]
+                removed = [n for n in cached_tables if n not in signatures]
+                if not changed and not removed:
+                    mode = "cached"
+                    tables = cached["tables"]
+                else:
+                    mode = "incremental"
+                    fresh = {t["name"]: t for t in self._inspect_tables(engine, changed)}
+                    tables = [fresh.get(name) or cached_tables[name] for name in signatures]
+            else:
+                mode = "full"
+                changed = list(signatures) if signatures is not None else inspect(engine).get_table_names()
+                removed = []
+                tables = self._inspect_tables(engine, changed)
+
+            schema = {"tables": tables, "fingerprint": schema_fingerprint(tables)}
+            if use_cache and mode != "cached":
+                self._save_cache(connection_string, engine, schema, signatures)
+
+            schema["discovery"] = {
+                "mode": mode,
+                "tables_total": len(tables),
+                "tables_inspected": 0 if mode == "cached" else len(changed),
+                "changed_tables": [] if mode in ("cached", "full") else changed,
+                "removed_tables": removed,
+                "elapsed_seconds": time.time() - start,
+            }
             return schema
 
         except SQLAlchemyError as e:
-            print(f"Error connecting to the database or analyzing schema: {e}")
+            logger.error("Error connecting to the database or analyzing schema: %s", e)
             return {"error": f"Failed to analyze database. Details: {e}"}
         except Exception as e:
-            print(f"An unexpected error occurred: {e}")
+            logger.exception("Unexpected error while analyzing the schema")
             return {"error": f"An unexpected error occurred: {e}"}
+
+    # -------------------------
+    # Catalog access
+    # -------------------------
+    def _table_signatures(self, engine: Engine) -> Optional[Dict[str, str]]:
+        """
+        ``{table_name: signature}`` from one catalog query, or None when the
+        dialect has no signature query (those always get a full discovery).
+        """
+        dialect = _DIALECT_ALIASES.get(engine.dialect.name, engine.dialect.name)
+        query = _SIGNATURE_QUERIES.get(dialect)
+        if query is None:
+            return None
+        try:
+            with engine.connect() as conn:
+                if dialect == "mysql":
+                    conn.execute(text("SET SESSION group_concat_max_len = 1048576"))
+                rows = conn.execute(text(query)).fetchall()
+        except SQLAlchemyError as e:
+            logger.warning("Schema signature query failed, falling back to full discovery: %s", e)
+            return None
+        signatures = {}
+        for name, signature in rows:
+            signatures[name] = hashlib.sha1((signature or "").encode("utf-8")).hexdigest()
+        return dict(sorted(signatures.items()))
+
+    @staticmethod
+    def _supports_bulk_reflection(engine: Engine) -> bool:
+        # Dialects that override the default per-table loop reflect all tables in a few queries
+        return type(engine.dialect).get_multi_columns is not DefaultDialect.get_multi_columns
+
+    def _inspect_tables(self, engine: Engine, table_names: List[str]) -> List[Dict]:
+        if not table_names:
+            return []
+        if self._supports_bulk_reflection(engine):
+            return self._inspect_bulk(engine, table_names)
+        # SQLite reads a local file (and :memory: databases are per-connection), so stay serial there
+        if engine.dialect.name == "sqlite" or self.max_workers <= 1 or len(table_names) == 1:
+            inspector = inspect(engine)
+            return [self._inspect_table(inspector, name) for name in table_names]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(table_names))) as pool:
+            # Inspector caches are not thread-safe: one inspector per task
+            return list(pool.map(lambda name: self._inspect_table(inspect(engine), name), table_names))
+
+    def _inspect_bulk(self, engine: Engine, table_names: List[str]) -> List[Dict]:
+        inspector = inspect(engine)
+        columns = {key[1]: value for key, value in inspector.get_multi_columns(filter_names=table_names).items()}
+        foreign_keys = {key[1]: value for key, value in
+                        inspector.get_multi_foreign_keys(filter_names=table_names).items()}
+        return [
+            {
+                "name": name,
+                "columns": [_column_info(c) for c in columns.get(name, [])],
+                "foreign_keys": [_foreign_key_info(fk) for fk in foreign_keys.get(name, [])],
+            }
+            for name in table_names
+        ]
+
+    def _inspect_table(self, inspector, table_name: str) -> Dict:
+        return {
+            "name": table_name,
+            "columns": [_column_info(c) for c in inspector.get_columns(table_name)],
+            "foreign_keys": [_foreign_key_info(fk) for fk in inspector.get_foreign_keys(table_name)],
+        }
+
+    # -------------------------
+    # On-disk cache
+    # -------------------------
+    def _cache_path(self, connection_string: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        key = hashlib.sha256(connection_string.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_cache(self, connection_string: str) -> Optional[Dict]:
+        path = self._cache_path(connection_string)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable schema cache %s: %s", path, e)
+            return None
+        return cached if cached.get("version") == SCHEMA_CACHE_VERSION else None
+
+    def _save_cache(self, connection_string: str, engine: Engine, schema: Dict,
+                    signatures: Optional[Dict[str, str]]):
+        path = self._cache_path(connection_string)
+        if not path:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "version": SCHEMA_CACHE_VERSION,
+                    # The key is a hash; keep a password-free URL for humans reading the cache
+                    "url": engine.url.render_as_string(hide_password=True),
+                    "saved_at": time.time(),
+                    "fingerprint": schema["fingerprint"],
+                    "table_signatures": signatures or {},
+                    "tables": schema["tables"],
+                }, f, default=str)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write schema cache %s: %s", path, e)
@@ -0,0 +1,118 @@
+import logging
+import math
+import os
+import re
+from typing import Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Tables chosen by relevance before FK neighbours are added
+SCHEMA_PROMPT_TOP_K = int(os.getenv("SCHEMA_PROMPT_TOP_K", "5"))
+# Schemas with at most this many tables are sent whole; pruning only pays off above it
+SCHEMA_PRUNE_MIN_TABLES = int(os.getenv("SCHEMA_PRUNE_MIN_TABLES", "8"))
+# Weight of exact name matches relative to embedding similarity
+LEXICAL_WEIGHT = 0.35
+
+
+def _name_tokens(name: str) -> Set[str]:
+    """``EmployeeSalaries`` / ``employee_salaries`` -> {"employee", "salaries", "salarie", ...}."""
+    words = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", name)
+    tokens = set()
+    for word in re.split(r"[^A-Za-z0-9]+", words.lower()):
+        if len(word) < 2:
+            continue
+        tokens.add(word)
+        if word.endswith("s"):
+            tokens.add(word[:-1])
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (~4 characters per token) for when the API reports none."""
+    return math.ceil(len(text) / 4)
+
+
+class SchemaIndex:
+    """
+    Retrieval index over a discovered schema, used to keep LLM prompts small.
+
+    Each table is described by its name, columns, types and foreign keys. A
+    question is scored against every table by embedding similarity plus exact
+    name-token overlap; the top-k tables are kept and their foreign-key
+    neighbours (both directions) are added so join paths stay available.
+    """
+
+    def __init__(self, schema: Dict, encode_fn: Optional[Callable[[List[str]], np.ndarray]] = None):
+        tables = schema.get("tables", []) if schema else []
+        self.tables: Dict[str, Dict] = {t["name"]: t for t in tables}
+        self.names: List[str] = list(self.tables)
+        self.neighbours: Dict[str, Set[str]] = {name: set() for name in self.names}
+        for table in tables:
+            for fk in table.get("foreign_keys", []):
+                referred = fk.get("referred_table")
+                if referred in self.neighbours and referred != table["name"]:
+                    self.neighbours[table["name"]].add(referred)
+                    self.neighbours[referred].add(table["name"])
+
+        self._tokens = []
+        for name in self.names:
+            tokens = _name_tokens(name)
+            for column in self.tables[name]["columns"]:
+                tokens |= _name_tokens(column["name"])
+            self._tokens.append(tokens)
+
+        self._embeddings = None
+        if encode_fn is not None and len(self.names) > SCHEMA_PRUNE_MIN_TABLES:
+            try:
+                vectors = np.asarray(encode_fn([self._describe_for_retrieval(n) for n in self.names]),
+                                     dtype="float32")
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                self._embeddings = vectors / np.where(norms == 0, 1, norms)
+            except Exception as e:
+                logger.warning("Schema index embedding failed, using name matching only: %s", e)
+
+    def _describe_for_retrieval(self, name: str) -> str:
+        table = self.tables[name]
+        columns = ", ".join(f"{c['name']} {c['type']}".lower() for c in table["columns"])
+        referred = ", ".join(sorted(self.neighbours[name]))
+        text = f"table {name}: {columns}"
+        return f"{text}; related to {referred}" if referred else text
+
+    def select(self, question: str, question_embedding: Optional[np.ndarray] = None,
+               top_k: int = SCHEMA_PROMPT_TOP_K) -> List[str]:
+        """
+        Returns the table names to put in the prompt, in schema order.
+        """
+        if len(self.names) <= max(top_k, SCHEMA_PRUNE_MIN_TABLES):
+            return list(self.names)
+
+        question_tokens = _name_tokens(question)
+        scores = np.array([
+            LEXICAL_WEIGHT * len(question_tokens & tokens) for tokens in self._tokens
+        ], dtype="float32")
+        if self._embeddings is not None and question_embedding is not None:
+            q = np.asarray(question_embedding, dtype="float32").ravel()
+            norm = np.linalg.norm(q)
+            if norm:
+                scores += self._embeddings @ (q / norm)
+
+        chosen = {self.names[i] for i in np.argsort(-scores)[:top_k]}
+        for name in list(chosen):
+            chosen |= self.neighbours[name]
+        return [name for name in self.names if name in chosen]
+
+    def describe(self, names: List[str]) -> str:
+        """Prompt text for the given tables: columns with types, then foreign keys."""
+        lines = []
+        for name in names:
+            table = self.tables[name]
+            columns = ", ".join(f"{c['name']} {c['type']}" for c in table["columns"])
+            lines.append(f"Table {name}({columns})")
+            for fk in table.get("foreign_keys", []):
+                lines.append(
+                    f"  FOREIGN KEY ({', '.join(fk['constrained_columns'])}) "
+                    f"REFERENCES {fk['referred_table']}({', '.join(fk['referred_columns'])})"
+                )
+        return "\n".join(lines)
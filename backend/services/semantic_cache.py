@@ -0,0 +1,140 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Optional
+
+import numpy as np
+
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+
+_TERM_PATTERN = re.compile(r"\d+(?:\.\d+)?|\w+")
+# Words a paraphrase may add, drop or swap without changing what is asked
+_FILLER_WORDS = frozenset("""
+    a an the of in on at to for from by with and or is are was were be been do does did
+    me us my our we i you please can could would will shall should tell give show list display
+    find get fetch return retrieve see view what which who whom whose where when how many much
+    all every each any there their them those these that this it its number count
+""".split())
+
+
+def _terms(question: str) -> FrozenSet[str]:
+    """
+    Content words of a question (numbers included, simple plurals folded).
+    Values such as cities or company names embed almost identically ("employees
+    in Berlin" / "employees in Paris"), so they must match for a hit.
+    """
+    terms = set()
+    for token in _TERM_PATTERN.findall(question.lower()):
+        if token in _FILLER_WORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        terms.add(token)
+    return frozenset(terms)
+
+
+class SemanticSQLCache:
+    """
+    Second cache tier for NL->SQL: remembers (question embedding, generated SQL)
+    per schema fingerprint and reuses the SQL for a new question whose cosine
+    similarity to a stored one is at least ``threshold``.
+
+    "top 5 earners" and "top 10 earners", or "hired by Acme" and "hired by
+    Globex", embed almost identically, so a hit also requires both questions to
+    have the same content words: only filler words, the verb of the request and
+    plural endings may differ ("show me all employees in Berlin" / "list
+    employees in Berlin").
+    Entries are evicted least-recently-used across all schemas.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Dict]" = OrderedDict()  # (fingerprint, question) -> entry
+        self._matrices: Dict[str, tuple] = {}  # fingerprint -> (keys, stacked embeddings)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype="float32").ravel()
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def _matrix(self, fingerprint: str):
+        cached = self._matrices.get(fingerprint)
+        if cached is None:
+            keys = [k for k in self._entries if k[0] == fingerprint]
+            matrix = np.vstack([self._entries[k]["embedding"] for k in keys]) if keys else None
+            cached = self._matrices[fingerprint] = (keys, matrix)
+        return cached
+
+    def lookup(self, fingerprint: str, question: str, embedding: np.ndarray) -> Optional[Dict]:
+        """
+        Returns ``{"sql", "question", "similarity"}`` of the closest stored question
+        above the threshold, or None.
+        """
+        query = self._normalize(embedding)
+        terms = _terms(question)
+        with self._lock:
+            keys, matrix = self._matrix(fingerprint)
+            if matrix is not None:
+                similarities = matrix @ query
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.threshold:
+                        break
+                    entry = self._entries[keys[i]]
+                    if entry["terms"] != terms:
+                        continue
+                    self._entries.move_to_end(keys[i])
+                    entry["hits"] += 1
+                    self.hits += 1
+                    return {"sql": entry["sql"], "question": entry["question"],
+                            "similarity": float(similarities[i])}
+            self.misses += 1
+            return None
+
+    def store(self, fingerprint: str, question: str, embedding: np.ndarray, sql: str):
+        key = (fingerprint, question.strip().lower())
+        with self._lock:
+            self._entries[key] = {
+                "embedding": self._normalize(embedding),
+                "sql": sql,
+                "question": question,
+                "terms": _terms(question),
+                "hits": 0,
+            }
+            self._entries.move_to_end(key)
+            self._matrices.pop(fingerprint, None)
+            while len(self._entries) > self.max_entries:
+                (evicted_fp, _), _ = self._entries.popitem(last=False)
+                self._matrices.pop(evicted_fp, None)
+                self.evictions += 1
+
+    def clear(self, fingerprint: Optional[str] = None):
+        with self._lock:
+            if fingerprint is None:
+                self._entries.clear()
+                self._matrices.clear()
+                return
+            for key in [k for k in self._entries if k[0] == fingerprint]:
+                del self._entries[key]
+            self._matrices.pop(fingerprint, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
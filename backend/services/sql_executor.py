@@ -0,0 +1,231 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import NullPool
+
+logger = logging.getLogger(__name__)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+MAX_CONCURRENT_QUERIES = int(os.getenv("MAX_CONCURRENT_QUERIES", "10"))
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "30"))
+# Streamed exports run much longer than interactive queries
+STREAM_TIMEOUT_SECONDS = float(os.getenv("STREAM_TIMEOUT_SECONDS", "600"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+# Extra time the client waits for the server-side timeout to fire before cancelling itself
+_CANCEL_GRACE_SECONDS = 1.0
+
+
+def create_pooled_engine(connection_string: str) -> Engine:
+    """
+    Engine with a sized, pre-pinged connection pool. SQLite keeps SQLAlchemy's
+    default pool, which does not take size/overflow arguments.
+    """
+    kwargs: Dict[str, Any] = {"pool_pre_ping": True}
+    if make_url(connection_string).get_backend_name() != "sqlite":
+        kwargs.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+            pool_recycle=DB_POOL_RECYCLE_SECONDS,
+        )
+    return create_engine(connection_string, **kwargs)
+
+
+class SQLExecutor:
+    """
+    Runs SELECTs on a bounded worker pool with a per-query timeout.
+
+    At most ``max_concurrent`` statements run at once; callers that cannot get a
+    slot within the timeout are rejected instead of piling up. The timeout is
+    enforced on the server where the dialect supports it (PostgreSQL
+    ``statement_timeout``, MySQL ``max_execution_time``, a SQLite progress
+    handler), and the client additionally cancels the statement if the server
+    does not stop it in time. Session-level settings are reset before the
+    connection goes back to the pool.
+    """
+
+    def __init__(self, engine: Engine, max_concurrent: int = MAX_CONCURRENT_QUERIES,
+                 timeout_seconds: float = QUERY_TIMEOUT_SECONDS):
+        self.engine = engine
+        self.timeout_seconds = timeout_seconds
+        self.max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="sql")
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self.engine.dispose()
+
+    def execute(self, sql: str, timeout: Optional[float] = None,
+                params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Executes ``sql`` (with optional bind ``params``) and returns
+        ``{"columns", "rows", "elapsed_seconds"}`` with rows as tuples (see
+        result_format.format_result for the response layouts) or ``{"error"}``.
+        """
+        timeout = timeout or self.timeout_seconds
+        if not self._slots.acquire(timeout=timeout):
+            with self._stats_lock:
+                self.rejected += 1
+            return {"error": f"Too many concurrent queries (limit {self.max_concurrent}); try again shortly."}
+
+        state: Dict[str, Any] = {}
+        try:
+            future = self._pool.submit(self._run, sql, timeout, state, params)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._stats_lock:
+            self.in_flight += 1
+        # The slot is held until the statement really finishes, even after a timeout
+        future.add_done_callback(self._release_slot)
+
+        try:
+            return future.result(timeout=timeout + _CANCEL_GRACE_SECONDS)
+        except FuturesTimeout:
+            with self._stats_lock:
+                self.timeouts += 1
+            self._cancel(state)
+            return {"error": f"Query timed out after {timeout:g}s and was cancelled."}
+
+    def _release_slot(self, _future):
+        with self._stats_lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def _run(self, sql: str, timeout: float, state: Dict[str, Any],
+             params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        start = time.time()
+        try:
+            with self.engine.connect() as conn:
+                state["dbapi_connection"] = conn.connection.dbapi_connection
+                with self._statement_timeout(conn, timeout):
+                    result = conn.execute(text(sql), params or {})
+                    columns = list(result.keys())
+                    rows = [tuple(r) for r in result.fetchall()]
+            return {"columns": columns, "rows": rows, "elapsed_seconds": time.time() - start}
+        except SQLAlchemyError as e:
+            if state.get("cancelled") or self._is_timeout_error(e):
+                if not state.get("cancelled"):
+                    with self._stats_lock:
+                        self.timeouts += 1
+                return {"error": f"Query timed out after {timeout:g}s and was cancelled."}
+            return {"error": f"SQL execution error: {e}"}
+        except Exception as e:
+            return {"error": f"Unexpected SQL execution error: {e}"}
+
+    def stream(self, sql: str, batch_size: int = STREAM_BATCH_SIZE,
+               timeout: float = STREAM_TIMEOUT_SECONDS) -> Iterator[Tuple[List[str], List[tuple]]]:
+        """
+        Yields ``(column_names, rows)`` batches from a server-side cursor, so the
+        full result is never held in memory. The first batch is always empty so
+        callers learn the columns before any rows arrive. Holds one concurrency slot and one
+        pooled connection until the generator is exhausted or closed.
+        """
+        if not self._slots.acquire(timeout=self.timeout_seconds):
+            with self._stats_lock:
+                self.rejected += 1
+            raise RuntimeError(f"Too many concurrent queries (limit {self.max_concurrent}); try again shortly.")
+        with self._stats_lock:
+            self.in_flight += 1
+        try:
+            with self.engine.connect() as conn, self._statement_timeout(conn, timeout):
+                result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(text(sql))
+                columns = list(result.keys())
+                yield columns, []
+                for partition in result.partitions(batch_size):
+                    yield columns, [tuple(row) for row in partition]
+        finally:
+            self._release_slot(None)
+
+    @contextmanager
+    def _statement_timeout(self, conn, timeout: float):
+        """Applies the server-side timeout to the statements run inside the block."""
+        dialect = self.engine.dialect.name
+        timeout_ms = max(1, int(timeout * 1000))
+        if dialect == "postgresql":
+            # LOCAL: scoped to this transaction, reset when the connection returns to the pool
+            conn.execute(text(f"SET LOCAL statement_timeout = {timeout_ms}"))
+            yield
+        elif dialect in ("mysql", "mariadb"):
+            # SESSION outlives the checkout, so it is put back before the pool hands the connection on
+            variable = "max_statement_time" if dialect == "mariadb" else "max_execution_time"
+            value = timeout if dialect == "mariadb" else timeout_ms
+            conn.execute(text(f"SET SESSION {variable} = {value}"))
+            try:
+                yield
+            finally:
+                try:
+                    conn.execute(text(f"SET SESSION {variable} = DEFAULT"))
+                except SQLAlchemyError as e:
+                    # Don't return a connection that may still carry the timeout
+                    logger.warning("Could not reset %s, discarding the connection: %s", variable, e)
+                    conn.invalidate()
+        elif dialect == "sqlite":
+            dbapi_conn = conn.connection.dbapi_connection
+            deadline = time.monotonic() + timeout
+            # A non-zero return aborts the running statement with "interrupted"
+            dbapi_conn.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+            try:
+                yield
+            finally:
+                dbapi_conn.set_progress_handler(None, 0)
+        else:
+            yield
+
+    @staticmethod
+    def _is_timeout_error(error: SQLAlchemyError) -> bool:
+        message = str(error).lower()
+        return any(marker in message for marker in (
+            "statement timeout", "canceling statement", "interrupted",
+            "maximum statement execution time", "max_statement_time",
+        ))
+
+    def _cancel(self, state: Dict[str, Any]):
+        """Best-effort client-side cancellation of a statement that overran its timeout."""
+        dbapi_conn = state.get("dbapi_connection")
+        if dbapi_conn is None:
+            return
+        state["cancelled"] = True
+        try:
+            if hasattr(dbapi_conn, "cancel"):          # psycopg2 / psycopg
+                dbapi_conn.cancel()
+            elif hasattr(dbapi_conn, "interrupt"):     # sqlite3
+                dbapi_conn.interrupt()
+            elif callable(getattr(dbapi_conn, "thread_id", None)):  # PyMySQL / mysqlclient
+                # A connection of its own: the pool may be exhausted by the statements being cancelled
+                kill_engine = create_engine(self.engine.url, poolclass=NullPool)
+                try:
+                    with kill_engine.connect() as conn:
+                        conn.execute(text(f"KILL QUERY {int(dbapi_conn.thread_id())}"))
+                finally:
+                    kill_engine.dispose()
+        except Exception as e:
+            logger.warning("Could not cancel timed-out query: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        pool = self.engine.pool
+        with self._stats_lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "in_flight": self.in_flight,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "timeout_seconds": self.timeout_seconds,
+                "pool": pool.status() if hasattr(pool, "status") else None,
+            }
@@ -0,0 +1,130 @@
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+import faiss
+
+from services.chunk_store import ChunkStore
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves are still atomic, just not cross-process locked
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_CURRENT_FILE = "CURRENT"
+_LOCK_FILE = ".lock"
+_INDEX_FILE = "index.faiss"
+_GENERATION_PREFIX = "gen-"
+KEEP_GENERATIONS = 2
+
+
+class DocumentStorage:
+    """
+    Persists the FAISS index and chunk store under a storage directory.
+
+    Every save writes a complete new generation directory and then atomically
+    repoints the ``CURRENT`` file at it, so a crash mid-save leaves the previous
+    generation intact and readers never observe a half-written corpus. Loads are
+    memory-mapped where possible, which lets several worker processes share one
+    read-only copy through the page cache.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, _LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def current_generation(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.directory, _CURRENT_FILE), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def save(self, vector_index, chunk_store: ChunkStore) -> str:
+        """
+        Writes a new generation and makes it current. Returns its path.
+        """
+        with self._locked():
+            generation = f"{_GENERATION_PREFIX}{time.time_ns()}"
+            final_path = os.path.join(self.directory, generation)
+            tmp_path = final_path + ".tmp"
+            os.makedirs(tmp_path)
+            try:
+                faiss.write_index(vector_index, os.path.join(tmp_path, _INDEX_FILE))
+                chunk_store.save(tmp_path)
+                os.rename(tmp_path, final_path)
+            except Exception:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+
+            current_tmp = os.path.join(self.directory, _CURRENT_FILE + ".tmp")
+            with open(current_tmp, "w", encoding="utf-8") as f:
+                f.write(generation)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(current_tmp, os.path.join(self.directory, _CURRENT_FILE))
+
+            self._prune_generations(keep=generation)
+            return final_path
+
+    def _prune_generations(self, keep: str):
+        # Keep the previous generation too: a reader may still be opening it.
+        generations = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(_GENERATION_PREFIX) and not name.endswith(".tmp")
+        )
+        for name in generations[:-KEEP_GENERATIONS]:
+            if name != keep:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def load(self, mmap: bool = True) -> Optional[Tuple[object, ChunkStore, str, bool]]:
+        """
+        Loads the current generation.
+
+        Returns ``(vector_index, chunk_store, generation, index_is_mmapped)`` or
+        None when nothing has been saved yet.
+        """
+        generation = self.current_generation()
+        if generation is None:
+            return None
+        path = os.path.join(self.directory, generation)
+
+        index_path = os.path.join(path, _INDEX_FILE)
+        index_is_mmapped = False
+        if mmap:
+            try:
+                vector_index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                index_is_mmapped = True
+            except Exception as e:
+                # Not every index type / FAISS build supports mapping; fall back to reading it
+                logger.warning("Memory-mapping %s failed, reading it instead: %s", index_path, e)
+                vector_index = faiss.read_index(index_path)
+        else:
+            vector_index = faiss.read_index(index_path)
+
+        chunk_store = ChunkStore.open(path, mmap=mmap)
+        # Vectors of deleted chunks are removed from the index (HNSW keeps them as tombstones)
+        if not chunk_store.live_count() <= vector_index.ntotal <= len(chunk_store):
+            raise ValueError(f"Generation {generation} is inconsistent: "
+                             f"{chunk_store.live_count()} live chunks vs {vector_index.ntotal} vectors")
+        return vector_index, chunk_store, generation, index_is_mmapped
+
+    def index_path(self, generation: str) -> str:
+        return os.path.join(self.directory, generation, _INDEX_FILE)
@@ -0,0 +1,209 @@
+import codecs
+import io
+import os
+import re
+import time
+from typing import Iterable, Iterator, List, Tuple
+
+import pypdf
+import docx
+
+# Kept free of model / index imports so process-pool workers start quickly
+SUPPORTED_EXTENSIONS = {"pdf", "docx", "txt"}
+
+# Chunks are packed up to this many tokens (the embedding model truncates at 256 word pieces)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+# Tokens repeated from the end of one chunk at the start of the next
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+# Chunks handed from an extraction worker to the embedding side at a time
+EXTRACT_BATCH_CHUNKS = int(os.getenv("EXTRACT_BATCH_CHUNKS", "64"))
+
+# Words and punctuation marks; a cheap, slightly low estimate of the model's word pieces
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def file_extension(filename: str) -> str:
+    return filename.split('.')[-1].lower()
+
+
+def count_tokens(text: str) -> int:
+    return len(_TOKEN_RE.findall(text))
+
+
+def iter_pdf_pages(file_content: bytes) -> Iterator[str]:
+    """Yields the text of one page at a time. Raises ValueError for a corrupt or encrypted PDF."""
+    try:
+        reader = pypdf.PdfReader(io.BytesIO(file_content))
+        for page in reader.pages:
+            text = page.extract_text()
+            if text:
+                yield text
+    except Exception as e:
+        # Parser exception types may not survive the trip back from a pool worker
+        raise ValueError(f"Could not read PDF: {e}") from e
+
+
+def iter_docx_paragraphs(file_content: bytes) -> Iterator[str]:
+    """Yields the non-empty paragraphs. Raises ValueError for a corrupt DOCX."""
+    try:
+        doc = docx.Document(io.BytesIO(file_content))
+        for p in doc.paragraphs:
+            if p.text:
+                yield p.text
+    except Exception as e:
+        raise ValueError(f"Could not read DOCX: {e}") from e
+
+
+def iter_txt_blocks(file_content: bytes, block_size: int = 1 << 20) -> Iterator[str]:
+    """Decodes the file in blocks cut at the last blank line, so paragraphs stay whole."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    pending = ""
+    for start in range(0, len(file_content), block_size):
+        pending += decoder.decode(file_content[start:start + block_size])
+        cut = pending.rfind("\n\n")
+        if cut > 0:
+            yield pending[:cut]
+            pending = pending[cut + 2:]
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def iter_text(filename: str, file_content: bytes) -> Iterator[str]:
+    """
+    Yields the file's text in pieces (PDF pages, DOCX paragraphs, TXT blocks);
+    each piece ends at a paragraph boundary.
+    """
+    ext = file_extension(filename)
+    if ext == 'pdf':
+        return iter_pdf_pages(file_content)
+    if ext == 'docx':
+        return iter_docx_paragraphs(file_content)
+    if ext == 'txt':
+        return iter_txt_blocks(file_content)
+    return iter(())
+
+
+def extract_text_from_pdf(file_content: bytes) -> str:
+    return "\n\n".join(iter_pdf_pages(file_content))
+
+
+def extract_text_from_docx(file_content: bytes) -> str:
+    return "\n".join(iter_docx_paragraphs(file_content))
+
+
+def extract_text_from_txt(file_content: bytes) -> str:
+    return file_content.decode('utf-8', errors='ignore')
+
+
+def extract_text(filename: str, file_content: bytes) -> str:
+    return "\n\n".join(iter_text(filename, file_content))
+
+
+def _units(piece: str, max_tokens: int, step: int) -> Iterator[Tuple[str, int, str]]:
+    """
+    Splits text into ``(text, tokens, separator)`` units no longer than
+    ``max_tokens``: paragraphs, then sentences of oversized paragraphs, then
+    runs of words of about ``step`` tokens for oversized sentences.
+    """
+    for paragraph in _PARAGRAPH_RE.split(piece):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        tokens = count_tokens(paragraph)
+        if tokens <= max_tokens:
+            yield paragraph, tokens, "\n\n"
+            continue
+        separator = "\n\n"
+        for sentence in _SENTENCE_RE.split(paragraph):
+            tokens = count_tokens(sentence)
+            if tokens <= max_tokens:
+                yield sentence, tokens, separator
+            else:
+                words, run, run_tokens = sentence.split(), [], 0
+                for word in words:
+                    word_tokens = count_tokens(word)
+                    if run and run_tokens + word_tokens > step:
+                        yield " ".join(run), run_tokens, separator
+                        separator, run, run_tokens = " ", [], 0
+                    run.append(word)
+                    run_tokens += word_tokens
+                if run:
+                    yield " ".join(run), run_tokens, separator
+            separator = " "
+
+
+def stream_chunks(pieces: Iterable[str], max_tokens: int = CHUNK_MAX_TOKENS,
+                  overlap: int = CHUNK_OVERLAP_TOKENS) -> Iterator[str]:
+    """
+    Packs paragraphs (split further when too long) into chunks of at most
+    ``max_tokens`` tokens, starting each chunk with up to ``overlap`` tokens
+    from the end of the previous one. Consumes ``pieces`` lazily, so only the
+    current chunk is held in memory.
+    """
+    max_tokens = max(1, max_tokens)
+    overlap = max(0, min(overlap, max_tokens // 2))
+    step = max(1, overlap or max_tokens // 4)
+    buffer: List[Tuple[str, int, str]] = []
+    size = 0
+    fresh = False  # buffer holds more than the overlap carried from the last chunk
+
+    def joined() -> str:
+        return "".join(text if i == 0 else sep + text for i, (text, _, sep) in enumerate(buffer))
+
+    for piece in pieces:
+        for unit in _units(piece, max_tokens, step):
+            if buffer and size + unit[1] > max_tokens:
+                if fresh:
+                    yield joined()
+                # Keep the trailing units that fit in the overlap
+                kept, kept_size = [], 0
+                for item in reversed(buffer):
+                    if kept_size + item[1] > overlap or kept_size + item[1] + unit[1] > max_tokens:
+                        break
+                    kept.insert(0, item)
+                    kept_size += item[1]
+                buffer, size, fresh = kept, kept_size, False
+            buffer.append(unit)
+            size += unit[1]
+            fresh = True
+    if fresh:
+        yield joined()
+
+
+def dynamic_chunking(content: str, max_tokens: int = CHUNK_MAX_TOKENS,
+                     overlap: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    return list(stream_chunks([content], max_tokens, overlap))
+
+
+def iter_chunks(filename: str, file_content: bytes, max_tokens: int = CHUNK_MAX_TOKENS,
+                overlap: int = CHUNK_OVERLAP_TOKENS) -> Iterator[str]:
+    """Extraction + chunking for one file, one chunk at a time."""
+    return stream_chunks(iter_text(filename, file_content), max_tokens, overlap)
+
+
+def extract_chunks_to_queue(filename: str, file_content: bytes, out, batch_size: int = EXTRACT_BATCH_CHUNKS) -> float:
+    """
+    Extraction + chunking for one file, streamed into ``out`` (a queue shared
+    with the caller) as lists of up to ``batch_size`` chunks and then None. A
+    bounded queue holds the worker back, so memory stays bounded whatever the
+    file size. Returns the seconds spent extracting, not waiting on ``out``.
+    Module-level so it can run in a process pool.
+    """
+    seconds = 0.0
+    batch: List[str] = []
+    start = time.perf_counter()
+    for chunk in iter_chunks(filename, file_content):
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            seconds += time.perf_counter() - start
+            out.put(batch)
+            batch = []
+            start = time.perf_counter()
+    seconds += time.perf_counter() - start
+    if batch:
+        out.put(batch)
+    out.put(None)
+    return seconds
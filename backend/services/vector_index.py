@@ -0,0 +1,228 @@
+import logging
+import os
+from typing import Iterable, Optional, Set, Tuple
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat").lower()
+IVF_NLIST = max(1, int(os.getenv("IVF_NLIST", "1024")))
+# FAISS warns below ~39 training points per centroid; don't train on less than that
+IVF_TRAIN_MIN_POINTS = max(1, int(os.getenv("IVF_TRAIN_MIN_POINTS", str(IVF_NLIST * 39))))
+IVF_NPROBE = max(1, int(os.getenv("IVF_NPROBE", "16")))
+PQ_M = max(1, int(os.getenv("PQ_M", "48")))  # sub-quantizers; must divide the embedding dim
+PQ_NBITS = min(16, max(1, int(os.getenv("PQ_NBITS", "8"))))  # 2**PQ_NBITS codebook entries per sub-quantizer
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+# HNSW cannot remove vectors; deleted ids are skipped at search time until they
+# exceed this fraction of the index, which is then rebuilt from the live vectors
+HNSW_MAX_TOMBSTONE_RATIO = float(os.getenv("HNSW_MAX_TOMBSTONE_RATIO", "0.2"))
+# Filtered searches over at most this many candidates compare against their vectors
+# directly (exact, and unaffected by how few of the graph / list neighbours match)
+FILTER_EXACT_MAX_CANDIDATES = int(os.getenv("FILTER_EXACT_MAX_CANDIDATES", "4096"))
+
+logger = logging.getLogger(__name__)
+
+
+def min_train_points(index_type: str, nlist: int) -> int:
+    """Fewest vectors FAISS can train on: one per centroid, and per PQ codebook entry."""
+    return max(nlist, 2 ** PQ_NBITS) if index_type == "ivf_pq" else nlist
+
+
+def _new_ivf(index_type: str, dim: int, nlist: int):
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf_pq":
+        # PQ needs dim % m == 0; fall back to the largest divisor not above PQ_M
+        m = next(m for m in range(min(PQ_M, dim), 0, -1) if dim % m == 0)
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, m, PQ_NBITS)
+    return faiss.IndexIVFFlat(quantizer, dim, nlist)
+
+
+class VectorIndex:
+    """
+    Wraps the FAISS index behind a configurable type: ``flat`` (exact),
+    ``ivf_flat``, ``ivf_pq`` or ``hnsw``.
+
+    Vectors carry explicit ids (the chunk ids of the chunk store) and can be
+    removed. Flat and HNSW indexes sit inside an ``IndexIDMap2``; IVF indexes
+    store ids natively. HNSW cannot remove vectors, so removed ids become
+    tombstones that searches skip until the index is rebuilt.
+
+    IVF indexes need training data, so vectors first go into an exact flat
+    staging index. Once IVF_TRAIN_MIN_POINTS vectors (at least
+    ``min_train_points``) have arrived the IVF index is trained on them, they
+    are moved over and staging is dropped. If training fails the vectors stay
+    in staging and training is retried once their number has doubled.
+    """
+
+    def __init__(self, dim: int, index_type: str = VECTOR_INDEX_TYPE, nlist: int = IVF_NLIST,
+                 train_min_points: Optional[int] = None):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown VECTOR_INDEX_TYPE '{index_type}'. Expected one of {INDEX_TYPES}.")
+        self.dim = dim
+        self.index_type = index_type
+        self.nlist = nlist
+        self.train_min_points = max(train_min_points if train_min_points is not None else IVF_TRAIN_MIN_POINTS,
+                                    min_train_points(index_type, nlist))
+        self.tombstones: Set[int] = set()
+        # flat, or the staging index of an untrained IVF
+        self.index = faiss.IndexIDMap2(self._new_hnsw() if index_type == "hnsw" else faiss.IndexFlatL2(dim))
+
+    def _new_hnsw(self):
+        hnsw = faiss.IndexHNSWFlat(self.dim, HNSW_M)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        hnsw.hnsw.efSearch = HNSW_EF_SEARCH
+        return hnsw
+
+    @classmethod
+    def wrap(cls, index, index_type: str = VECTOR_INDEX_TYPE,
+             deleted_ids: Iterable[int] = ()) -> "VectorIndex":
+        """
+        Wraps an index read from disk. An IVF configuration over a flat index is
+        treated as still staging and will train once it is big enough.
+        ``deleted_ids`` restores HNSW tombstones.
+        """
+        wrapper = cls(index.d, index_type)
+        wrapper.index = index
+        if wrapper._is_hnsw():
+            wrapper.tombstones = set(int(i) for i in deleted_ids) & set(wrapper.ids().tolist())
+        return wrapper
+
+    @property
+    def ntotal(self) -> int:
+        """Vectors physically in the index, including HNSW tombstones."""
+        return self.index.ntotal
+
+    @property
+    def live_count(self) -> int:
+        return self.index.ntotal - len(self.tombstones)
+
+    @property
+    def is_trained(self) -> bool:
+        return not self._is_staging()
+
+    def _is_staging(self) -> bool:
+        return self.index_type.startswith("ivf") and isinstance(self.index, faiss.IndexIDMap2)
+
+    def ids(self) -> np.ndarray:
+        """Ids of the vectors in an ID-mapped (flat, HNSW or staging) index."""
+        return faiss.vector_to_array(self.index.id_map)
+
+    def add(self, vectors: np.ndarray, ids: Optional[np.ndarray] = None):
+        if ids is None:
+            ids = np.arange(self.ntotal, self.ntotal + len(vectors), dtype="int64")
+        self.index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+        if self._is_staging() and self.index.ntotal >= self.train_min_points:
+            self._train_ivf()
+
+    def _is_hnsw(self) -> bool:
+        return isinstance(self.index, faiss.IndexIDMap2) and isinstance(
+            faiss.downcast_index(self.index.index), faiss.IndexHNSW)
+
+    def remove(self, ids: Iterable[int]) -> int:
+        """Removes vectors by id (tombstones them for HNSW). Returns how many were removed."""
+        ids = np.fromiter((int(i) for i in ids), dtype="int64")
+        if not len(ids):
+            return 0
+        if not self._is_hnsw():
+            return int(self.index.remove_ids(ids))
+        removed = (set(ids.tolist()) & set(self.ids().tolist())) - self.tombstones
+        self.tombstones |= removed
+        if len(self.tombstones) > HNSW_MAX_TOMBSTONE_RATIO * self.ntotal:
+            self._rebuild_hnsw()
+        return len(removed)
+
+    def _rebuild_hnsw(self):
+        ids = self.ids()
+        keep = np.array([i not in self.tombstones for i in ids.tolist()], dtype=bool)
+        inner = self.index.index
+        vectors = inner.reconstruct_n(0, inner.ntotal)[keep] if inner.ntotal else np.empty((0, self.dim), "float32")
+        rebuilt = faiss.IndexIDMap2(self._new_hnsw())
+        if len(vectors):
+            rebuilt.add_with_ids(vectors, ids[keep])
+        logger.info("Rebuilt hnsw index without %d deleted vectors", len(self.tombstones))
+        self.index = rebuilt
+        self.tombstones = set()
+
+    def _train_ivf(self):
+        ids = self.ids()
+        staged = self.index.index.reconstruct_n(0, self.index.ntotal)
+        ivf = _new_ivf(self.index_type, self.dim, self.nlist)
+        try:
+            ivf.train(staged)
+            ivf.add_with_ids(staged, ids)
+        except RuntimeError:
+            # Searches keep using the exact staging index; ingestion is not interrupted
+            self.train_min_points = 2 * len(staged)
+            logger.exception("Training %s index (nlist=%d) on %d vectors failed; will retry at %d",
+                             self.index_type, self.nlist, len(staged), self.train_min_points)
+            return
+        ivf.nprobe = IVF_NPROBE
+        self.index = ivf
+        logger.info("Trained %s index (nlist=%d) on %d vectors", self.index_type, self.nlist, len(staged))
+
+    def _search_params(self, nprobe: Optional[int], ef_search: Optional[int], sel=None):
+        if self._is_staging():
+            return faiss.SearchParameters(sel=sel) if sel is not None else None
+        if self.index_type.startswith("ivf") and (nprobe is not None or sel is not None):
+            params = {"nprobe": int(nprobe if nprobe is not None else self.index.nprobe)}
+            if sel is not None:
+                params["sel"] = sel
+            return faiss.SearchParametersIVF(**params)
+        if self.index_type == "hnsw" and (ef_search is not None or self.tombstones or sel is not None):
+            params = {"efSearch": int(ef_search if ef_search is not None else HNSW_EF_SEARCH)}
+            if sel is not None:
+                params["sel"] = sel  # candidate ids never include tombstones (see search)
+            elif self.tombstones:
+                params["sel"] = faiss.IDSelectorNot(
+                    faiss.IDSelectorBatch(np.fromiter(self.tombstones, dtype="int64")))
+            return faiss.SearchParametersHNSW(**params)
+        if sel is not None:
+            return faiss.SearchParameters(sel=sel)
+        return None
+
+    def search(self, queries: np.ndarray, k: int, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None, ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Searches the index and returns ``(distances, ids)``. ``nprobe`` (IVF) and
+        ``ef_search`` (HNSW) override the configured defaults for this call only;
+        they are ignored by other types. ``ids`` restricts the search to those
+        candidates: few enough are compared exactly, otherwise FAISS skips the
+        rest through an ID selector while it searches.
+        """
+        if ids is not None:
+            ids = np.asarray(ids, dtype="int64")
+            if self.tombstones:
+                ids = ids[~np.isin(ids, np.fromiter(self.tombstones, dtype="int64"))]
+            if not len(ids) or (len(ids) <= FILTER_EXACT_MAX_CANDIDATES and isinstance(self.index, faiss.IndexIDMap2)):
+                return self._search_exact(queries, k, ids)
+            params = self._search_params(nprobe, ef_search, sel=faiss.IDSelectorBatch(ids))
+            return self.index.search(queries, k, params=params)
+        params = self._search_params(nprobe, ef_search)
+        if params is None:
+            return self.index.search(queries, k)
+        return self.index.search(queries, k, params=params)
+
+    def _search_exact(self, queries: np.ndarray, k: int, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        distances = np.full((len(queries), k), np.inf, dtype="float32")
+        labels = np.full((len(queries), k), -1, dtype="int64")
+        present, vectors = [], []
+        for i in ids.tolist():
+            try:
+                vectors.append(self.index.reconstruct(i))
+            except RuntimeError:  # not in the index (already removed); skip it like the ID selector does
+                continue
+            present.append(i)
+        if not present:
+            return distances, labels
+        ids, vectors = np.array(present, dtype="int64"), np.vstack(vectors)
+        # Squared L2, like the FAISS indexes
+        scores = ((queries[:, None, :] - vectors[None, :, :]) ** 2).sum(axis=2)
+        n = min(k, len(ids))
+        top = np.argsort(scores, axis=1)[:, :n]
+        distances[:, :n] = np.take_along_axis(scores, top, axis=1)
+        labels[:, :n] = ids[top]
+        return distances, labels
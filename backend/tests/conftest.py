@@ -0,0 +1,40 @@
+import hashlib
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Module-level settings are read at import time: keep the services in memory and off the network
+os.environ["DOCUMENT_STORE_DIR"] = ""
+os.environ["SCHEMA_CACHE_DIR"] = tempfile.mkdtemp(prefix="nlq-test-schema-")
+os.environ["QUERY_CACHE_BACKEND"] = "memory"
+os.environ["PAGINATION_SECRET"] = "test-secret"
+
+
+class HashingModel:
+    """Stands in for the sentence-transformers model: words hashed into 384 dims."""
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return 384
+
+    def encode(self, texts, convert_to_tensor=False, batch_size=32, **kwargs):
+        single = isinstance(texts, str)
+        vectors = np.zeros((1 if single else len(texts), 384), dtype="float32")
+        for row, text in enumerate([texts] if single else texts):
+            for word in text.lower().split():
+                vectors[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % 384] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+        return vectors[0] if single else vectors
+
+
+@pytest.fixture
+def hash_embedder(monkeypatch):
+    from services.embeddings import embedder
+    monkeypatch.setattr(embedder, "_model", HashingModel())
+    return embedder
@@ -0,0 +1,106 @@
+import re
+
+import pytest
+
+from services import document_filters
+from services.document_filters import extract_entities, normalize_filters, scope_from_result
+from services.document_processor import DocumentProcessor
+from services.query_engine import QueryEngine
+
+
+@pytest.fixture
+def processor(hash_embedder, monkeypatch):
+    monkeypatch.setattr(document_filters, "ENTITY_PATTERNS", {"emp_id": re.compile(r"\bEMP-?(\d+)\b")})
+    processor = DocumentProcessor(None)
+    processor.upsert_document("alice.txt", b"EMP-1 resume: python developer")
+    processor.upsert_document("bob.pdf", b"bob", chunks=["EMP-2 resume: java developer"])
+    processor.upsert_document("policy.txt", b"remote work policy for everyone", entities={"team": ["hr"]})
+    return processor
+
+
+def filenames(processor, filters):
+    return sorted({processor.chunk_store.filename(int(i)) for i in processor.select(normalize_filters(filters))})
+
+
+def test_filters_are_normalized_to_one_canonical_form():
+    assert normalize_filters({"doc_type": [".PDF", "pdf"], "filename": "a.pdf", "entities": {"EMP_ID": [7.0, "7"]}}) == \
+        {"filename": ["a.pdf"], "doc_type": ["pdf"], "entities": {"emp_id": ["7"]}}
+    assert normalize_filters({"uploaded_after": "2024-01-01T00:00:00Z"}) == \
+        normalize_filters({"uploaded_after": 1704067200})
+    assert normalize_filters({}) is None and normalize_filters({"filename": None}) is None
+
+
+@pytest.mark.parametrize("filters", [
+    ["a.pdf"],
+    {"author": "bob"},
+    {"uploaded_after": "last tuesday"},
+    {"uploaded_before": True},
+    {"entities": ["emp_id"]},
+])
+def test_malformed_filters_are_rejected(filters):
+    with pytest.raises(ValueError):
+        normalize_filters(filters)
+
+
+def test_entities_are_extracted_with_the_configured_patterns(monkeypatch):
+    monkeypatch.setattr(document_filters, "ENTITY_PATTERNS", {
+        "emp_id": re.compile(r"\bEMP-?(\d+)\b"), "ticket": re.compile(r"\bT\d+\b"),
+    })
+    assert extract_entities("EMP-7 and EMP7 raised T12") == ["emp_id=7", "ticket=T12"]
+
+
+def test_scope_comes_from_the_first_entity_column():
+    result = {"columns": ["full_name", "Emp_ID"], "rows": [["Alice", 1], ["Bob", 2.0], ["Carol", None]]}
+    assert scope_from_result(result, {"emp_id"}) == {"emp_id": ["1", "2"]}
+    assert scope_from_result(result, {"dept_id"}) is None
+    assert scope_from_result({"columns": ["emp_id"], "rows": []}, {"emp_id"}) is None
+
+
+def test_too_many_entities_do_not_scope(monkeypatch):
+    monkeypatch.setattr(document_filters, "HYBRID_SCOPE_MAX_ENTITIES", 2)
+    result = {"columns": ["emp_id"], "rows": [[1], [2], [3]]}
+    assert scope_from_result(result, {"emp_id"}) is None
+
+
+def test_select_combines_fields_and_entity_sources(processor):
+    assert filenames(processor, {"doc_type": "txt"}) == ["alice.txt", "policy.txt"]
+    assert filenames(processor, {"entities": {"emp_id": [1, 2]}}) == ["alice.txt", "bob.pdf"]
+    assert filenames(processor, {"entities": {"emp_id": 2}, "doc_type": "txt"}) == []
+    assert filenames(processor, {"entities": {"team": "hr"}}) == ["policy.txt"]
+    assert filenames(processor, {"uploaded_before": 0}) == []
+    processor.delete_document("alice.txt")
+    assert filenames(processor, {"entities": {"emp_id": [1, 2]}}) == ["bob.pdf"]
+
+
+def test_search_only_returns_matching_chunks(processor, hash_embedder):
+    query = hash_embedder.encode(["python developer resume"])
+    assert processor.search(query, 3)[0]["filename"] == "alice.txt"
+    hits = processor.search(query, 3, filters=normalize_filters({"doc_type": "pdf"}))
+    assert [hit["filename"] for hit in hits] == ["bob.pdf"]
+    assert processor.search(query, 3, filters=normalize_filters({"filename": "missing.txt"})) == []
+
+
+def scoped(processor, hits, sql_rows, top_k=1):
+    engine = QueryEngine(doc_processor=processor)
+    results = {
+        "sql": (None, {"columns": ["emp_id"], "rows": sql_rows}, {}),
+        "documents": {"results": [{"embedding_id": i} for i in hits]},
+    }
+    timings = {"sql": {"status": "ok"}, "documents": {"status": "ok"}}
+    searched = []
+
+    def search_scoped(filters):
+        searched.append(filters)
+        return {"results": [{"embedding_id": int(i)} for i in processor.select(filters)][:top_k]}
+
+    engine._scope_documents(results, timings, {"emp_id"}, None, top_k, search_scoped)
+    return [hit["embedding_id"] for hit in results["documents"]["results"]], searched
+
+
+def test_hybrid_hits_are_narrowed_to_the_sql_entities(processor):
+    alice, bob = (processor.chunk_store.file_chunk_ids(name)[0] for name in ("alice.txt", "bob.pdf"))
+    assert scoped(processor, [alice, bob], [[2]]) == ([bob], [])
+    # No over-fetched hit is in scope: a second, scoped search fills the page
+    assert scoped(processor, [alice], [[2]]) == ([bob], [{"entities": {"emp_id": ["2"]}}])
+    # A result without a usable entity column leaves the hits unscoped
+    assert scoped(processor, [alice, bob], []) == ([alice], [])
@@ -0,0 +1,56 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from services.document_processor import EmbeddingBatcher
+
+
+class RecordingEncoder:
+    """Encodes a text as [len(text), index in its batch] and records every batch."""
+
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.fail_on = fail_on
+        self.lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self.lock:
+            self.batches.append(list(texts))
+        if self.fail_on in texts:
+            raise ValueError("model failed")
+        return np.array([[len(text), i] for i, text in enumerate(texts)], dtype="float32")
+
+
+def encode_concurrently(batcher, texts):
+    with ThreadPoolExecutor(len(texts)) as pool:
+        return list(pool.map(batcher.encode, texts))
+
+
+def test_concurrent_calls_share_a_forward_pass_and_get_their_own_vector():
+    encoder = RecordingEncoder()
+    batcher = EmbeddingBatcher(encoder, window_ms=200, max_batch_size=64)
+    texts = ["a" * n for n in range(1, 9)]
+    vectors = encode_concurrently(batcher, texts)
+    assert [int(v[0]) for v in vectors] == list(range(1, 9))
+    assert len(encoder.batches) < len(texts)
+    stats = batcher.metrics()
+    assert stats["requests"] == 8 and stats["batches"] == len(encoder.batches)
+    assert sum(stats["batch_size_histogram"].values()) == stats["batches"]
+
+
+def test_batches_are_capped_at_max_batch_size():
+    encoder = RecordingEncoder()
+    batcher = EmbeddingBatcher(encoder, window_ms=200, max_batch_size=3)
+    encode_concurrently(batcher, [f"text {i}" for i in range(7)])
+    assert max(len(batch) for batch in encoder.batches) <= 3
+    assert batcher.metrics()["batch_size_max"] <= 3
+
+
+def test_a_failed_batch_fails_only_its_callers():
+    encoder = RecordingEncoder(fail_on="bad")
+    batcher = EmbeddingBatcher(encoder, window_ms=0)
+    with pytest.raises(ValueError, match="model failed"):
+        batcher.encode("bad")
+    assert batcher.encode("good")[0] == 4
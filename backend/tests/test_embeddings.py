@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from services import embeddings
+from services.embeddings import Embedder, load_model
+
+
+class StubModel:
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.encoded = []
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=32, convert_to_tensor=False):
+        self.encoded.append(texts)
+        return np.ones((len(texts), self.dim))
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Replaces the model loader; records the (model, backend) of every load."""
+    calls = []
+
+    def load(model_name, backend):
+        calls.append((model_name, backend))
+        return StubModel()
+
+    monkeypatch.setattr(embeddings, "load_model", load)
+    return calls
+
+
+def test_model_is_loaded_on_first_use_only(loads):
+    embedder = Embedder("mini", "torch")
+    assert not embedder.loaded and loads == []
+    vectors = embedder.encode(["a", "b"])
+    embedder.encode(["c"])
+    assert vectors.dtype == np.float32 and vectors.shape == (2, 384)
+    assert loads == [("mini", "torch")] and embedder.loaded
+
+
+def test_warm_up_loads_the_model_and_reports_timings(loads):
+    status = Embedder("mini", "int8").warm_up()
+    assert status["loaded"] and status["backend"] == "int8" and status["dimension"] == 384
+    assert status["load_seconds"] is not None and status["warm_up_seconds"] >= 0
+
+
+def test_dimension_mismatch_asks_for_embedding_dim(loads):
+    embedder = Embedder("mini", "torch", dim=768)
+    with pytest.raises(RuntimeError, match="set EMBEDDING_DIM=384"):
+        embedder.model
+    assert not embedder.loaded
+
+
+def test_load_failure_is_reported_with_the_model_name(monkeypatch):
+    def load(model_name, backend):
+        raise OSError("no such model")
+
+    monkeypatch.setattr(embeddings, "load_model", load)
+    with pytest.raises(RuntimeError, match="Could not load embedding model missing \\(torch\\): no such model"):
+        Embedder("missing", "torch").model
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError, match="Unknown EMBEDDING_BACKEND 'tensorrt'"):
+        load_model("mini", "tensorrt")
+
+
+def test_onnx_backend_without_its_dependencies_is_rejected(monkeypatch):
+    pytest.importorskip("sentence_transformers")
+    monkeypatch.setattr(embeddings.importlib.util, "find_spec", lambda name: None)
+    with pytest.raises(RuntimeError, match="optimum and onnxruntime"):
+        load_model("mini", "onnx")
+
+
+def test_int8_backend_quantizes_the_linear_layers(monkeypatch):
+    torch = pytest.importorskip("torch")
+    sentence_transformers = pytest.importorskip("sentence_transformers")
+
+    class TinyModel(torch.nn.Module):
+        def __init__(self, model_name, device=None):
+            super().__init__()
+            self.device_name = device
+            self.dense = torch.nn.Linear(8, 4)
+
+    monkeypatch.setattr(sentence_transformers, "SentenceTransformer", TinyModel)
+    model = load_model("mini", "int8")
+    assert model.device_name == "cpu"
+    assert isinstance(model.dense, torch.ao.nn.quantized.dynamic.Linear)
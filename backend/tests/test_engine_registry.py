@@ -0,0 +1,115 @@
+import sqlite3
+import threading
+
+import pytest
+
+from services.document_processor import DocumentProcessor
+from services.engine_registry import EngineRegistry
+from services.query_engine import QueryEngine, query_cache
+
+
+@pytest.fixture
+def database(tmp_path):
+    def make(name):
+        path = tmp_path / f"{name}.db"
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE employees (emp_id INTEGER PRIMARY KEY, full_name TEXT)")
+        return f"sqlite:///{path}"
+    return make
+
+
+@pytest.fixture
+def registry():
+    registry = EngineRegistry(DocumentProcessor(None), max_engines=2, idle_seconds=0)
+    yield registry
+    registry.close_all()
+
+
+def test_least_recently_used_idle_engine_is_evicted(registry, database):
+    _, first = registry.connect(database("a"), "a")
+    registry.connect(database("b"), "b")
+    registry.connect(database("c"), "c")
+    assert list(registry.engines()) == ["b", "c"]
+    assert first.engine is None and registry.evictions == 1
+
+
+def test_held_engine_survives_eviction_until_released(registry, database):
+    registry.connect(database("a"), "a")
+    held = registry.acquire("a")
+    registry.connect(database("b"), "b")
+    registry.connect(database("c"), "c")
+    assert list(registry.engines()) == ["a", "c"] and held.engine is not None
+    assert [row["active_requests"] for row in registry.list() if row["connection_id"] == "a"] == [1]
+
+    registry.release(held)
+    registry.connect(database("d"), "d")
+    assert list(registry.engines()) == ["c", "d"] and held.engine is None
+
+
+def test_removing_a_held_engine_closes_it_on_the_last_release(registry, database):
+    registry.connect(database("a"), "a")
+    first, second = registry.acquire("a"), registry.acquire("a")
+    assert registry.remove("a") is True
+    assert registry.acquire("a") is None and first.engine is not None
+    registry.release(first)
+    assert second.engine is not None
+    registry.release(second)
+    assert second.engine is None
+
+
+def test_idle_engines_are_closed(database):
+    registry = EngineRegistry(DocumentProcessor(None), idle_seconds=60)
+    _, engine = registry.connect(database("a"), "a")
+    registry._entries["a"].last_used -= 120
+    assert registry.acquire("b") is None
+    assert registry.engines() == {} and engine.engine is None
+
+
+def test_invalidation_is_scoped_to_one_connection(registry, database):
+    _, hr = registry.connect(database("a"), "hr")
+    _, sales = registry.connect(database("b"), "sales")
+    query_cache.clear()
+    for engine in (hr, sales):
+        query_cache.set(engine.cache_namespace, {"sql": "SELECT 1"}, tables=engine.table_tags(["employees"]))
+    assert registry.invalidate_tables(["employees"], "hr") == 1
+    assert query_cache.get("hr") is None and query_cache.get("sales") is not None
+    assert registry.invalidate_tables(["employees"]) == 1
+
+
+def test_failed_connect_is_dropped_without_evicting_healthy_engines(registry, database):
+    _, first = registry.connect(database("a"), "a")
+    registry.connect(database("b"), "b")
+    with pytest.raises(RuntimeError):
+        registry.connect("nosuchdialect://nowhere", "c")
+    assert registry.acquire("b") is not None
+    assert list(registry.engines()) == ["a", "b"] and first.engine is not None and registry.evictions == 0
+
+
+def test_failed_reconnect_keeps_the_connected_database(registry, database):
+    _, engine = registry.connect(database("a"), "a")
+    with pytest.raises(RuntimeError):
+        registry.connect("nosuchdialect://nowhere", "a")
+    assert registry.acquire("a") is engine and engine.engine is not None
+
+
+def test_engine_still_connecting_is_not_evicted(database, monkeypatch):
+    registry = EngineRegistry(DocumentProcessor(None), max_engines=1, idle_seconds=0)
+    entered, proceed = threading.Event(), threading.Event()
+    connect_db = QueryEngine.connect_db
+
+    def slow_connect(engine, connection_string):
+        if engine.cache_namespace == "slow":
+            entered.set()
+            proceed.wait(10)
+        connect_db(engine, connection_string)
+
+    monkeypatch.setattr(QueryEngine, "connect_db", slow_connect)
+    worker = threading.Thread(target=registry.connect, args=(database("slow"), "slow"))
+    worker.start()
+    entered.wait(10)
+    registry.connect(database("a"), "a")
+    assert list(registry.engines()) == ["slow", "a"]
+    proceed.set()
+    worker.join(10)
+    assert list(registry.engines()) == ["slow"] and registry.evictions == 1
+    registry.close_all()
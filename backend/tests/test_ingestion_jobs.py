@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+from services import ingestion_jobs
+from services.document_processor import DocumentProcessor
+from services.ingestion_jobs import IngestionJobManager
+
+
+@pytest.fixture(params=[0, 1], ids=["job-thread", "process-pool"])
+def manager(request, hash_embedder):
+    manager = IngestionJobManager(DocumentProcessor(None), process_workers=request.param)
+    yield manager
+    manager.shutdown()
+
+
+def run(manager, files, timeout=60):
+    job_id = manager.submit(files)["job_id"]
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+def test_unreadable_file_fails_without_stopping_the_job(manager):
+    job = run(manager, [
+        {"filename": "broken.pdf", "content": b"%PDF-1.4 this is not really a pdf"},
+        {"filename": "notes.txt", "content": b"quarterly review notes"},
+        {"filename": "blank.txt", "content": b"   "},
+        {"filename": "image.png", "content": b"\x89PNG"},
+    ])
+    statuses = {f["filename"]: (f["status"], f["error"]) for f in job["files"]}
+    assert job["status"] == "completed_with_errors"
+    assert statuses["broken.pdf"][0] == "failed" and "Could not read PDF" in statuses["broken.pdf"][1]
+    assert statuses["notes.txt"] == ("indexed", None)
+    assert statuses["blank.txt"] == ("skipped", "No text could be extracted.")
+    assert statuses["image.png"] == ("skipped", "Unsupported file type.")
+    assert job["files_done"] == 4 and job["chunks_indexed"] == 1
+    assert manager.doc_processor.chunk_store.live_filenames() == {"notes.txt": 1}
+
+
+def test_identical_upload_is_not_extracted_again(manager):
+    files = [{"filename": "notes.txt", "content": b"quarterly review notes"}]
+    assert run(manager, files)["files"][0]["status"] == "indexed"
+    assert run(manager, files)["files"][0]["status"] == "unchanged"
+
+
+def test_active_jobs_are_counted_until_they_finish(manager):
+    manager._job_pool.submit(time.sleep, 0.3)  # keeps the next job queued for a moment
+    job_id = manager.submit([{"filename": "notes.txt", "content": b"quarterly review notes"}])["job_id"]
+    assert manager.active_jobs == 1
+    while manager.get(job_id)["status"] in ("queued", "running"):
+        time.sleep(0.05)
+    assert manager.active_jobs == 0
+
+
+def test_job_that_cannot_be_saved_is_reported_failed(manager, monkeypatch):
+    def persist():
+        raise OSError("disk full")
+
+    monkeypatch.setattr(manager.doc_processor, "persist", persist)
+    job = run(manager, [{"filename": "notes.txt", "content": b"quarterly review notes"}])
+    assert job["status"] == "failed" and job["errors"] == ["disk full"]
+    assert job["finished_at"] >= job["started_at"] and manager.active_jobs == 0
+
+
+def test_only_the_latest_jobs_are_kept(manager, monkeypatch):
+    monkeypatch.setattr(ingestion_jobs, "INGESTION_JOB_HISTORY", 2)
+    jobs = [run(manager, [{"filename": f"{i}.txt", "content": f"notes {i}".encode()}]) for i in range(3)]
+    assert manager.get(jobs[0]["job_id"]) is None
+    assert [job["job_id"] for job in manager.list_jobs()] == [jobs[2]["job_id"], jobs[1]["job_id"]]
@@ -0,0 +1,42 @@
+import pytest
+
+from services import pagination
+from services.pagination import InvalidCursor, build_page_query, decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    state = {"sql": "SELECT id FROM employees", "offset": 50, "last_key": [42, "x"], "conn": "default"}
+    assert decode_cursor(encode_cursor(state)) == state
+
+
+def test_cursor_with_altered_payload_is_rejected():
+    _, signature = encode_cursor({"sql": "SELECT id FROM employees", "offset": 0}).split(".")
+    forged = pagination._b64(b'{"sql":"SELECT * FROM salaries","offset":0}')
+    with pytest.raises(InvalidCursor, match="signature"):
+        decode_cursor(f"{forged}.{signature}")
+
+
+def test_cursor_signed_with_another_secret_is_rejected(monkeypatch):
+    token = encode_cursor({"sql": "SELECT 1", "offset": 0})
+    monkeypatch.setattr(pagination, "PAGINATION_SECRET", "another-worker")
+    with pytest.raises(InvalidCursor):
+        decode_cursor(token)
+
+
+@pytest.mark.parametrize("token", ["", "no-separator", "!!!.???"])
+def test_malformed_cursor_is_rejected(token):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(token)
+
+
+def test_keyset_page_query():
+    sql, params = build_page_query("SELECT id, name FROM t;", lambda c: f'"{c}"', ["id"], [10], 0, 5)
+    assert sql == ('SELECT * FROM (SELECT id, name FROM t) AS _page WHERE ("id") > (:_page_k0) '
+                   'ORDER BY "id" LIMIT :_page_limit')
+    assert params == {"_page_limit": 5, "_page_k0": 10}
+
+
+def test_offset_page_query():
+    sql, params = build_page_query("SELECT id FROM t", str, [], None, 20, 10)
+    assert sql == "SELECT * FROM (SELECT id FROM t) AS _page LIMIT :_page_limit OFFSET :_page_offset"
+    assert params == {"_page_limit": 10, "_page_offset": 20}
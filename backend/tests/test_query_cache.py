@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from services.query_cache import (
+    DOCUMENTS_TAG, InProcessQueryCache, QueryCacheBackend, RedisQueryCache, SQLiteQueryCache, referenced_tables,
+)
+from services.query_engine import QueryEngine
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return InProcessQueryCache()
+    if request.param == "sqlite":
+        return SQLiteQueryCache(path=str(tmp_path / "cache.sqlite3"))
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisQueryCache(client=fakeredis.FakeRedis())
+
+
+def answer(n):
+    return {"sql": f"SELECT {n}", "sql_result": {"columns": ["n"], "rows": [[n]]}}
+
+
+def test_invalidating_a_table_drops_only_the_answers_that_read_it(cache):
+    cache.set("salaries", answer(1), fingerprint="fp", tables=["Employees", "Salaries"])
+    cache.set("departments", answer(2), fingerprint="fp", tables=["departments"])
+    cache.set("resumes", answer(3), fingerprint="fp", tables=["employees", DOCUMENTS_TAG])
+
+    assert cache.invalidate_tables(["SALARIES"]) == 1
+    assert cache.get("salaries") is None
+    assert cache.get("departments") == answer(2)
+    assert cache.invalidate_tables([DOCUMENTS_TAG]) == 1
+    assert cache.get("resumes") is None
+    assert cache.get("departments") == answer(2)
+
+
+def test_invalidating_a_fingerprint_drops_its_answers(cache):
+    cache.set("old", answer(1), fingerprint="v1", tables=["employees"])
+    cache.set("new", answer(2), fingerprint="v2", tables=["employees"])
+    assert cache.invalidate_fingerprint("v1") == 1
+    assert cache.get("old") is None and cache.get("new") == answer(2)
+
+
+def test_entries_expire_and_oversized_answers_are_not_cached(cache):
+    cache.ttl_seconds = 0.05
+    cache.set("short-lived", answer(1), tables=["employees"])
+    cache.max_entry_bytes = 10
+    cache.set("oversized", answer(2), tables=["employees"])
+    assert cache.get("oversized") is None and cache.stats()["oversized_skipped"] == 1
+    time.sleep(0.1)
+    assert cache.get("short-lived") is None
+
+
+def test_referenced_tables_ignores_string_literals():
+    sql = "SELECT e.name FROM Employees e JOIN departments d ON d.id = e.dept_id WHERE e.note = 'salaries'"
+    assert referenced_tables(sql, ["employees", "departments", "salaries"]) == ["departments", "employees"]
+
+
+def test_table_tags_are_namespaced_per_connection_except_documents():
+    assert QueryEngine(cache_namespace="hr").table_tags(["employees", DOCUMENTS_TAG]) == \
+        ["hr:employees", DOCUMENTS_TAG]
+    assert QueryEngine().table_tags(["employees"]) == ["employees"]
+
+
+def test_incomplete_backend_cannot_be_created():
+    class GetOnly(QueryCacheBackend):
+        def _get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
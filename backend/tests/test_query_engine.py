@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from services.document_processor import DocumentProcessor
+from services.query_engine import QueryEngine, _answer_key, query_cache
+
+
+@pytest.fixture
+def engine():
+    query_cache.clear()
+    yield QueryEngine(doc_processor=DocumentProcessor(None))
+    query_cache.clear()
+
+
+def key(query="Top earners", schema_hash="abc", namespace="", top_k=5, nprobe=None, ef_search=None, filters=None):
+    return _answer_key(query, schema_hash, namespace, top_k, nprobe, ef_search, filters)
+
+
+def test_answer_key_ignores_case_and_surrounding_whitespace():
+    assert key("  Top Earners ") == key("top earners")
+
+
+@pytest.mark.parametrize("changed", [
+    {"schema_hash": "def"},
+    {"namespace": "hr"},
+    {"top_k": 10},
+    {"nprobe": 32},
+    {"ef_search": 128},
+    {"filters": {"doc_type": ["pdf"]}},
+])
+def test_answer_key_changes_with_everything_that_shapes_the_answer(changed):
+    assert key(**changed) != key()
+
+
+def test_answer_key_of_equal_filters_is_equal():
+    assert key(filters={"doc_type": ["pdf"], "filename": ["a.pdf"]}) == \
+        key(filters={"filename": ["a.pdf"], "doc_type": ["pdf"]})
+
+
+def test_search_knobs_are_not_served_from_each_others_cache(engine):
+    question = "summarise the policy document"
+    assert engine.process_query(question, top_k_docs=5)["_cache_hit"] is False
+    assert engine.process_query(question, top_k_docs=5)["_cache_hit"] is True
+    assert engine.process_query(question, top_k_docs=3)["_cache_hit"] is False
+    assert engine.process_query(question, top_k_docs=5, nprobe=64)["_cache_hit"] is False
+    assert engine.process_query(question, top_k_docs=5, ef_search=256)["_cache_hit"] is False
+
+
+def sleeper(seconds, value=None):
+    def fn():
+        time.sleep(seconds)
+        return value
+    return fn
+
+
+def test_branches_run_concurrently():
+    start = time.time()
+    results, timings = QueryEngine._run_branches({"sql": (sleeper(0.3, "rows"), 5), "documents": (sleeper(0.3, "docs"), 5)})
+    assert time.time() - start < 0.55
+    assert results == {"sql": "rows", "documents": "docs"}
+    assert all(t["status"] == "ok" and t["elapsed_seconds"] >= 0.3 for t in timings.values())
+
+
+def test_slow_branch_times_out_without_dropping_the_other():
+    start = time.time()
+    results, timings = QueryEngine._run_branches({"sql": (sleeper(2), 0.2), "documents": (sleeper(0, "docs"), 5)})
+    assert time.time() - start < 1
+    assert results["sql"] == {"error": "The sql branch timed out after 0.2s."} and results["documents"] == "docs"
+    assert timings["sql"]["status"] == "timeout" and timings["documents"]["status"] == "ok"
+
+
+def test_lone_branch_still_times_out():
+    results, timings = QueryEngine._run_branches({"sql": (sleeper(2), 0.1)})
+    assert timings["sql"]["status"] == "timeout" and "timed out" in results["sql"]["error"]
+
+
+def test_failing_branch_is_reported():
+    def fail():
+        raise ValueError("no such table: staff")
+
+    results, timings = QueryEngine._run_branches({"sql": (fail, 5), "documents": (sleeper(0, "docs"), 5)})
+    assert results["sql"] == {"error": "The sql branch failed: no such table: staff"}
+    assert timings["sql"]["status"] == "error" and results["documents"] == "docs"
@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from services.query_plan import _SQLITE_LOOP, QueryCostGuard, limit_table_scans
+from services.sql_executor import SQLExecutor, create_pooled_engine
+
+CROSS_JOIN = "SELECT a.name FROM employees a JOIN employees b ON a.dept_id <> b.dept_id"
+
+
+@pytest.fixture
+def executor(tmp_path):
+    path = tmp_path / "plan.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE employees (emp_id INTEGER PRIMARY KEY, name TEXT, dept_id INTEGER)")
+        conn.execute("CREATE TABLE departments (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.executemany("INSERT INTO employees VALUES (?, ?, ?)", [(i, f"e{i}", i % 5) for i in range(1, 2001)])
+        conn.executemany("INSERT INTO departments VALUES (?, ?)", [(i, f"d{i}") for i in range(5)])
+    executor = SQLExecutor(create_pooled_engine(f"sqlite:///{path}"))
+    yield executor
+    executor.shutdown()
+
+
+def guard(executor, mode, **kwargs):
+    return QueryCostGuard(executor, mode=mode, max_rows=100_000, rewrite_row_limit=100, **kwargs)
+
+
+@pytest.mark.parametrize("detail, table", [
+    ("SCAN employees", "employees"),
+    ("SCAN TABLE employees", "employees"),
+    ("SEARCH TABLE departments USING INTEGER PRIMARY KEY (rowid=?)", "departments"),
+])
+def test_sqlite_loops_are_read_from_old_and_new_plan_formats(detail, table):
+    assert _SQLITE_LOOP.match(detail).group(2) == table
+
+
+def test_cheap_statements_pass_through(executor):
+    sql = "SELECT e.name FROM employees e JOIN departments d ON d.id = e.dept_id WHERE e.emp_id = 7"
+    verdict = guard(executor, "reject").check(sql)
+    assert verdict["action"] == "allow" and verdict["sql"] == sql
+    assert guard(executor, "reject").check("SELECT name FROM employees LIMIT 10")["action"] == "allow"
+
+
+def test_over_budget_statement_is_rejected_and_the_verdict_cached(executor):
+    cost_guard = guard(executor, "reject")
+    verdict = cost_guard.check(CROSS_JOIN)
+    assert verdict["action"] == "reject" and "SQL_MAX_PLAN_ROWS" in verdict["reason"]
+    assert verdict["estimate"]["full_scans"] == {"employees": 2000.0}
+    assert cost_guard.check(CROSS_JOIN + ";")["cached"] is True
+    assert cost_guard.stats()["hits"] == 1
+
+
+def test_rewrite_caps_the_full_scans_and_still_runs(executor):
+    verdict = guard(executor, "rewrite").check(CROSS_JOIN)
+    assert verdict["action"] == "rewrite" and verdict["estimate"]["rows"] <= 100_000
+    assert verdict["sql"].count("(SELECT * FROM employees LIMIT 100) AS") == 2
+    assert "error" not in executor.execute(verdict["sql"])
+
+
+def test_rewrite_that_cannot_get_under_budget_is_rejected(executor):
+    cost_guard = QueryCostGuard(executor, mode="rewrite", max_rows=10, rewrite_row_limit=100)
+    verdict = cost_guard.check(CROSS_JOIN)
+    assert verdict["action"] == "reject" and verdict["sql"] == CROSS_JOIN
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT e.name FROM employees e JOIN departments d ON d.id = e.dept_id",
+     "SELECT e.name FROM (SELECT * FROM employees LIMIT 10) AS e JOIN departments d ON d.id = e.dept_id"),
+    ("SELECT name FROM departments WHERE id IN (SELECT dept_id FROM employees)",
+     "SELECT name FROM departments WHERE id IN (SELECT dept_id FROM (SELECT * FROM employees LIMIT 10) AS employees)"),
+    ("SELECT name FROM employees UNION SELECT name FROM hr.contractors",
+     "SELECT name FROM (SELECT * FROM employees LIMIT 10) AS employees "
+     "UNION SELECT name FROM (SELECT * FROM hr.contractors LIMIT 10) AS contractors"),
+    ("SELECT name FROM departments", "SELECT name FROM departments"),
+])
+def test_limit_table_scans_rewrites_every_reference(sql, expected):
+    assert limit_table_scans(sql, {"Employees": 10, "contractors": 10}) == expected
+
+
+def test_unknown_cost_guard_mode_falls_back_to_off():
+    env = dict(os.environ, SQL_COST_GUARD="strict")
+    result = subprocess.run(
+        [sys.executable, "-c", "from services import query_plan; print(query_plan.SQL_COST_GUARD)"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env,
+        capture_output=True, text=True, check=True,
+    )
+    assert result.stdout.strip() == "off" and "SQL_COST_GUARD" in result.stderr
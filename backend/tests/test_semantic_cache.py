@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from services.semantic_cache import SemanticSQLCache
+
+SQL = "SELECT full_name FROM employees WHERE city = 'Berlin'"
+
+
+@pytest.fixture
+def cache():
+    cache = SemanticSQLCache(threshold=0.9, max_entries=3)
+    # Every question embeds identically, so only the guard can tell them apart
+    cache.store("fp", "Show me all employees in Berlin", np.ones(8), SQL)
+    return cache
+
+
+@pytest.mark.parametrize("question", [
+    "list the employees in berlin",
+    "Which employees are in Berlin?",
+    "employee in Berlin",
+])
+def test_paraphrase_reuses_sql(cache, question):
+    assert cache.lookup("fp", question, np.ones(8))["sql"] == SQL
+
+
+@pytest.mark.parametrize("question", [
+    "Show me all employees in Paris",
+    "Show me all employees in 'Berlin Mitte'",
+    "Show me all managers in Berlin",
+    "Show me 5 employees in Berlin",
+])
+def test_different_value_misses(cache, question):
+    assert cache.lookup("fp", question, np.ones(8)) is None
+
+
+def test_numbers_and_companies_must_match():
+    cache = SemanticSQLCache(threshold=0.9)
+    cache.store("fp", "top 5 earners hired by Acme", np.ones(8), "SELECT 1")
+    assert cache.lookup("fp", "top 10 earners hired by Acme", np.ones(8)) is None
+    assert cache.lookup("fp", "top 5 earners hired by Globex", np.ones(8)) is None
+    assert cache.lookup("fp", "show the top 5 earners hired by acme", np.ones(8))["sql"] == "SELECT 1"
+
+
+def test_below_threshold_or_other_schema_misses(cache):
+    assert cache.lookup("fp", "list the employees in berlin", np.eye(8)[0]) is None
+    assert cache.lookup("other-fp", "list the employees in berlin", np.ones(8)) is None
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    for i in range(3):
+        cache.store("fp", f"question {i}", np.ones(8), "SELECT 1")
+    assert cache.stats()["entries"] == 3 and cache.stats()["evictions"] == 1
+    assert cache.lookup("fp", "list the employees in berlin", np.ones(8)) is None
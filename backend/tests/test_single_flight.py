@@ -0,0 +1,60 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services.single_flight import SingleFlight
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def test_concurrent_calls_for_a_key_share_one_execution():
+    flight, release, calls = SingleFlight(), threading.Event(), []
+
+    def answer():
+        calls.append(1)
+        release.wait(5)
+        return {"answer": 42}
+
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(flight.do, "top earners", answer) for _ in range(4)]
+        wait_for(lambda: flight.stats()["coalesced"] == 3)
+        release.set()
+        outcomes = [f.result() for f in futures]
+
+    assert len(calls) == 1
+    assert all(result == {"answer": 42} for result, _shared in outcomes)
+    assert sorted(shared for _result, shared in outcomes) == [False, True, True, True]
+    assert flight.stats() == {"in_flight": 0, "executions": 1, "coalesced": 3,
+                              "coalesced_ratio": 0.75, "max_waiters": 3}
+
+
+def test_waiters_receive_the_leaders_error():
+    flight, release = SingleFlight(), threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise ValueError("database is down")
+
+    with ThreadPoolExecutor(2) as pool:
+        futures = [pool.submit(flight.do, "q", fail) for _ in range(2)]
+        wait_for(lambda: flight.stats()["coalesced"] == 1)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError, match="database is down"):
+                future.result()
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_different_keys_and_later_calls_run_again():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == (1, False)
+    assert flight.do("b", lambda: 2) == (2, False)
+    assert flight.do("a", lambda: 3) == (3, False)  # nothing is remembered after a call finishes
+    assert flight.stats()["executions"] == 3 and flight.stats()["coalesced_ratio"] == 0.0
@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from services import sql_executor
+from services.sql_executor import SQLExecutor, create_pooled_engine
+
+SLOW_SQL = ("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+            "SELECT COUNT(*) FROM n")
+
+
+@pytest.fixture
+def executor(tmp_path):
+    executor = SQLExecutor(create_pooled_engine(f"sqlite:///{tmp_path / 'exec.db'}"), max_concurrent=1)
+    yield executor
+    executor.shutdown()
+
+
+class RecordingConnection:
+    """Stands in for a SQLAlchemy connection; fails the statements matching ``fail``."""
+
+    def __init__(self, fail=None):
+        self.statements = []
+        self.fail = fail
+        self.invalidated = False
+
+    def execute(self, statement):
+        self.statements.append(str(statement))
+        if self.fail and self.fail in str(statement):
+            raise OperationalError(str(statement), {}, Exception("lost connection"))
+
+    def invalidate(self):
+        self.invalidated = True
+
+
+def mysql_executor(dialect="mysql"):
+    executor = SQLExecutor.__new__(SQLExecutor)
+    executor.engine = SimpleNamespace(dialect=SimpleNamespace(name=dialect), url="mysql+pymysql://u:p@db/hr")
+    return executor
+
+
+def test_slow_statement_is_stopped_and_the_connection_reused(executor):
+    result = executor.execute(SLOW_SQL, timeout=0.2)
+    assert "timed out" in result["error"] and executor.stats()["timeouts"] == 1
+    assert executor.execute("SELECT 1 + 1")["rows"] == [(2,)]
+
+
+def test_caller_without_a_slot_is_rejected(executor):
+    stream = executor.stream("SELECT 1")
+    next(stream)  # holds the only slot until the stream is closed
+    assert "Too many concurrent queries" in executor.execute("SELECT 1", timeout=0.1)["error"]
+    stream.close()
+    assert executor.execute("SELECT 1")["rows"] == [(1,)]
+    assert executor.stats()["rejected"] == 1 and executor.stats()["in_flight"] == 0
+
+
+@pytest.mark.parametrize("dialect, expected", [
+    ("mysql", ["SET SESSION max_execution_time = 1500", "SELECT 1", "SET SESSION max_execution_time = DEFAULT"]),
+    ("mariadb", ["SET SESSION max_statement_time = 1.5", "SELECT 1", "SET SESSION max_statement_time = DEFAULT"]),
+])
+def test_mysql_session_timeout_is_reset_before_the_connection_is_returned(dialect, expected):
+    conn = RecordingConnection()
+    with pytest.raises(RuntimeError):
+        with mysql_executor(dialect)._statement_timeout(conn, 1.5):
+            conn.execute("SELECT 1")
+            raise RuntimeError("statement failed")
+    assert conn.statements == expected and not conn.invalidated
+
+
+def test_connection_is_discarded_when_the_reset_fails():
+    conn = RecordingConnection(fail="DEFAULT")
+    with mysql_executor()._statement_timeout(conn, 1):
+        pass
+    assert conn.invalidated
+
+
+def test_mysql_cancel_uses_a_connection_outside_the_pool(monkeypatch):
+    engines = []
+
+    class KillEngine(RecordingConnection):
+        def __init__(self, url, poolclass=None):
+            super().__init__()
+            self.url, self.poolclass, self.disposed = url, poolclass, False
+            engines.append(self)
+
+        def connect(self):
+            return self
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def dispose(self):
+            self.disposed = True
+
+    monkeypatch.setattr(sql_executor, "create_engine", KillEngine)
+    state = {"dbapi_connection": SimpleNamespace(thread_id=lambda: 42)}
+    mysql_executor()._cancel(state)
+    assert state["cancelled"] and len(engines) == 1
+    assert engines[0].poolclass is sql_executor.NullPool and engines[0].disposed
+    assert engines[0].statements == ["KILL QUERY 42"]
@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+
+from services import document_processor
+from services.document_processor import DocumentProcessor
+
+
+@pytest.fixture
+def store_dir(tmp_path, hash_embedder):
+    return str(tmp_path / "store")
+
+
+def texts(processor):
+    return sorted(processor.chunk_store.text(i) for i in range(len(processor.chunk_store))
+                  if i not in processor.chunk_store.deleted)
+
+
+def generations(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("gen-"))
+
+
+def test_saved_generation_is_memory_mapped_on_load(store_dir):
+    writer = DocumentProcessor(store_dir)
+    writer.upsert_document("a.txt", b"alpha notes")
+    writer.upsert_document("b.txt", b"beta notes")
+    writer.delete_document("b.txt")
+    writer.persist()
+
+    reader = DocumentProcessor(store_dir, read_only=True)
+    assert texts(reader) == ["alpha notes"]
+    assert isinstance(reader.chunk_store._base.text, np.memmap)
+    assert reader.chunk_store.deleted == writer.chunk_store.deleted
+    assert reader.vector_index.live_count == 1
+
+
+def test_appends_after_a_mapped_load_are_kept_in_the_next_generation(store_dir):
+    writer = DocumentProcessor(store_dir)
+    writer.upsert_document("a.txt", b"alpha notes")
+    writer.persist()
+
+    reopened = DocumentProcessor(store_dir)
+    reopened.upsert_document("c.txt", b"gamma notes")
+    reopened.persist()
+    reopened.upsert_document("d.txt", b"delta notes")
+    reopened.persist()
+    assert len(generations(store_dir)) == 2  # older generations are pruned
+    assert texts(DocumentProcessor(store_dir)) == ["alpha notes", "delta notes", "gamma notes"]
+
+
+def test_read_only_worker_refreshes_to_the_newest_generation(store_dir, monkeypatch):
+    monkeypatch.setattr(document_processor, "DOCUMENT_STORE_REFRESH_SECONDS", 0)
+    writer = DocumentProcessor(store_dir)
+    writer.upsert_document("a.txt", b"alpha notes")
+    writer.persist()
+    reader = DocumentProcessor(store_dir, read_only=True)
+
+    writer.upsert_document("b.txt", b"beta notes")
+    writer.persist()
+    reader.refresh()
+    assert texts(reader) == ["alpha notes", "beta notes"]
+    with pytest.raises(PermissionError):
+        reader.upsert_document("c.txt", b"gamma notes")
+
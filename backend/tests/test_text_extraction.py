@@ -0,0 +1,61 @@
+import queue
+
+import pytest
+
+from services.text_extraction import (
+    count_tokens, dynamic_chunking, extract_chunks_to_queue, iter_chunks, iter_txt_blocks, stream_chunks,
+)
+
+SENTENCES = " ".join(f"Sentence number {i} has a few words." for i in range(40))
+
+
+@pytest.mark.parametrize("max_tokens, overlap", [(30, 10), (50, 0), (12, 40)])
+def test_no_chunk_exceeds_the_token_budget(max_tokens, overlap):
+    chunks = dynamic_chunking(SENTENCES, max_tokens, overlap)
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= max_tokens for chunk in chunks)
+
+
+def test_each_chunk_starts_with_the_tail_of_the_previous_one():
+    chunks = dynamic_chunking(SENTENCES, max_tokens=30, overlap=10)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        last_sentence = previous.rsplit(". ", 1)[-1]
+        assert chunk.startswith(last_sentence)
+    assert "Sentence number 39" in chunks[-1]
+
+
+def test_without_overlap_every_sentence_appears_once():
+    chunks = dynamic_chunking(SENTENCES, max_tokens=30, overlap=0)
+    assert " ".join(chunks) == SENTENCES
+
+
+def test_oversized_sentences_and_words_are_split():
+    run_on = " ".join(f"word{i}" for i in range(100))
+    chunks = dynamic_chunking(run_on, max_tokens=20, overlap=5)
+    assert all(count_tokens(chunk) <= 20 for chunk in chunks)
+    assert chunks[0].startswith("word0") and chunks[-1].endswith("word99")
+
+
+def test_paragraphs_split_across_pieces_are_chunked_lazily():
+    pieces = iter(["First paragraph.\n\nSecond paragraph.", "Third paragraph."])
+    chunks = stream_chunks(pieces, max_tokens=100)
+    assert next(chunks) == "First paragraph.\n\nSecond paragraph.\n\nThird paragraph."
+    assert list(chunks) == []
+
+
+def test_txt_blocks_keep_paragraphs_and_multibyte_characters_whole():
+    text = "\n\n".join(f"Paragraph {i}: naïve café — ünïcödé" for i in range(50))
+    blocks = list(iter_txt_blocks(text.encode("utf-8"), block_size=37))
+    assert "\n\n".join(blocks) == text
+    assert all(block.startswith("Paragraph") for block in blocks)
+
+
+def test_chunks_are_queued_in_batches_and_then_none():
+    content = "\n\n".join(" ".join(f"w{p}x{i}" for i in range(150)) for p in range(5)).encode()
+    out = queue.Queue()
+    assert extract_chunks_to_queue("notes.txt", content, out, batch_size=2) >= 0
+    batches = [out.get_nowait() for _ in range(out.qsize())]
+    assert batches[-1] is None
+    assert all(1 <= len(batch) <= 2 for batch in batches[:-1])
+    assert [chunk for batch in batches[:-1] for chunk in batch] == list(iter_chunks("notes.txt", content))
+    assert len(batches) > 2
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from services import vector_index
+from services.vector_index import VectorIndex
+
+DIM = 16
+
+
+def vectors(n, seed=0):
+    return np.random.default_rng(seed).random((n, DIM), dtype="float32")
+
+
+def build(index_type, n=200):
+    index = VectorIndex(DIM, index_type, nlist=4, train_min_points=64)
+    data = vectors(n)
+    index.add(data, np.arange(n, dtype="int64"))
+    return index, data
+
+
+def found(index, query, k=10, **kwargs):
+    _, ids = index.search(query[None, :], k, **kwargs)
+    return [int(i) for i in ids[0] if i >= 0]
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "hnsw"])
+def test_removed_vectors_are_never_returned(index_type):
+    index, data = build(index_type)
+    assert found(index, data[7], nprobe=4)[0] == 7
+    assert index.remove([7, 8, 9999]) == 2
+    assert index.live_count == 198
+    assert not {7, 8} & set(found(index, data[7], k=50, nprobe=4))
+
+
+def test_ivf_trains_once_enough_vectors_arrive():
+    index = VectorIndex(DIM, "ivf_flat", nlist=4, train_min_points=64)
+    index.add(vectors(32), np.arange(32, dtype="int64"))
+    assert not index.is_trained
+    index.add(vectors(64, seed=1), np.arange(32, 96, dtype="int64"))
+    assert index.is_trained and index.ntotal == 96
+
+
+def test_ivf_pq_waits_for_enough_points_for_its_codebooks():
+    index = VectorIndex(DIM, "ivf_pq", nlist=4, train_min_points=20)
+    assert index.train_min_points == 2 ** vector_index.PQ_NBITS
+    index.add(vectors(100), np.arange(100, dtype="int64"))
+    assert not index.is_trained
+    index.add(vectors(200, seed=1), np.arange(100, 300, dtype="int64"))
+    assert index.is_trained and index.ntotal == 300
+
+
+def test_failed_training_keeps_the_vectors_staged():
+    index = VectorIndex(DIM, "ivf_pq", nlist=4)
+    index.train_min_points = 20  # below the 256 PQ codebook entries: FAISS refuses to train
+    data = vectors(32)
+    index.add(data, np.arange(32, dtype="int64"))
+    assert not index.is_trained and index.ntotal == 32 and index.train_min_points == 64
+    assert found(index, data[5])[0] == 5
+
+
+def test_hnsw_keeps_tombstones_until_the_ratio_then_rebuilds(monkeypatch):
+    monkeypatch.setattr(vector_index, "HNSW_MAX_TOMBSTONE_RATIO", 0.1)
+    index, data = build("hnsw", n=100)
+    index.remove(range(5))
+    assert index.tombstones == set(range(5)) and index.ntotal == 100
+    index.remove(range(5, 15))
+    assert index.tombstones == set() and index.ntotal == 85
+    assert found(index, data[50])[0] == 50
+
+
+def test_wrap_restores_hnsw_tombstones():
+    index, data = build("hnsw", n=50)
+    restored = VectorIndex.wrap(index.index, "hnsw", deleted_ids=[3])
+    assert restored.tombstones == {3}
+    assert 3 not in found(restored, data[3])
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "hnsw"])
+@pytest.mark.parametrize("exact_max", [0, 1000])
+def test_search_is_restricted_to_candidate_ids(monkeypatch, index_type, exact_max):
+    # exact_max 0 forces the FAISS ID selector, 1000 the exact comparison
+    monkeypatch.setattr(vector_index, "FILTER_EXACT_MAX_CANDIDATES", exact_max)
+    index, data = build(index_type)
+    index.remove([20])
+    candidates = np.array([10, 20, 30, 40], dtype="int64")
+    assert found(index, data[10], k=3, ids=candidates, nprobe=4, ef_search=200)[:1] == [10]
+    assert set(found(index, data[10], k=10, ids=candidates, nprobe=4, ef_search=200)) <= {10, 30, 40}
+    assert found(index, data[10], ids=np.empty(0, dtype="int64")) == []
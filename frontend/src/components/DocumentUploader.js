@@ -3,6 +3,20 @@ import { useDropzone } from 'react-dropzone';
 import apiClient from '../apiClient';
 import Spinner from './common/spinner';
 
+const POLL_INTERVAL_MS = 1000;
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+// Uploads return a job id at once; ingestion runs in the background
+const waitForIngestionJob = async (jobId, onProgress) => {
+  for (;;) {
+    const { data: job } = await apiClient.get(`/api/ingestion/jobs/${jobId}`);
+    if (!['queued', 'running'].includes(job.status)) return job;
+    onProgress(job);
+    await sleep(POLL_INTERVAL_MS);
+  }
+};
+
 const DocumentUploader = ({ setUploadStatus }) => {
   const [isLoading, setIsLoading] = useState(false);
 
@@ -21,8 +35,16 @@ const DocumentUploader = ({ setUploadStatus }) => {
       const response = await apiClient.post('/api/upload-documents', formData, {
         headers: { 'Content-Type': 'multipart/form-data' },
       });
-      const { total_documents_processed, total_chunks_indexed } = response.data;
-      setUploadStatus({ message: `Success! Processed ${total_documents_processed} file(s) and indexed ${total_chunks_indexed} chunks.`, type: 'success' });
+      const job = await waitForIngestionJob(response.data.job_id, (progress) => {
+        setUploadStatus({ message: `Processing... ${progress.files_done}/${progress.files_total} file(s), ${progress.chunks_indexed} chunks indexed.`, type: null });
+      });
+      const indexedFiles = job.files.filter(f => f.status === 'indexed').length;
+      if (job.status === 'failed') {
+        setUploadStatus({ message: `Ingestion failed: ${job.errors.join('; ')}`, type: 'error' });
+      } else {
+        const warnings = job.errors.length ? ` (${job.errors.length} file(s) skipped)` : '';
+        setUploadStatus({ message: `Success! Processed ${indexedFiles} file(s) and indexed ${job.total_chunks_indexed} chunks${warnings}.`, type: 'success' });
+      }
     } catch (error) {
       const errorMessage = error.response?.data?.detail || 'File upload failed.';
       setUploadStatus({ message: errorMessage, type: 'error' });
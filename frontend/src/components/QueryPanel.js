@@ -16,7 +16,7 @@ const QueryPanel = ({ setResults, setIsLoading, setQueryError }) => {
     setQueryError(null);
 
     try {
-      const response = await apiClient.post('/api/query', { query });
+      const response = await apiClient.post('/api/query', { query, result_format: 'columns' });
       setResults(response.data);
     } catch (error) {
       const errorMessage = error.response?.data?.detail || 'An error occurred while processing the query.';
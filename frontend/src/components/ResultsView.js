@@ -37,6 +37,10 @@ const ResultsView = ({ results, isLoading, queryError }) => {
   };
 
   const { sql_result, document_result, query_type, _cache_hit } = results;
+  // "columns" layout: names once plus row arrays; "rows" layout: one object per row
+  const sqlColumns = sql_result?.columns
+    || (sql_result?.rows?.length ? Object.keys(sql_result.rows[0]) : []);
+  const sqlRows = (sql_result?.rows || []).map(row => (Array.isArray(row) ? row : Object.values(row)));
 
   return (
     <div className="space-y-8">
@@ -52,20 +56,20 @@ const ResultsView = ({ results, isLoading, queryError }) => {
       {sql_result && sql_result.rows && (
         <div>
           <h3 className="text-xl font-semibold mb-3 text-gray-800">Database Results</h3>
-          {sql_result.rows.length > 0 ? (
+          {sqlRows.length > 0 ? (
             <div className="overflow-x-auto rounded-lg border">
               <table className="min-w-full divide-y divide-gray-200">
                 <thead className="bg-gray-50">
                   <tr>
-                    {Object.keys(sql_result.rows[0]).map(key => (
+                    {sqlColumns.map(key => (
                       <th key={key} className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">{key}</th>
                     ))}
                   </tr>
                 </thead>
                 <tbody className="bg-white divide-y divide-gray-200">
-                  {sql_result.rows.map((row, i) => (
+                  {sqlRows.map((row, i) => (
                     <tr key={i}>
-                      {Object.values(row).map((val, j) => (
+                      {row.map((val, j) => (
                         <td key={j} className="px-6 py-4 whitespace-nowrap text-sm text-gray-700">{renderCell(val)}</td>
                       ))}
                     </tr>